@@ -0,0 +1,90 @@
+"""Summarize or plot a structure size time series recorded by
+incoq.runtime.SizeSampler.
+
+    python -m experiments.sizeplot FILE [--plot] [--bytes] [--top N]
+"""
+
+
+import argparse
+
+from incoq.runtime import read_size_samples
+
+
+def get_series(samples, use_bytes=False):
+    """Return the list of sample times and a map from each structure
+    name to its list of values, with None where the structure did not
+    exist at that time.
+    """
+    times = [t for t, _, _ in samples]
+    names = []
+    for _, sizes, _ in samples:
+        for name in sizes:
+            if name not in names:
+                names.append(name)
+    series = {name: [] for name in names}
+    for _, sizes, nbytes in samples:
+        values = nbytes if use_bytes else sizes
+        if values is None:
+            raise ValueError('File does not contain byte sizes')
+        for name in names:
+            series[name].append(values.get(name))
+    return times, series
+
+def summarize(samples, use_bytes=False, top=None):
+    """Print the final, peak, and initial value of each structure,
+    largest final value first.
+    """
+    times, series = get_series(samples, use_bytes)
+    def last(vals):
+        return next((v for v in reversed(vals) if v is not None), 0)
+    names = sorted(series, key=lambda n: last(series[n]), reverse=True)
+    if top is not None:
+        names = names[:top]
+    
+    print('{} samples over {:.2f} s'.format(
+          len(times), times[-1] - times[0] if times else 0))
+    width = max([len(n) for n in names] + [9])
+    print('{:<{w}}  {:>12}  {:>12}  {:>12}'.format(
+          'structure', 'first', 'peak', 'final', w=width))
+    for name in names:
+        vals = [v for v in series[name] if v is not None]
+        print('{:<{w}}  {:>12}  {:>12}  {:>12}'.format(
+              name, vals[0], max(vals), vals[-1], w=width))
+
+def plot(samples, use_bytes=False, top=None):
+    """Plot each structure's value over time."""
+    import matplotlib.pyplot as plt
+    times, series = get_series(samples, use_bytes)
+    names = sorted(series, key=lambda n: max(v or 0 for v in series[n]),
+                   reverse=True)
+    if top is not None:
+        names = names[:top]
+    for name in names:
+        plt.plot(times, series[name], '-', label=name)
+    plt.xlabel('Time (s)')
+    plt.ylabel('Bytes' if use_bytes else 'Structure size')
+    plt.legend(loc='upper left')
+    plt.gca().set_ylim(bottom=0)
+    plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='sizeplot.py')
+    parser.add_argument('filename')
+    parser.add_argument('--plot', action='store_true')
+    parser.add_argument('--bytes', action='store_true',
+                        help='use deep byte sizes instead of '
+                             'structure sizes')
+    parser.add_argument('--top', type=int, default=None,
+                        help='only show the N largest structures')
+    ns = parser.parse_args()
+    
+    samples = read_size_samples(ns.filename)
+    if ns.plot:
+        plot(samples, ns.bytes, ns.top)
+    else:
+        summarize(samples, ns.bytes, ns.top)
+
+
+if __name__ == '__main__':
+    main()
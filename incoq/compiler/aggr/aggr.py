@@ -59,6 +59,7 @@ from abc import ABCMeta, abstractmethod
 from simplestruct import Struct, Field, TypedField
 from simplestruct.type import checktype
 
+from incoq.util.faststruct import fast_struct
 import incoq.compiler.incast as L
 from incoq.compiler.set import Mask
 
@@ -69,6 +70,7 @@ def is_aggrrel(rel):
     return rel.startswith(AGGR_PREFIX)
 
 
+@fast_struct
 class AggrSpec(Struct):
     
     """Aggregate query specification."""
@@ -157,6 +159,7 @@ class AggrSpec(Struct):
         return constrs
 
 
+@fast_struct
 class IncAggr(Struct):
     
     """Info for incrementalizing an aggregate query."""
@@ -175,6 +178,10 @@ class IncAggr(Struct):
     """If using demand and this is True, use the "half-demand"
     strategy.
     """
+    deltalog = Field(default=None)
+    """None or the capacity of the result's delta log."""
+    lazy_maint = Field(default=None)
+    """None, or the buffer limit if using deferred maintenance."""
     
     @property
     def has_demand(self):
@@ -188,7 +195,8 @@ class IncAggr(Struct):
         # so counts aren't needed.
         return not (self.has_demand and not self.half_demand)
     
-    def __init__(self, aggr, spec, name, demname, uset_lru, half_demand):
+    def __init__(self, aggr, spec, name, demname, uset_lru, half_demand,
+                 deltalog=None, lazy_maint=None):
         self.params = params = tuple(spec.params)
         """Aggregate parameters (same as operand parameters).
         Also same as aggregate demand parameters.
@@ -442,13 +450,17 @@ class AggrCodegen(metaclass=ABCMeta):
         incaggr = self.incaggr
         
         params_l = L.List(tuple(L.ln(p) for p in incaggr.params), L.Load())
+        params_t = L.tuplify(incaggr.params)
+        if incaggr.lazy_maint is not None:
+            maker = L.DeferMaker(incaggr.name)
+            params_t = maker.make_flushed(params_t)
         
         if incaggr.has_demand:
             code = L.pe('''
                 DEMQUERY(NAME, PARAMS_L, RES.smlookup(AGGRMASK, PARAMS_T))
                 ''', subst={'NAME': incaggr.name,
                             'PARAMS_L': params_l,
-                            'PARAMS_T': L.tuplify(incaggr.params),
+                            'PARAMS_T': params_t,
                             'RES': incaggr.name,
                             'AGGRMASK': incaggr.aggrmask.make_node()})
         
@@ -457,7 +469,7 @@ class AggrCodegen(metaclass=ABCMeta):
                 RES.smdeflookup(AGGRMASK, PARAMS_T, ZERO)
                 ''', subst={'RES': incaggr.name,
                             'AGGRMASK': incaggr.aggrmask.make_node(),
-                            'PARAMS_T': L.tuplify(incaggr.params),
+                            'PARAMS_T': params_t,
                             'ZERO': self.make_zero_mapval_expr(),})
         
         code = self.make_proj_mapval_code(code)
@@ -666,18 +678,26 @@ class AggrMaintainer(L.NodeTransformer):
         
         add_prefix = self.manager.namegen.next_prefix()
         remove_prefix = self.manager.namegen.next_prefix()
-        addcode = self.cg.make_oper_maint(add_prefix, 'add', L.pe('_e'))
-        removecode = self.cg.make_oper_maint(remove_prefix,
-                                             'remove', L.pe('_e'))
+        addcode = self.log(self.cg.make_oper_maint(add_prefix, 'add',
+                                                   L.pe('_e')))
+        removecode = self.log(self.cg.make_oper_maint(remove_prefix,
+                                                      'remove', L.pe('_e')))
         
         code = L.pc('''
             RES = Set()
+            ''', subst={'RES': incaggr.name})
+        if incaggr.deltalog is not None:
+            code += L.DeltaLogger.make_logvar(incaggr.name,
+                                              incaggr.deltalog)
+        if incaggr.lazy_maint is not None:
+            maker = L.DeferMaker(incaggr.name)
+            code += maker.make_init(incaggr.lazy_maint)
+        code += L.pc('''
             def ADDFUNC(_e):
                 ADDCODE
             def REMOVEFUNC(_e):
                 REMOVECODE
-            ''', subst={'RES': incaggr.name,
-                        '<def>ADDFUNC': self.addfunc,
+            ''', subst={'<def>ADDFUNC': self.addfunc,
                         '<c>ADDCODE': addcode,
                         '<def>REMOVEFUNC': self.removefunc,
                         '<c>REMOVECODE': removecode})
@@ -687,6 +707,15 @@ class AggrMaintainer(L.NodeTransformer):
         
         return node
     
+    def log(self, code):
+        """If the result has a delta log, instrument code that updates
+        the result to publish its changes.
+        """
+        if self.incaggr.deltalog is None:
+            return code
+        return L.DeltaLogger.run(code, self.incaggr.name,
+                                 self.manager.namegen.next_prefix())
+    
     def visit_SetUpdate(self, node):
         spec = self.incaggr.spec
         
@@ -696,7 +725,14 @@ class AggrMaintainer(L.NodeTransformer):
             return node
         var, op, elem = node.get_varupdate()
         
-        if var == spec.rel:
+        if var == spec.rel and self.incaggr.lazy_maint is not None:
+            maker = L.DeferMaker(self.incaggr.name)
+            func = self.addfunc if op == 'add' else self.removefunc
+            precode = maker.make_defer(var, op, elem, func)
+            code = L.Maintenance(self.incaggr.name, L.ts(node),
+                                 precode, (node,), ())
+        
+        elif var == spec.rel:
             precode = postcode = ()
             if op == 'add':
                 postcode = L.pc('ADDFUNC(ELEM)',
@@ -716,12 +752,18 @@ class AggrMaintainer(L.NodeTransformer):
             prefix = self.manager.namegen.next_prefix()
             precode = postcode = ()
             if op == 'add':
-                postcode = self.cg.make_addu_maint(prefix)
+                postcode = self.log(self.cg.make_addu_maint(prefix))
             elif op == 'remove':
-                precode = self.cg.make_removeu_maint(prefix)
+                precode = self.log(self.cg.make_removeu_maint(prefix))
             else:
                 assert()
             
+            # U-set maintenance computes from the current operand,
+            # which already reflects any deferred updates.
+            if self.incaggr.lazy_maint is not None:
+                maker = L.DeferMaker(self.incaggr.name)
+                precode = maker.make_flush() + precode
+            
             code = L.Maintenance(self.incaggr.name, L.ts(node),
                                  precode, (node,), postcode)
         
@@ -807,7 +849,16 @@ def inc_aggr(tree, manager, aggr, name,
     demname = name if demand else None
     if not demand:
         half_demand = False
-    incaggr = IncAggr(aggr, spec, name, demname, uset_lru, half_demand)
+    deltalog = manager.options.get_queryopt(aggr, 'deltalog')
+    lazy_maint = manager.options.get_queryopt(aggr, 'lazy_maint')
+    # Other queries that read the result would see it stale.
+    if (lazy_maint is not None and
+        not L.OuterQueryChecker.run(tree, aggr)):
+        if manager.options.get_opt('verbose'):
+            print('Not deferring maintenance for ' + name)
+        lazy_maint = None
+    incaggr = IncAggr(aggr, spec, name, demname, uset_lru, half_demand,
+                      deltalog, lazy_maint)
     
     tree = AggrReplacer.run(tree, manager, incaggr)
     tree = AggrMaintainer.run(tree, manager, incaggr)
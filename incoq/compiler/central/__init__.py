@@ -9,3 +9,4 @@
 # Exports.
 from .manager import *
 from .transform import *
+from .incremental import *
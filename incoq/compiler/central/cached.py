@@ -0,0 +1,185 @@
+"""Cached implementation of queries.
+
+A query with impl 'cached' is computed the same way as in batch mode,
+by a function compute_<name>(), but its results are memoized per
+combination of parameter values in a runtime QueryCache. Every update
+to one of the query's operand relations invalidates the cache, so a
+result is recomputed only if some operand changed since it was
+computed. For example,
+
+    print(sum({y for (x, y) in R if x == p}))
+
+becomes
+
+    _QC_Aggr1 = QueryCache(1000)
+    def compute_Aggr1(p):
+        return sum({y for (x, y) in R if x == p})
+    def query_Aggr1(p):
+        return _QC_Aggr1.call(compute_Aggr1, p)
+    
+    print(query_Aggr1(p))
+
+with "_QC_Aggr1.invalidate()" following each update to R. This relies
+on the same assumption as incrementalization, namely that relations
+are only updated by name.
+
+Queries that can be cached are relational comprehensions that do not
+need demand, aggregates of the forms handled by incrementalization
+(without demand), and aggregates whose operand is such a comprehension
+or a call to another cached query. A comprehension may call other
+cached queries, whose operands then count as its own, but must not
+otherwise read incrementalized results or global variables.
+"""
+
+
+__all__ = [
+    'get_cached_info',
+    'impl_cached_query',
+]
+
+
+import builtins
+
+from incoq.util.collections import OrderedSet
+import incoq.compiler.incast as L
+import incoq.runtime
+from incoq.compiler.comp import CompSpec
+from incoq.compiler.aggr import AggrSpec
+
+
+# Functions that don't read any program state.
+PURE_FUNCS = (set(dir(builtins)) - {
+    'globals', 'locals', 'vars', 'eval', 'exec', 'getattr', 'hasattr',
+    'input', 'open'}) | {
+    name for name in dir(incoq.runtime) if not name.startswith('_')}
+
+
+def get_cached_info(manager, query):
+    """Return a pair of the tuple of parameters of a query and the
+    tuple of relations its result depends on, or None if the query
+    cannot be cached.
+    """
+    if isinstance(query, L.Comp):
+        try:
+            spec = CompSpec.from_comp(query, manager.factory)
+        except TypeError:
+            return None
+        if spec.join.has_demand:
+            return None
+        
+        rels = OrderedSet(spec.join.rels)
+        localvars = set(spec.join.enumvars) | set(query.params)
+        datavars = L.VarsFinder.run(query, ignore_functions=True)
+        funcs = L.VarsFinder.run(query) - datavars
+        if datavars - localvars - rels:
+            return None
+        for func in funcs:
+            if func in manager.cached_queries:
+                rels.update(manager.cached_queries[func])
+            elif func not in PURE_FUNCS:
+                return None
+        if any(rel in manager.invariants for rel in rels):
+            return None
+        return tuple(query.params), tuple(rels)
+    
+    elif isinstance(query, L.Aggregate):
+        oper = query.value
+        if isinstance(oper, L.Comp):
+            return get_cached_info(manager, oper)
+        
+        if L.is_plaincall(oper):
+            func, args = L.get_plaincall(oper)
+            if (func in manager.cached_queries and
+                all(isinstance(a, L.Name) for a in args)):
+                return (tuple(a.id for a in args),
+                        manager.cached_queries[func])
+            return None
+        
+        try:
+            spec = AggrSpec.from_node(query)
+        except L.ProgramError:
+            return None
+        if spec.has_oper_demand or spec.rel in manager.invariants:
+            return None
+        return tuple(spec.params), (spec.rel,)
+    
+    else:
+        assert()
+
+
+class CacheInvalidator(L.OuterMaintTransformer):
+    
+    """Insert code to invalidate a query's cache after each update to
+    one of its operand relations.
+    """
+    
+    def __init__(self, name, rels):
+        super().__init__(None)
+        self.name = name
+        self.rels = set(rels)
+    
+    def visit_SetUpdate(self, node):
+        node = self.generic_visit(node)
+        
+        if not node.is_varupdate():
+            return node
+        var, _op, _elem = node.get_varupdate()
+        if var not in self.rels:
+            return node
+        
+        code = L.pc('''
+            CACHE.invalidate()
+            ''', subst={'CACHE': L.N.querycache(self.name)})
+        return self.with_outer_maint(node, self.name, L.ts(node),
+                                     (), code)
+
+
+def impl_cached_query(tree, manager, query, name):
+    """Implement a query as a batch computation with a result cache.
+    The query must be one for which get_cached_info() succeeds.
+    """
+    if manager.options.get_opt('verbose'):
+        s = ('Caching ' + name + ': ').ljust(45)
+        s += L.ts(query)
+        print(s)
+    
+    params, rels = get_cached_info(manager, query)
+    size = manager.options.get_queryopt(query, 'cache_size')
+    
+    # The copy of the query inside the compute function is left for
+    # batch evaluation.
+    new_options = dict(query.options)
+    new_options['impl'] = 'batch'
+    batch_query = query._replace(options=new_options)
+    
+    queryfunc = L.N.queryfunc(name)
+    computefunc = L.N.computefunc(name)
+    
+    cachecall = L.pe('CACHE.call(COMPUTE)',
+                     subst={'CACHE': L.ln(L.N.querycache(name)),
+                            'COMPUTE': L.ln(computefunc)})
+    cachecall = cachecall._replace(
+                    args=cachecall.args + tuple(L.ln(p) for p in params))
+    
+    code = L.pc('''
+        CACHE = QueryCache(SIZE)
+        ''', subst={'CACHE': L.N.querycache(name),
+                    'SIZE': L.Num(size)})
+    code += L.plainfuncdef(computefunc, params, L.pc('''
+        return QUERY
+        ''', subst={'QUERY': batch_query}))
+    code += L.plainfuncdef(queryfunc, params, L.pc('''
+        SPEC_STR
+        return CACHECALL
+        ''', subst={'SPEC_STR': L.Str(s=L.ts(query)),
+                    'CACHECALL': cachecall}))
+    
+    call = L.pe('QFUN(__ARGS)', subst={'QFUN': L.ln(queryfunc)})
+    call = call._replace(args=tuple(L.ln(p) for p in params))
+    
+    tree = L.QueryReplacer.run(tree, query, call)
+    tree = CacheInvalidator.run(tree, name, rels)
+    tree = tree._replace(body=code + tree.body)
+    
+    manager.cached_queries[queryfunc] = rels
+    return tree
@@ -0,0 +1,349 @@
+"""Incremental recompilation.
+
+A full transformation is global: fresh names are drawn from shared
+counters, and type analysis and dead code elimination look at the
+whole program. Re-transforming only part of a program therefore can't
+in general reproduce what a full transformation would output. Instead,
+we record the result of each full transformation, and when the input
+changes we reuse that result only if every change is confined to
+top-level functions that are provably passed through the
+transformation unchanged ("inert" functions). The new text of such
+functions is spliced into the recorded output, which yields exactly
+what a full transformation would. Any other change falls back to a
+full transformation, which is recorded for next time.
+
+Generated invariants and maintenance code are not reused per query.
+Re-running transform_query only for the queries whose dependencies
+changed would number fresh names from a different point and see a
+different program during type analysis and dead code elimination,
+so its output would not match a full transformation. A change
+outside inert functions therefore re-transforms every query.
+"""
+
+
+__all__ = [
+    'CompileRecord',
+    'transform_source_incremental',
+    'transform_file_incremental',
+]
+
+
+import os
+import pickle
+import hashlib
+
+from incoq.util.linecount import get_loc_source
+import incoq.compiler.incast as L
+import incoq.runtime
+
+from .rewritings import import_distalgo
+from .transform import transform_source
+
+
+# Node kinds that some stage of the transformation may rewrite, or
+# whose presence makes it hard to tell what a function may affect.
+# Iteration, membership tests, tuples, and attribute and subscript
+# reads are only rewritten inside queries or for relations, which
+# inert functions can't mention. Attribute and subscript stores are
+# rejected separately.
+UNSAFE_KINDS = [
+    'Comp', 'Aggregate', 'SetUpdate', 'MacroUpdate', 'RCSetRefUpdate',
+    'AssignKey', 'DelKey', 'IsEmpty', 'GetRef', 'Lookup', 'ImgLookup',
+    'RCImgLookup', 'SMLookup', 'DemQuery', 'NoDemQuery', 'SetMatch',
+    'DeltaMatch', 'Maintenance', 'NOptions', 'QOptions', 'Comment',
+    'Set', 'SetComp', 'ListComp', 'DictComp', 'GeneratorExp',
+    'Delete', 'With', 'Global', 'Nonlocal', 'Pass', 'FunctionDef',
+    'ClassDef', 'Lambda', 'Yield', 'YieldFrom',
+]
+
+# Functions that calls to may be rewritten.
+UNSAFE_CALLS = {name for name in dir(incoq.runtime)
+                if not name.startswith('_')} | {
+    'set', 'len', 'sum', 'count', 'min', 'max', 'globals',
+    'hasattr', 'getattr', 'setattr', 'delattr', 'isinstance',
+}
+
+
+class CallNameFinder(L.SkippingNodeVisitor):
+    
+    """Return the set of names of functions that are called directly.
+    If methods is True, also include the names of called methods.
+    """
+    
+    def __init__(self, methods=False):
+        super().__init__()
+        self.methods = methods
+    
+    def process(self, tree):
+        self.names = set()
+        super().process(tree)
+        return self.names
+    
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, L.Name):
+            self.names.add(node.func.id)
+        elif self.methods and isinstance(node.func, L.Attribute):
+            self.names.add(node.func.attr)
+
+
+class StoreFinder(L.NodeVisitor):
+    
+    """Return whether an attribute or subscript is assigned to or
+    deleted. These are rewritten as field and map updates.
+    """
+    
+    def process(self, tree):
+        self.found = False
+        super().process(tree)
+        return self.found
+    
+    def helper(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, L.Load):
+            self.found = True
+    
+    visit_Attribute = helper
+    visit_Subscript = helper
+
+
+_fingerprint = None
+
+def compiler_fingerprint():
+    """Return a digest of the compiler's source code, so that records
+    made by a different version of the compiler are not reused.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        root = os.path.dirname(os.path.dirname(__file__))
+        h = hashlib.sha1()
+        for dirpath, dirnames, filenames in sorted(os.walk(root)):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                if fn.endswith('.py'):
+                    path = os.path.join(dirpath, fn)
+                    h.update(os.path.relpath(path, root).encode())
+                    with open(path, 'rb') as file:
+                        h.update(file.read())
+        _fingerprint = h.hexdigest()
+    return _fingerprint
+
+def options_key(nopts, qopts):
+    """Return a hashable key identifying a choice of options."""
+    nopts = nopts or {}
+    qopts = qopts or {}
+    return (compiler_fingerprint(),
+            repr(sorted(nopts.items())),
+            repr(sorted((k, sorted(v.items())) for k, v in qopts.items())))
+
+
+def func_text(func):
+    """Return the source text of a top-level function, as it appears
+    in the unparsed program.
+    """
+    return L.ts(func).strip()
+
+def get_units(tree):
+    """Return a list of triples (name, text, node) for the top-level
+    statements of a PyAST module, where name is the function name for
+    FunctionDefs and None otherwise.
+    """
+    units = []
+    for stmt in tree.body:
+        name = stmt.name if isinstance(stmt, L.FunctionDef) else None
+        units.append((name, L.ts(stmt), stmt))
+    return units
+
+def is_inert(func, tree, funcnames):
+    """Return whether a top-level FunctionDef is guaranteed to pass
+    through the transformation of program tree unchanged, and to not
+    influence the transformation of the rest of the program.
+    funcnames is the set of names of top-level functions in tree.
+    """
+    if func.name.startswith('_'):
+        return False
+    # Importing must not change anything beyond the IncAST nodes
+    # that are checked for below.
+    mod = L.Module((func,))
+    imported = L.import_incast(mod)
+    if L.import_incast(import_distalgo(mod)) != imported:
+        return False
+    body = imported.body[0].body
+    if (func.decorator_list or L.contains_kinds(body, UNSAFE_KINDS) or
+        StoreFinder.run(body)):
+        return False
+    
+    # Qualified calls such as incoq.runtime.Set() are recognized too.
+    if CallNameFinder.run(body, methods=True) & UNSAFE_CALLS:
+        return False
+    calls = CallNameFinder.run(body)
+    allvars = L.VarsFinder.run(body)
+    if any(v.startswith('_') for v in allvars):
+        return False
+    # Variables that are only written to would be eliminated as
+    # dead code.
+    if allvars - L.VarsFinder.run(body, ignore_store=True):
+        return False
+    
+    # The function's variables must not occur anywhere else in the
+    # program, or they could affect type analysis and dead code
+    # elimination. Functions it calls, such as builtins, may occur
+    # elsewhere as long as they are only called there too.
+    localvars = L.VarsFinder.run(body, ignore_functions=True)
+    othervars = set()
+    otherdata = set()
+    for stmt in tree.body:
+        if not (isinstance(stmt, L.FunctionDef) and
+                stmt.name == func.name):
+            stmt = L.import_incast(stmt)
+            othervars.update(L.VarsFinder.run(stmt))
+            otherdata.update(L.VarsFinder.run(stmt, ignore_functions=True))
+    othervars -= funcnames
+    otherdata -= funcnames
+    if localvars & othervars or calls & otherdata:
+        return False
+    
+    return True
+
+
+class CompileRecord:
+    
+    """The result of a transformation, together with what is needed
+    to decide whether it can be reused for a changed input.
+    """
+    
+    def __init__(self, key, units, output, stats, eol, inert):
+        self.key = key
+        """Options key of the transformation."""
+        self.units = units
+        """List of (name, text) pairs for the input's top-level
+        statements.
+        """
+        self.output = output
+        """Output source text."""
+        self.stats = stats
+        """Stats dictionary of the transformation."""
+        self.eol = eol
+        """Value of the eol option."""
+        self.inert = inert
+        """Map from each inert function's name to its text, which
+        occurs exactly once in the output.
+        """
+    
+    def save(self, filename):
+        with open(filename, 'wb') as file:
+            pickle.dump(self, file)
+    
+    @classmethod
+    def load(cls, filename):
+        """Load a record, or return None if there is no usable one."""
+        try:
+            with open(filename, 'rb') as file:
+                record = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError):
+            return None
+        return record if isinstance(record, cls) else None
+
+
+def make_record(key, tree, output, manager):
+    """Build a record for a full transformation of tree."""
+    units = get_units(tree)
+    funcnames = {name for name, _, _ in units if name is not None}
+    inert = {}
+    if not manager.options.get_opt('analyze_costs'):
+        for name, _, node in units:
+            if name is None or not is_inert(node, tree, funcnames):
+                continue
+            text = func_text(node)
+            if output.count(text) == 1:
+                inert[name] = text
+    return CompileRecord(key, [(name, text) for name, text, _ in units],
+                         output, manager.stats,
+                         manager.options.get_opt('eol'), inert)
+
+def try_splice(record, tree, units):
+    """Return the output for tree obtained by splicing changed inert
+    functions into the recorded output, or None if this is not
+    possible.
+    """
+    if len(units) != len(record.units):
+        return None
+    funcnames = {name for name, _, _ in units if name is not None}
+    output = record.output
+    for (name, text, node), (old_name, old_text) in \
+            zip(units, record.units):
+        if name != old_name:
+            return None
+        if text == old_text:
+            continue
+        if name is None or name not in record.inert:
+            return None
+        if not is_inert(node, tree, funcnames):
+            return None
+        old_func = record.inert[name]
+        new_func = func_text(node)
+        if output.count(old_func) != 1:
+            return None
+        output = output.replace(old_func, new_func)
+    return output
+
+def transform_source_incremental(source, record=None, *,
+                                 nopts=None, qopts=None):
+    """Like transform_source, but reuse the previous result given by
+    record where possible. Return a triple of the output source, the
+    stats dictionary, and the record to use for the next call.
+    
+    The stats entry 'incremental' is 'reused' if the input was
+    unchanged, 'spliced' if only inert functions were changed, and
+    'full' otherwise.
+    """
+    key = options_key(nopts, qopts)
+    tree = L.p(source)
+    units = get_units(tree)
+    
+    if record is not None and record.key == key:
+        output = try_splice(record, tree, units)
+        if output is not None:
+            stats = dict(record.stats)
+            if output == record.output:
+                stats['incremental'] = 'reused'
+            else:
+                stats['incremental'] = 'spliced'
+                stats['lines'] = get_loc_source(output)
+            # Spliced functions were checked to be inert, and the
+            # others are unchanged.
+            inert = {}
+            for name, _, node in units:
+                if name in record.inert:
+                    text = func_text(node)
+                    if output.count(text) == 1:
+                        inert[name] = text
+            record = CompileRecord(
+                        key, [(name, text) for name, text, _ in units],
+                        output, stats, record.eol, inert)
+            return output, stats, record
+    
+    output, manager = transform_source(source, nopts=nopts, qopts=qopts)
+    manager.stats['incremental'] = 'full'
+    record = make_record(key, tree, output, manager)
+    return output, manager.stats, record
+
+def transform_file_incremental(in_filename, out_filename, record_filename,
+                               *, nopts=None, qopts=None):
+    """Like transform_file, but keep a compile record in
+    record_filename between runs, as for transform_source_incremental.
+    """
+    with open(in_filename, 'r') as in_file:
+        in_source = in_file.read()
+    
+    record = CompileRecord.load(record_filename)
+    out_source, stats, record = transform_source_incremental(
+                in_source, record, nopts=nopts, qopts=qopts)
+    
+    eol = {'lf': '\n', 'crlf': '\r\n', 'native': None}[record.eol]
+    with open(out_filename, 'w', newline=eol) as out_file:
+        out_file.write(out_source)
+    
+    record.save(record_filename)
+    return stats
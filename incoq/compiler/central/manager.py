@@ -114,9 +114,13 @@ class Manager:
             
             'dem structs': 0,       # number of tags/filters/inner-usets
                                     # created for filtered comps
+            'shared dem structs': 0,# number of tags/filters reused from
+                                    # earlier filtered comps
             
             'comps expanded': 0,    # number of comps expanded as batch + maps 
             
+            'cached queries': 0,    # number of queries given a result cache
+            
             'auxmaps': 0,           # number of auxmaps created
             
             'queries processed': 0, # number of queries considered for
@@ -127,6 +131,18 @@ class Manager:
                                     # satisfying syntactic requirements
                                     # for transformation
             
+            'template hits': 0,     # number of template parses answered
+                                    # from L.parse_cache
+            'template misses': 0,   # number of template parses that ran
+                                    # the Python parser
+            'template hit rate': 0, # hits / (hits + misses)
+            
+            'stages': [],           # list of (stage name, time, nodes before,
+                                    # nodes after) for each transformation
+                                    # stage, in order
+            'query times': [],      # list of (query name, impl, time) for
+                                    # each incrementalized query
+            
             # The following are used for exporting transformation data
             # for later analysis.
             'costs': {},            # dictionary mapping from function name to
@@ -152,6 +168,21 @@ class Manager:
         
         self.invariants = {}
         """Map from name to IncComp/IncAggr object."""
+        
+        self.shared_structs = {}
+        """Map from keys to SharedStructs, describing the tags and
+        filters that later queries may reuse (see demand/tags.py).
+        """
+        
+        self.cached_queries = {}
+        """Map from the query function name of each query implemented
+        with a result cache to the relations its result depends on.
+        """
+        
+        self.orderer = None
+        """Join orderer to use when generating code for joins, or None
+        for a fresh AsymptoticOrderer each time.
+        """
     
     def add_macros(self, seq):
         """Register a sequence of ContextMacros, and update their
@@ -34,6 +34,11 @@ class DefaultNormalOptions:
     """If False, the output program is left in the pair domain
     instead of being converted back to the object domain.
     """
+    obj_containers =        False
+    """If True, the map from each set element to the sets containing
+    it is kept in the elements themselves where possible, in a slot
+    of the runtime Obj class, instead of in a global auxiliary map.
+    """
     
     input_rels =            []
     """List of names of sets in the input program that are relations
@@ -66,7 +71,7 @@ class DefaultNormalOptions:
     
     default_impl =          'batch'
     """Default implementation for queries. One of 'batch', 'auxonly',
-    'inc', or 'dem'. 
+    'inc', 'dem', or 'cached'. 
     """
     
     default_uset_lru =      None
@@ -108,6 +113,13 @@ class DefaultNormalOptions:
     """If True, guard maintenance comprehensions with a demand check."""
     single_tag =            False
     """If True, each query variable only gets one tag."""
+    share_dem_structs =     False
+    """If True, a tag or filter that is defined the same way, up to
+    renaming of variables, as one made for an earlier query reuses
+    that one instead of being maintained separately. Tags over the
+    U-sets of different queries are shared by counting how many
+    U-sets demand each value.
+    """
     subdem_tags =           True
     """If True, subquery demand invariants are defined based on tags
     for its demand parameters in the outer query. Otherwise, define
@@ -116,6 +128,16 @@ class DefaultNormalOptions:
     """
     rc_elim =               True
     """If True, eliminate reference counts where possible."""
+    fuse_results =          False
+    """If True, keep the result of a parameterized comprehension that
+    is only read by retrieval as a map from parameters to image sets,
+    instead of as a flat set plus an auxiliary map over it.
+    """
+    change_maint =          False
+    """If True, maintain a field reassignment "del o.f; o.f = v" as a
+    single change to a comprehension's result, touching only entries
+    whose value differs, rather than as a removal and an addition.
+    """
     deadcode_elim =         True
     """If False, do not run deadcode elimination."""
     deadcode_keepvars =     []
@@ -125,6 +147,12 @@ class DefaultNormalOptions:
     """Dictionary mapping from relation_mask identifiers to a numerical
     join heuristic ranking. See incoq/compiler/comp/order.py.
     """
+    share_auxmaps =         False
+    """If True, choose among equally good join orders so that queries
+    share auxiliary maps, reducing the number of maps that updates
+    must maintain. See IndexSharingOrderer in
+    incoq/compiler/comp/order.py.
+    """
     
     maint_inline =          False
     """If True, maintenance code is inlined."""
@@ -140,6 +168,21 @@ class DefaultNormalOptions:
     obj_types =             {}
     """Mapping from names of object types to dictionaries that map
     from attribute name to attribute types (expressed as strings, as above).
+    Each object type gets a generated subclass of ObjBase whose
+    __slots__ are its attributes, and "v = Obj()" is rewritten to use
+    that class when the attributes subsequently assigned to v identify
+    the type.
+    """
+    
+    columnar_rels =         []
+    """List of names of relations to store column-wise, as ColumnSets.
+    Each must be an input or flattened relation, initialized at top
+    level by "R = Set()", whose elements are all tuples of the same
+    arity. This saves memory for large flat relations, and speeds up
+    matching against them in auxonly and batch mode. Batch aggregates
+    of setmatches over these relations are computed by
+    ColumnSet.aggregate(), which keeps a per-key index and cache up to
+    date across updates.
     """
     
     rewrite_costsastypes =  True
@@ -182,6 +225,13 @@ class DefaultQueryOptions:
                      incremental auxiliary maps for comprehensions
         'inc':       incremental computation
         'dem':       demand-filtered incremental computation
+        'cached':    batch computation, with results memoized per
+                     combination of parameter values until an
+                     operand relation is updated
+    """
+    cache_size =            1000
+    """For impl 'cached', the number of parameter combinations whose
+    results are kept (0 for no limit).
     """
     aggr_halfdemand =       None
     """If True, aggregate queries using demand will use the
@@ -207,6 +257,23 @@ class DefaultQueryOptions:
     tag and filter dependencies (demand graph). This is a hack that
     doesn't treat the U-set differently from any other clause.
     """
+    lazy_maint =            None
+    """If not None, defer this query's maintenance. Updates to its
+    operands are buffered, an addition and removal of the same element
+    cancel each other out, and the remaining updates are maintained in
+    one pass when the result is next read, when an update to a
+    different operand arrives, or when this many updates are buffered
+    (0 for no limit). Only applies when the query is incrementalized.
+    It is ignored for comprehensions with self-joins or demand-driven
+    subqueries, and for queries whose result is used by other queries.
+    """
+    deltalog =              None
+    """If not None, publish each change to this query's maintained
+    result to a runtime DeltaLog, so subscribers can follow the result
+    without re-reading it. The value is the number of most recent
+    changes to keep for polling (0 to only invoke callbacks). Only
+    applies when the query is incrementalized.
+    """
     
     _deltarel =             None
     """(Internal) If this join is a maintenance join, name of the
@@ -10,8 +10,13 @@ __all__ = [
     'MacroUpdateRewriter',
     'SetTypeRewriter',
     'ObjTypeRewriter',
+    'make_obj_classes',
+    'ObjConstructorRewriter',
+    'ColumnarRelRewriter',
+    'ColumnarAggrRewriter',
     'StrictUpdateRewriter',
     'MapOpImporter',
+    'BatchRewriter',
     'UpdateRewriter',
     'MinMaxRewriter',
     'eliminate_deadcode',
@@ -19,8 +24,11 @@ __all__ = [
 ]
 
 
+import builtins
+
 from incoq.util.collections import OrderedSet
 import incoq.compiler.incast as L
+import incoq.runtime
 from incoq.compiler.obj import is_specialrel
 
 
@@ -72,7 +80,7 @@ def get_distalgo_message_sets(tree):
                   'SentEvent_' in v)]
 
 
-class RelationFinder(L.NodeVisitor):
+class RelationFinder(L.SkippingNodeVisitor):
     
     """Find variables that we can statically infer to be relations,
     i.e. sets that are unaliased and top-level.
@@ -395,6 +403,165 @@ class ObjTypeRewriter(L.NodeTransformer):
         return node
 
 
+def make_obj_classes(obj_types):
+    """Given the value of the obj_types option, return code defining
+    a class for each object type, whose fields are given by
+    __slots__.
+    """
+    code = ()
+    for name in sorted(obj_types):
+        fields = tuple(sorted(obj_types[name]))
+        code += L.pc('''
+            class {}(ObjBase):
+                __slots__ = {!r}
+            '''.format(name, fields))
+    return code
+
+class ObjConstructorRewriter(L.NodeTransformer):
+    
+    """Rewrite object constructions "v = Obj()" to use the class of
+    a declared object type. The type is chosen based on the fields
+    assigned to v by the statements that follow in the same block:
+    it must be the only type that declares exactly these fields, or
+    else the only type that declares all of them. Otherwise the
+    construction is left alone.
+    """
+    
+    def __init__(self, obj_types):
+        super().__init__()
+        self.obj_types = {name: frozenset(fields)
+                          for name, fields in obj_types.items()}
+    
+    def choose_type(self, fields):
+        if len(fields) == 0:
+            return None
+        exact = [name for name, declared in self.obj_types.items()
+                      if declared == fields]
+        if len(exact) == 1:
+            return exact[0]
+        covering = [name for name, declared in self.obj_types.items()
+                         if declared >= fields]
+        if len(covering) == 1:
+            return covering[0]
+        return None
+    
+    def seq_visit(self, seq):
+        seq = super().seq_visit(seq)
+        
+        new_seq = list(seq)
+        for i, stmt in enumerate(seq):
+            if not (isinstance(stmt, L.Assign) and
+                    len(stmt.targets) == 1 and
+                    isinstance(stmt.targets[0], L.Name) and
+                    stmt.value == L.pe('Obj()')):
+                continue
+            var = stmt.targets[0].id
+            
+            fields = set()
+            for later in seq[i + 1:]:
+                if L.is_attrassign(later):
+                    cont, attr, _value = L.get_attrassign(later)
+                    if isinstance(cont, L.Name) and cont.id == var:
+                        fields.add(attr)
+                elif (isinstance(later, L.Assign) and
+                      L.ln(var) in later.targets):
+                    # Reassigned; later fields are for another object.
+                    break
+            
+            name = self.choose_type(frozenset(fields))
+            if name is not None:
+                new_seq[i] = stmt._replace(value=L.pe(name + '()'))
+        
+        if new_seq != list(seq):
+            return tuple(new_seq)
+        else:
+            return seq
+
+def get_columnar_init(stmt, rels):
+    """If stmt is a top-level initialization "R = Set()" of one of the
+    given relations, return the relation name, otherwise None.
+    """
+    if (isinstance(stmt, L.Assign) and
+        len(stmt.targets) == 1 and
+        isinstance(stmt.targets[0], L.Name) and
+        stmt.targets[0].id in rels and
+        stmt.value == L.pe('Set()')):
+        return stmt.targets[0].id
+    return None
+
+class ColumnarRelRewriter(L.NodeTransformer):
+    
+    """Rewrite the top-level initializations "R = Set()" of the given
+    relations to "R = ColumnSet()". Raise ProgramError if some
+    relation has no such initialization, or is not one of flat_rels,
+    the input and flattened relations. Other relations may hold
+    objects, and object-domain code doesn't recognize a ColumnSet
+    as a set.
+    """
+    
+    def __init__(self, rels, flat_rels):
+        super().__init__()
+        self.rels = set(rels)
+        self.flat_rels = set(flat_rels)
+    
+    def visit_Module(self, node):
+        nonflat = self.rels - self.flat_rels
+        if nonflat:
+            raise L.ProgramError(
+                'Columnar relations must be input or flattened '
+                'relations: ' + ', '.join(sorted(nonflat)))
+        
+        rewritten = set()
+        body = []
+        for stmt in node.body:
+            rel = get_columnar_init(stmt, self.rels)
+            if rel is not None:
+                stmt = stmt._replace(value=L.pe('ColumnSet()'))
+                rewritten.add(rel)
+            body.append(stmt)
+        
+        missing = self.rels - rewritten
+        if missing:
+            raise L.ProgramError(
+                'Columnar relations must be initialized by a top-level '
+                '"R = Set()": ' + ', '.join(sorted(missing)))
+        return node._replace(body=tuple(body))
+
+class ColumnarAggrRewriter(L.NodeTransformer):
+    
+    """Rewrite aggregates of setmatches over the given relations into
+    calls to ColumnSet.aggregate(), which maintains its own index and
+    caches results per key. To be run on the
+    remaining (batch) aggregates, before setmatches are
+    incrementalized. Only relations that ColumnarRelRewriter will
+    convert are affected.
+    """
+    
+    def __init__(self, rels):
+        super().__init__()
+        self.rels = set(rels)
+        self.converted = set()
+    
+    def visit_Module(self, node):
+        self.converted = {get_columnar_init(stmt, self.rels)
+                          for stmt in node.body} - {None}
+        return self.generic_visit(node)
+    
+    def visit_Aggregate(self, node):
+        node = self.generic_visit(node)
+        
+        value = node.value
+        if not (isinstance(value, L.SetMatch) and
+                isinstance(value.target, L.Name) and
+                value.target.id in self.converted):
+            return node
+        return L.pe('REL.aggregate(OP, MASK, KEY)',
+                    subst={'REL': value.target,
+                           'OP': L.Str(node.op),
+                           'MASK': L.Str(value.mask),
+                           'KEY': value.key})
+
+
 class StrictUpdateRewriter(L.NodeTransformer):
     
     """Rewrite set, field, and/or map updates with if-guards
@@ -481,6 +648,289 @@ class MapOpImporter(L.NodeTransformer):
             return L.DelKey(target, key)
         return node
 
+# Functions that may be called inside an incoq_batch block, since
+# they do not update the program's sets, fields, or maps.
+BATCH_CALLS = (set(dir(builtins)) - {
+    'setattr', 'delattr', 'eval', 'exec', 'globals', 'vars',
+    '__import__'}) | {
+    name for name in dir(incoq.runtime) if not name.startswith('_')}
+
+
+class BatchCallChecker(L.NodeVisitor):
+    
+    """Raise ProgramError if code in an incoq_batch block calls a
+    function or method that could make updates of its own. These
+    would be applied immediately, ahead of the buffered updates made
+    before the call.
+    """
+    
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not (isinstance(node.func, L.Name) and
+                node.func.id in BATCH_CALLS):
+            raise L.ProgramError('Cannot call functions or methods '
+                                 'in an incoq_batch block', node=node)
+    
+    # Code in nested scopes does not run as part of the block.
+    
+    def scope_helper(self, node):
+        pass
+    
+    visit_FunctionDef = scope_helper
+    visit_ClassDef = scope_helper
+    visit_Lambda = scope_helper
+
+
+class BatchRewriter(L.NodeTransformer):
+    
+    """Rewrite "with incoq_batch():" blocks so that only the net
+    effect of the set, field, and map updates inside them is applied,
+    once the block finishes.
+    
+    Each update in the block is replaced by a call that records it
+    in a runtime Batch, which cancels updates that undo each other.
+    After the block, a loop replays the surviving updates as ordinary
+    update statements, so the rest of the transformation maintains
+    queries for them as usual. Each replayed statement is selected
+    by the site number recorded with the update. Updates to the
+    relations in rels get a site of their own so that the relation
+    is still named statically; other set updates, map updates, and
+    updates to each field share a site.
+    
+    Updates are not visible until the end of the block, and are
+    discarded if the block raises an exception. Since updates made by
+    a called function could not be batched, only builtins and runtime
+    functions may be called in the block. Nested blocks are merged
+    into the outermost one.
+    
+    To be run after MapOpImporter and before UpdateRewriter.
+    """
+    
+    def __init__(self, namegen, rels, *, strict=True):
+        super().__init__()
+        self.namegen = namegen
+        self.rels = set(rels)
+        self.strict = strict
+    
+    def process(self, tree):
+        self.prefix = None
+        """Prefix for the current batch's variables, or None if not
+        inside a batch.
+        """
+        self.sitekeys = {}
+        """Map from site key to site number."""
+        self.sitecode = []
+        """List of replay code for each site number."""
+        self.loopdepth = 0
+        return super().process(tree)
+    
+    def is_batch(self, node):
+        return (len(node.items) == 1 and
+                node.items[0].context_expr == L.pe('incoq_batch()') and
+                node.items[0].optional_vars is None)
+    
+    def get_site(self, key, code):
+        """Return the site number for the given key, allocating it
+        with the given replay code if it is new.
+        """
+        site = self.sitekeys.get(key)
+        if site is None:
+            site = self.sitekeys[key] = len(self.sitecode)
+            self.sitecode.append(code)
+        return site
+    
+    def make_replay(self):
+        """Return code to replay the current batch's net updates."""
+        v = self.prefix
+        chain = ()
+        for site in reversed(range(len(self.sitecode))):
+            test = L.pe('SITE == N', subst={'SITE': v + 'site',
+                                            'N': L.Num(site)})
+            chain = (L.If(test, self.sitecode[site], chain),)
+        return L.pc('''
+            for SITE, OP, T, A, B in BATCH.net():
+                CHAIN
+            ''', subst={'SITE': v + 'site', 'OP': v + 'op',
+                        'T': v + 't', 'A': v + 'a', 'B': v + 'b',
+                        'BATCH': v + 'batch',
+                        '<c>CHAIN': chain})
+    
+    def visit_With(self, node):
+        if not self.is_batch(node):
+            return self.generic_visit(node)
+        
+        if self.prefix is not None:
+            # Merge into the enclosing batch.
+            return self.visit(node.body)
+        
+        BatchCallChecker.run(node.body)
+        
+        self.prefix = self.namegen.next_prefix()
+        self.sitekeys = {}
+        self.sitecode = []
+        self.loopdepth = 0
+        body = self.visit(node.body)
+        
+        code = L.pc('''
+            BATCH = Batch(STRICT)
+            ''', subst={'BATCH': self.prefix + 'batch',
+                        'STRICT': L.NameConstant(self.strict)})
+        code += body
+        if len(self.sitecode) > 0:
+            code += self.make_replay()
+        self.prefix = None
+        return code
+    
+    def scope_helper(self, node):
+        # Code in nested scopes does not run as part of the block.
+        prefix, loopdepth = self.prefix, self.loopdepth
+        self.prefix = None
+        node = self.generic_visit(node)
+        self.prefix, self.loopdepth = prefix, loopdepth
+        return node
+    
+    visit_FunctionDef = scope_helper
+    visit_ClassDef = scope_helper
+    visit_Lambda = scope_helper
+    
+    def loop_helper(self, node):
+        self.loopdepth += 1
+        node = self.generic_visit(node)
+        self.loopdepth -= 1
+        return node
+    
+    visit_For = loop_helper
+    visit_While = loop_helper
+    
+    def exit_helper(self, node):
+        if self.prefix is not None:
+            raise L.ProgramError('Cannot leave an incoq_batch block '
+                                 'early', node=node)
+        return node
+    
+    visit_Return = exit_helper
+    
+    def jump_helper(self, node):
+        if self.loopdepth == 0:
+            return self.exit_helper(node)
+        return node
+    
+    visit_Break = jump_helper
+    visit_Continue = jump_helper
+    
+    def visit_MacroUpdate(self, node):
+        if self.prefix is not None:
+            raise L.ProgramError('Cannot use macro updates in an '
+                                 'incoq_batch block', node=node)
+        return node
+    
+    # The replay code for each site refers to the loop variables
+    # made by make_replay().
+    
+    def visit_SetUpdate(self, node):
+        if self.prefix is None:
+            return node
+        v = self.prefix
+        if node.is_varupdate() and node.target.id in self.rels:
+            rel = node.target.id
+            site = self.get_site(('rel', rel), L.pc('''
+                if OP == 'add':
+                    REL.add(A)
+                else:
+                    REL.remove(A)
+                ''', subst={'OP': v + 'op', 'A': v + 'a', 'REL': rel}))
+            target = L.NameConstant(None)
+        else:
+            site = self.get_site(('set',), L.pc('''
+                if OP == 'add':
+                    T.add(A)
+                else:
+                    T.remove(A)
+                ''', subst={'OP': v + 'op', 'T': v + 't', 'A': v + 'a'}))
+            target = node.target
+        return L.pc('''
+            BATCH.setupdate(SITE, TARGET, OP, ELEM)
+            ''', subst={'BATCH': v + 'batch',
+                        'SITE': L.Num(site),
+                        'TARGET': target,
+                        'OP': L.Str(node.op),
+                        'ELEM': node.elem})
+    
+    def field_site(self, field):
+        v = self.prefix
+        return self.get_site(('field', field), L.pc('''
+            if OP == 'assign':
+                T.FIELD = B
+            else:
+                del T.FIELD
+            ''', subst={'OP': v + 'op', 'T': v + 't', 'B': v + 'b',
+                        '@FIELD': field}))
+    
+    def visit_Assign(self, node):
+        if self.prefix is None:
+            return node
+        if not L.is_attrassign(node):
+            if any(isinstance(t, (L.Attribute, L.Tuple, L.List))
+                   for t in node.targets):
+                raise L.ProgramError('Field assignments in an incoq_batch '
+                                     'block must have a single target',
+                                     node=node)
+            return node
+        cont, field, value = L.get_attrassign(node)
+        return L.pc('''
+            BATCH.assignfield(SITE, CONT, FIELD, VALUE)
+            ''', subst={'BATCH': self.prefix + 'batch',
+                        'SITE': L.Num(self.field_site(field)),
+                        'CONT': cont,
+                        'FIELD': L.Str(field),
+                        'VALUE': value})
+    
+    def visit_Delete(self, node):
+        if self.prefix is None:
+            return node
+        if not L.is_delattr(node):
+            if any(isinstance(t, L.Attribute) for t in node.targets):
+                raise L.ProgramError('Field deletions in an incoq_batch '
+                                     'block must have a single target',
+                                     node=node)
+            return node
+        cont, field = L.get_delattr(node)
+        return L.pc('''
+            BATCH.delfield(SITE, CONT, FIELD)
+            ''', subst={'BATCH': self.prefix + 'batch',
+                        'SITE': L.Num(self.field_site(field)),
+                        'CONT': cont,
+                        'FIELD': L.Str(field)})
+    
+    def map_site(self):
+        v = self.prefix
+        return self.get_site(('map',), (L.If(
+            L.pe('OP == "assign"', subst={'OP': v + 'op'}),
+            (L.AssignKey(L.ln(v + 't'), L.ln(v + 'a'), L.ln(v + 'b')),),
+            (L.DelKey(L.ln(v + 't'), L.ln(v + 'a')),)),))
+    
+    def visit_AssignKey(self, node):
+        if self.prefix is None:
+            return node
+        return L.pc('''
+            BATCH.assignkey(SITE, TARGET, KEY, VALUE)
+            ''', subst={'BATCH': self.prefix + 'batch',
+                        'SITE': L.Num(self.map_site()),
+                        'TARGET': node.target,
+                        'KEY': node.key,
+                        'VALUE': node.value})
+    
+    def visit_DelKey(self, node):
+        if self.prefix is None:
+            return node
+        return L.pc('''
+            BATCH.delkey(SITE, TARGET, KEY)
+            ''', subst={'BATCH': self.prefix + 'batch',
+                        'SITE': L.Num(self.map_site()),
+                        'TARGET': node.target,
+                        'KEY': node.key})
+
+
 class UpdateRewriter(L.NodeTransformer):
     
     """Rewrite set and map updates to ensure that the operands
@@ -608,7 +1058,7 @@ class MinMaxRewriter(L.NodeTransformer):
 # such as in filter checks. This could be fixed by rewriting these tests
 # to use an arbitrary map over the set instead.
 
-class DeadCodeEliminator(L.NodeTransformer):
+class DeadCodeEliminator(L.SkippingNodeTransformer):
     
     def __init__(self, deadvars):
         self.deadvars = set(deadvars)
@@ -21,7 +21,7 @@ from incoq.util.str import quote_items
 import incoq.compiler.incast as L
 from incoq.compiler.set import inc_all_relmatch
 from incoq.compiler.comp import (
-        patternize_comp, depatternize_all, inc_relcomp, 
+        IndexSharingOrderer, patternize_comp, depatternize_all, inc_relcomp, 
         impl_auxonly_relcomp, comp_inc_needs_dem,
         comp_isvalid)
 from incoq.compiler.aggr import (
@@ -34,16 +34,20 @@ from incoq.compiler.tup import (
 from incoq.compiler.cost import analyze_costs, eval_coststr
 
 from .manager import get_clause_factory, make_manager
+from .cached import get_cached_info, impl_cached_query
 from .rewritings import (import_distalgo, get_distalgo_message_sets,
                          MacroUpdateRewriter,
                          SetTypeRewriter, ObjTypeRewriter, MapOpImporter,
+                         BatchRewriter,
                          StrictUpdateRewriter,
                          UpdateRewriter, MinMaxRewriter,
                          eliminate_deadcode, PassEliminator,
-                         RelationFinder)
+                         RelationFinder,
+                         ObjConstructorRewriter, make_obj_classes,
+                         ColumnarRelRewriter, ColumnarAggrRewriter)
 
 
-class FunctionUniqueChecker(L.NodeVisitor):
+class FunctionUniqueChecker(L.SkippingNodeVisitor):
     
     """Raise AssertionError if the same function name is defined more
     than once at the top level.
@@ -58,7 +62,7 @@ class FunctionUniqueChecker(L.NodeVisitor):
             'Function {} defined multiple times'.format(node.name)
         self.names.add(node.name)
 
-class OrigSetFinder(L.NodeVisitor):
+class OrigSetFinder(L.SkippingNodeVisitor):
     
     """Find all relation updates in the tree."""
     
@@ -90,7 +94,7 @@ class InputQueryMarker(L.QueryMapper):
 def is_original(query):
     return query.options.get('in_original', False)
 
-class OriginalUpdateCounter(L.NodeVisitor):
+class OriginalUpdateCounter(L.SkippingNodeVisitor):
     
     """Count the number of outermost Maintenance nodes which are
     for one of the specified invariants and specified relations.
@@ -123,7 +127,7 @@ class OriginalUpdateCounter(L.NodeVisitor):
             self.generic_visit(node)
 
 
-class QueryFinder(L.NodeVisitor):
+class QueryFinder(L.SkippingNodeVisitor):
     
     """Find the next query to be transformed and return a pair of
     it along with helper information. Return (None, None) if there
@@ -158,7 +162,7 @@ class QueryFinder(L.NodeVisitor):
         impl = self.opman.get_queryopt(query, 'impl')
         if impl is None:
             impl = self.opman.get_opt('default_impl')
-        assert impl in ['batch', 'auxonly', 'inc', 'dem']
+        assert impl in ['batch', 'auxonly', 'inc', 'dem', 'cached']
         return impl
     
     def process(self, tree):
@@ -203,7 +207,7 @@ class QueryFinder(L.NodeVisitor):
         # (Can raise exception.)
         self.generic_visit(node)
         
-        if (impl in ['inc', 'dem'] and
+        if (impl in ['inc', 'dem', 'cached'] and
             not node.options.get('_invalid', False)):
             info = {'impl': impl,
                     'in_inccomp': self.inccomp_depth > 0,
@@ -215,6 +219,7 @@ def transform_query(tree, manager, query, info):
     """Transform a single query. info is the dictionary returned
     by QueryFinder.
     """
+    t1 = time.process_time()
     opman = manager.options
     comp_dem_fallback = opman.get_opt('comp_dem_fallback')
     aggr_batch_fallback = opman.get_opt('aggr_batch_fallback')
@@ -222,7 +227,28 @@ def transform_query(tree, manager, query, info):
     impl = info['impl']
     in_inccomp = info['in_inccomp']
     
-    if isinstance(query, L.Comp):
+    if impl == 'cached':
+        # If the query's dependencies can't be determined, leave it
+        # to batch computation.
+        if get_cached_info(manager, query) is None:
+            new_options = dict(query.options)
+            new_options['impl'] = 'batch'
+            rewritten_query = query._replace(options=new_options)
+            tree = L.QueryReplacer.run(tree, query, rewritten_query)
+            
+            manager.stats['queries skipped'] += 1
+            if manager.options.get_opt('verbose'):
+                print('Skipping query ' + L.ts(query))
+            return tree
+        
+        if isinstance(query, L.Comp):
+            name = next(manager.compnamegen)
+        else:
+            name = next(manager.aggrnamegen)
+        tree = impl_cached_query(tree, manager, query, name)
+        manager.stats['cached queries'] += 1
+    
+    elif isinstance(query, L.Comp):
         # If we can't handle this query, flag it and skip it.
         if is_original(query) and not comp_isvalid(manager, query):
             new_options = dict(query.options)
@@ -313,6 +339,9 @@ def transform_query(tree, manager, query, info):
             assert()
     
     
+    manager.stats['query times'].append(
+            (name, impl, time.process_time() - t1))
+    
     # Helpful for those long-running transformations.
     manager.stats['queries processed'] += 1
     processed = manager.stats['queries processed']
@@ -387,6 +416,36 @@ def elim_inputrel_params(tree, input_rels):
     return Trans.run(tree)
 
 
+class StageTimer:
+    
+    """Record the process time taken by each stage of the
+    transformation in the "stages" entry of a stats dictionary, as
+    a list of tuples of the stage name, seconds, and number of tree
+    nodes before and after the stage. The time spent counting nodes
+    is not charged to any stage, but is kept in overhead.
+    """
+    
+    def __init__(self, stats, tree):
+        self.stages = stats['stages']
+        self.overhead = 0
+        self.nodes = self.count(tree)
+        self.start = time.process_time()
+    
+    def count(self, tree):
+        t1 = time.process_time()
+        nodes = L.count_nodes(tree)
+        self.overhead += time.process_time() - t1
+        return nodes
+    
+    def done(self, name, tree):
+        """Record the end of a stage and the start of the next."""
+        elapsed = time.process_time() - self.start
+        nodes = self.count(tree)
+        self.stages.append((name, elapsed, self.nodes, nodes))
+        self.nodes = nodes
+        self.start = time.process_time()
+
+
 def transform_ast(tree, *, nopts=None, qopts=None):
     """Take a PyAST and return a transformed output PyAST.
     
@@ -395,6 +454,7 @@ def transform_ast(tree, *, nopts=None, qopts=None):
     input tree's own option specifications.
     """
     t1 = time.process_time()
+    hits1, misses1 = L.parse_cache.hits, L.parse_cache.misses
     
     if nopts is None:
         nopts = {}
@@ -404,8 +464,10 @@ def transform_ast(tree, *, nopts=None, qopts=None):
     qopts = qopts.copy()
     
     manager = make_manager()
+    timer = StageTimer(manager.stats, tree)
     
     tree, opman = preprocess_tree(manager, tree, (nopts, qopts))
+    timer.done('preprocess_tree', tree)
     
     verbose = opman.get_opt('verbose')
     objdomain = opman.get_opt('obj_domain')
@@ -414,17 +476,32 @@ def transform_ast(tree, *, nopts=None, qopts=None):
     
     manager.factory = get_clause_factory(use_objdomain=objdomain_out,
                                          use_typecheck=typecheck)
+    if opman.get_opt('share_auxmaps'):
+        manager.orderer = IndexSharingOrderer()
     
     # Rewrite set/obj types.
     tree = SetTypeRewriter.run(tree, manager.namegen,
                                set_literals=True, orig_set_comps=False)
     tree = ObjTypeRewriter.run(tree)
+    timer.done('SetTypeRewriter, ObjTypeRewriter', tree)
     
     # Import map key assignment/deletion nodes.
     tree = MapOpImporter.run(tree)
+    timer.done('MapOpImporter', tree)
+    
+    # Buffer the updates in incoq_batch blocks. Relations are
+    # found here the same way as below, so that their updates
+    # can be replayed by name.
+    batch_rels = set(opman.get_opt('input_rels'))
+    if opman.get_opt('autodetect_input_rels'):
+        batch_rels.update(RelationFinder.run(tree))
+    tree = BatchRewriter.run(tree, manager.namegen, batch_rels,
+                             strict=not opman.get_opt('nonstrict_sets'))
+    timer.done('BatchRewriter', tree)
     
     # Rewrite non-trivial update operands.
     tree = UpdateRewriter.run(tree, manager.namegen)
+    timer.done('UpdateRewriter', tree)
     
     # Rewrite for strictness if requested.
     ns_sets = opman.get_opt('nonstrict_sets')
@@ -433,9 +510,11 @@ def transform_ast(tree, *, nopts=None, qopts=None):
     tree = StrictUpdateRewriter.run(
             tree, rewrite_sets=ns_sets, rewrite_fields = ns_fields,
             rewrite_maps = ns_maps)
+    timer.done('StrictUpdateRewriter', tree)
     
     # Rewrite macro updates.
     tree = MacroUpdateRewriter.run(tree)
+    timer.done('MacroUpdateRewriter', tree)
     
     input_rels = list(opman.get_opt('input_rels'))
     # Find additional input relations.
@@ -443,6 +522,7 @@ def transform_ast(tree, *, nopts=None, qopts=None):
         detected_rels = RelationFinder.run(tree)
         input_rels.extend(r for r in detected_rels
                           if r not in input_rels)
+        timer.done('RelationFinder', tree)
     
     # Get type annotations and cost annotations/
     typeann = opman.get_opt('var_types')
@@ -466,14 +546,18 @@ def transform_ast(tree, *, nopts=None, qopts=None):
             print('Flattening relations: ' + ', '.join(flatten_rels))
         # This will also update the manager vartypes.
         tree = flatten_relations(tree, flatten_rels, manager)
+        timer.done('flatten_relations', tree)
     
     tree = elim_inputrel_params(tree, input_rels)
+    timer.done('elim_inputrel_params', tree)
     
     tree = manager.analyze_types(tree)
+    timer.done('analyze_types', tree)
     
     # Go to the pair domain.
     if objdomain:
         tree = to_pairdomain(tree, manager, input_rels)
+        timer.done('to_pairdomain', tree)
     
     # In principle we may need to do another UpdateRewriter run
     # to rewrite F_f.remove(o, o.f) so o.f is saved in a temp
@@ -485,26 +569,33 @@ def transform_ast(tree, *, nopts=None, qopts=None):
     # we may end up not turning some aggregate arguments into
     # comps.
     tree = MinMaxRewriter.run(tree)
+    timer.done('MinMaxRewriter', tree)
     
     # Flatten nested tuples in queries.
     tree = flatten_tuples(tree)
+    timer.done('flatten_tuples', tree)
     
     # Mark all the queries that exist right now as being from
     # the input program, so we can track statistics for input
     # queries versus intermediate queries that we create.
     tree = InputQueryMarker.run(tree)
     original_sets = OrigSetFinder.run(tree)
+    timer.done('InputQueryMarker, OrigSetFinder', tree)
     
     # Incrementalize queries.
     tree = transform_all_queries(tree, manager)
+    timer.done('transform_all_queries', tree)
     
     if not opman.get_opt('pattern_out'):
         tree = depatternize_all(tree, manager.factory)
+        timer.done('depatternize_all', tree)
     
     tree = SetTypeRewriter.run(tree, manager.namegen,
                                set_literals=False, orig_set_comps=True)
+    timer.done('SetTypeRewriter', tree)
     
     tree = manager.analyze_types(tree)
+    timer.done('analyze_types', tree)
     
     if opman.get_opt('analyze_costs'):
         print('Analyzing costs')
@@ -513,18 +604,28 @@ def transform_ast(tree, *, nopts=None, qopts=None):
                                     rewrite_types=rewrite_types,
                                     warn=True)
         manager.stats['costs'] = costs
+        timer.done('analyze_costs', tree)
     
     # For debugging type information.
 #    print(L.ts_typed(tree))
     
+    # Compute batch aggregates over columnar relations column-wise,
+    # rather than through auxiliary maps.
+    columnar_rels = opman.get_opt('columnar_rels')
+    if columnar_rels:
+        tree = ColumnarAggrRewriter.run(tree, columnar_rels)
+        timer.done('ColumnarAggrRewriter', tree)
+    
     # Incrementalize setmatch queries.
     check_bad_setmatches(tree)
     tree = inc_all_relmatch(tree, manager)
+    timer.done('inc_all_relmatch', tree)
     
     # Count updates to original queries.
     updatecount = OriginalUpdateCounter.run(
                     tree, original_sets, manager.original_queryinvs)
     manager.stats['orig updates'] = updatecount
+    timer.done('OriginalUpdateCounter', tree)
     
     # Eliminate deadcode.
     # Must happen before we return to obj domain, where there
@@ -535,13 +636,16 @@ def transform_ast(tree, *, nopts=None, qopts=None):
                 keepvars=opman.get_opt('deadcode_keepvars'),
                 obj_domain_out=opman.get_opt('obj_domain_out'),
                 verbose=verbose)
+        timer.done('eliminate_deadcode', tree)
     
     # Go back to the object domain.
     if opman.get_opt('obj_domain') and opman.get_opt('obj_domain_out'):
         tree = to_objdomain(tree, manager)
+        timer.done('to_objdomain', tree)
     
     if opman.get_opt('mode') == 'outline':
         tree = L.maint_skeleton(tree)
+        timer.done('maint_skeleton', tree)
     
     # Inline maintenance code if requested.
     # Otherwise, just eliminate unused maintenance functions.
@@ -551,29 +655,57 @@ def transform_ast(tree, *, nopts=None, qopts=None):
             print('Inlining maintenance functions')
         funcnames = list(L.FuncDefLister.run(tree, maintfunc_pred).keys())
         tree = L.inline_functions(tree, funcnames)
+        timer.done('inline_functions', tree)
     else:
         if verbose:
             print('Eliminating dead functions')
         tree = L.elim_deadfuncs(tree, maintfunc_pred)
+        timer.done('elim_deadfuncs', tree)
     
     # Expand maintenance nodes away.
     tree = L.MaintExpander.run(tree)
+    timer.done('MaintExpander', tree)
     
     # Eliminate redundant Pass statements. Occurs after eliminating
     # Maint nodes, since that flattens multiple bodies of code
     # together and makes it possible to eliminate more Passes.
     if opman.get_opt('deadcode_elim'):
         tree = PassEliminator.run(tree)
+        timer.done('PassEliminator', tree)
+    
+    # Store the requested relations column-wise.
+    if columnar_rels:
+        tree = ColumnarRelRewriter.run(tree, columnar_rels,
+                                       input_rels + flatten_rels)
+        timer.done('ColumnarRelRewriter', tree)
+    
+    # Give declared object types their own classes, and construct
+    # objects from them.
+    obj_types = opman.get_opt('obj_types')
+    if obj_types:
+        tree = ObjConstructorRewriter.run(tree, obj_types)
+        timer.done('ObjConstructorRewriter', tree)
+        classes = make_obj_classes(obj_types)
+    else:
+        classes = ()
     
     # Add header comments.
-    tree = tree._replace(body=tuple(manager.header_comments) + tree.body)
+    tree = tree._replace(body=tuple(manager.header_comments) +
+                              classes + tree.body)
     
     # Convert back to Python AST format.
     tree = L.add_runtimelib(tree)
     tree = L.export_program(tree)
+    timer.done('export_program', tree)
     
     t2 = time.process_time()
-    manager.stats['trans time'] = t2 - t1
+    manager.stats['trans time'] = t2 - t1 - timer.overhead
+    hits = L.parse_cache.hits - hits1
+    misses = L.parse_cache.misses - misses1
+    manager.stats['template hits'] = hits
+    manager.stats['template misses'] = misses
+    if hits + misses > 0:
+        manager.stats['template hit rate'] = hits / (hits + misses)
     
     if verbose:
         print()
@@ -582,11 +714,19 @@ def transform_ast(tree, *, nopts=None, qopts=None):
 
 def transform_source(source, *, nopts=None, qopts=None):
     """Like transform_ast, but from source code to source code."""
+    t1 = time.process_time()
     tree = L.p(source)
+    t2 = time.process_time()
     
     tree, manager = transform_ast(tree, nopts=nopts, qopts=qopts)
     
+    t3 = time.process_time()
     result = L.ts(tree)
+    t4 = time.process_time()
+    
+    stages = manager.stats['stages']
+    stages.insert(0, ('parse', t2 - t1, None, stages[0][2]))
+    stages.append(('unparse', t4 - t3, stages[-1][3], None))
     manager.stats['lines'] = get_loc_source(result)
     return result, manager
 
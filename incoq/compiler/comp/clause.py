@@ -28,6 +28,7 @@ from simplestruct import Struct, MetaStruct, TypedField
 
 from incoq.util.type import checktype
 from incoq.util.seq import elim_duplicates
+from incoq.util.faststruct import fast_struct
 import incoq.compiler.incast as L
 from incoq.compiler.set import (Mask, AuxmapSpec, make_bindmatch,
                                  make_tuplematch)
@@ -358,6 +359,7 @@ class Clause(metaclass=ABCMeta):
         """
 
 
+@fast_struct
 class EnumClause(Clause, ABCStruct):
     
     """An normal enumeration (membership constraint) clause
@@ -459,6 +461,7 @@ class EnumClause(Clause, ABCStruct):
         return make_bindmatch(self.rel, mask, bvars, uvars, body)
 
 
+@fast_struct
 class SubClause(Clause, ABCStruct):
     
     """An enumerator that skips over a specified element."""
@@ -532,6 +535,7 @@ class SubClause(Clause, ABCStruct):
         return self.cl.get_code(bindenv, guard_code)
 
 
+@fast_struct
 class AugClause(Clause, ABCStruct):
     
     """An enumerator that runs for one extra element."""
@@ -604,6 +608,7 @@ class AugClause(Clause, ABCStruct):
         return code
 
 
+@fast_struct
 class LookupClause(EnumClause, ABCStruct):
     
     """An enumerator over a singleton set of an SMLookup node.
@@ -659,6 +664,7 @@ class LookupClause(EnumClause, ABCStruct):
         return super().rate(bindenv)
 
 
+@fast_struct
 class SingletonClause(Clause, ABCStruct):
     
     """An enumerator over a singleton set, i.e., that binds its
@@ -719,6 +725,7 @@ class SingletonClause(Clause, ABCStruct):
         return make_tuplematch(self.val, mask, bvars, uvars, body)
 
 
+@fast_struct
 class DeltaClause(Clause, ABCStruct):
     
     """Clause for the update to a join."""
@@ -802,6 +809,7 @@ class DeltaClause(Clause, ABCStruct):
             return make_tuplematch(self.val, mask, bvars, uvars, body)
 
 
+@fast_struct
 class CondClause(Clause, ABCStruct):
     
     """A condition expression clause."""
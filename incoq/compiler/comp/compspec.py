@@ -7,7 +7,10 @@ __all__ = [
     'for_rel_code',
     'for_rels_union_code',
     'for_rels_union_disjoint_code',
+    'uses_rc',
     'make_comp_maint_code',
+    'get_change_var',
+    'make_comp_change_code',
 ]
 
 
@@ -351,8 +354,39 @@ def for_rels_union_disjoint_code(vars, iters, body):
     return code
 
 
+def uses_rc(spec, rc):
+    """Return whether the saved result of a comprehension with the
+    given CompSpec and rc option ('yes', 'no', 'safe') is reference-
+    counted.
+    """
+    return {'yes': True,
+            'no': False,
+            'safe': not spec.is_duplicate_safe}[rc]
+
+def make_result_update(resrel, op, resexp, *, use_rc, keylen):
+    """Return code to add or remove the value of resexp to or from
+    the saved result resrel, as described for make_comp_maint_code().
+    """
+    if keylen is None:
+        if use_rc:
+            op = 'rc' + op
+        return L.pc('''
+            RES.OP(RESEXP)
+            ''', subst={'RES': resrel,
+                        '@OP': op,
+                        'RESEXP': resexp})
+    else:
+        assert isinstance(resexp, L.Tuple)
+        op = ('rcimg' if use_rc else 'img') + op
+        return L.pc('''
+            RES.OP(KEY, VALUE)
+            ''', subst={'RES': resrel,
+                        '@OP': op,
+                        'KEY': L.tuplify(resexp.elts[:keylen]),
+                        'VALUE': L.tuplify(resexp.elts[keylen:])})
+
 def make_comp_maint_code(spec, resrel, deltarel, op, elem, prefix, *,
-                         maint_impl, rc, selfjoin):
+                         maint_impl, rc, selfjoin, keylen=None):
     """Construct comprehension maintenance code. Return the code and
     a list of maintenance comprehensions used.
     
@@ -396,6 +430,12 @@ def make_comp_maint_code(spec, resrel, deltarel, op, elem, prefix, *,
               naive, only valid if joins are disjoint
             'assume_disjoint_verify':
               naive, use das to assert disjoint at runtime
+        
+        keylen:
+          If not None, the saved result is kept as a map from
+          tuples of the first keylen components of the result
+          expression to image sets of the remaining components,
+          instead of as a flat set.
     """
     assert op in ['add', 'remove']
     assert maint_impl in ['batch', 'auxonly']
@@ -423,18 +463,11 @@ def make_comp_maint_code(spec, resrel, deltarel, op, elem, prefix, *,
     
     # Decide whether the body is a normal update or
     # a reference-counted one.
-    use_rc = {'yes': True,
-              'no': False,
-              'safe': not spec.is_duplicate_safe}[rc]
-    if use_rc:
-        op = 'rc' + op
+    use_rc = uses_rc(spec, rc)
     resvars = L.VarsFinder.run(spec.resexp, ignore_functions=True)
     resexp = L.prefix_names(spec.resexp, resvars, prefix)
-    body = L.pc('''
-        RES.OP(RESEXP)
-        ''', subst={'RES': resrel,
-                    '@OP': op,
-                    'RESEXP': resexp})
+    body = make_result_update(resrel, op, resexp,
+                              use_rc=use_rc, keylen=keylen)
     
     # Create code according to the choice of self-join strategy.
     if selfjoin in ['sub', 'aug', 'assume_disjoint']:
@@ -448,3 +481,140 @@ def make_comp_maint_code(spec, resrel, deltarel, op, elem, prefix, *,
                         dasprefix, verify_disjoint=ver_dis)
     
     return code, maint_comps
+
+
+def get_change_var(spec, rel):
+    """Return the variable that make_comp_change_code() substitutes
+    when a pair in rel is replaced by one with the same first
+    component, or None if such changes can't be maintained that way.
+    
+    This requires that rel is iterated by exactly one enumerator, over
+    two distinct variables, and that the second variable is not a
+    parameter and is not mentioned by any other enumerator. It may
+    appear in conditions and in the result expression.
+    """
+    occs = [cl for cl in spec.join.clauses if cl.enumrel == rel]
+    if len(occs) != 1:
+        return None
+    (cl,) = occs
+    if len(cl.enumlhs) != 2 or cl.has_demand:
+        return None
+    key, var = cl.enumlhs
+    if '_' in (key, var) or key == var or var in spec.params:
+        return None
+    for other in spec.join.clauses:
+        if other is cl or other.kind is not Clause.KIND_ENUM:
+            continue
+        if (var in other.demparams or
+            var in L.VarsFinder.run(other.to_AST())):
+            return None
+    return var
+
+def make_comp_change_code(spec, resrel, deltarel, elem, newvalue, prefix, *,
+                          maint_impl, rc, keylen=None):
+    """Construct maintenance code for when the pair elem in deltarel
+    is replaced by a pair with the same first component and with
+    second component newvalue. Return the code and a list of
+    maintenance comprehensions used.
+    
+    The code must run before elem is removed. It enumerates the join
+    once, with the changed variable (see get_change_var()) bound to
+    its old value, and moves each resulting entry from its old value
+    to its new value. Conditions over the changed variable are
+    evaluated for both values, and entries whose result expression
+    and conditions are unaffected are not touched. The other
+    arguments are as for make_comp_maint_code().
+    """
+    assert maint_impl in ['batch', 'auxonly']
+    assert rc in ['yes', 'no', 'safe']
+    
+    var = get_change_var(spec, deltarel)
+    assert var is not None
+    
+    if len(spec.params) > 0:
+        raise ValueError('Cannot incrementalize comprehension with '
+                         'parameters')
+    
+    # Conditions over the changed variable are checked in the body,
+    # for both values, rather than in the join.
+    conds = [cl for cl in spec.join.clauses
+                if cl.kind is Clause.KIND_COND and var in cl.vars]
+    clauses = [cl for cl in spec.join.clauses if cl not in conds]
+    join = spec.join._replace(clauses=clauses)
+    
+    maint_joins = join.get_maint_joins(elem, deltarel, 'remove', prefix,
+                                       disjoint_strat='das')
+    assert len(maint_joins) == 1
+    maint_join = maint_joins[0]
+    
+    def old_and_new(tree, names):
+        old = L.prefix_names(tree, names, prefix)
+        new = L.Templater.run(old, {prefix + var: newvalue})
+        return old, new
+    
+    enumvars = set(spec.join.enumvars)
+    oldconds = []
+    newconds = []
+    for cl in conds:
+        oldcond, newcond = old_and_new(cl.cond, set(cl.vars) & enumvars)
+        oldconds.append(oldcond)
+        newconds.append(newcond)
+    
+    use_rc = uses_rc(spec, rc)
+    resvars = L.VarsFinder.run(spec.resexp, ignore_functions=True)
+    oldres, newres = old_and_new(spec.resexp, resvars)
+    remove_code = make_result_update(resrel, 'remove', oldres,
+                                     use_rc=use_rc, keylen=keylen)
+    add_code = make_result_update(resrel, 'add', newres,
+                                  use_rc=use_rc, keylen=keylen)
+    
+    # Code for when the conditions hold for both values.
+    if var in resvars:
+        both_code = L.pc('''
+            if OLDRES != NEWRES:
+                REMOVE
+                ADD
+            ''', subst={'OLDRES': oldres,
+                        'NEWRES': newres,
+                        '<c>REMOVE': remove_code,
+                        '<c>ADD': add_code})
+    else:
+        both_code = ()
+    
+    if len(conds) == 0:
+        body = both_code
+    else:
+        def conj(exprs):
+            return exprs[0] if len(exprs) == 1 else L.BoolOp(L.And(), exprs)
+        subst = {'OLDCOND': conj(oldconds),
+                 'NEWCOND': conj(newconds),
+                 '<c>REMOVE': remove_code,
+                 '<c>ADD': add_code}
+        if len(both_code) > 0:
+            subst['<c>BOTH'] = both_code
+            body = L.pc('''
+                if OLDCOND:
+                    if NEWCOND:
+                        BOTH
+                    else:
+                        REMOVE
+                elif NEWCOND:
+                    ADD
+                ''', subst=subst)
+        else:
+            body = L.pc('''
+                if OLDCOND:
+                    if not NEWCOND:
+                        REMOVE
+                elif NEWCOND:
+                    ADD
+                ''', subst=subst)
+    
+    # If nothing observes the changed variable, the change has no
+    # effect on the result.
+    if len(body) == 0:
+        return L.pc('pass'), []
+    
+    maint_comp = maint_join.to_comp({'impl': maint_impl})
+    code = for_rel_code(maint_join.enumvars, maint_comp, body)
+    return code, [maint_comp]
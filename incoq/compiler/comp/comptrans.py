@@ -22,7 +22,8 @@ from incoq.compiler.set import Mask
 
 from .clause import EnumClause
 from .join import Join
-from .compspec import make_comp_maint_code, CompSpec
+from .compspec import (make_comp_maint_code, make_comp_change_code,
+                       get_change_var, uses_rc, CompSpec)
 
 
 def get_uset_params(spec, mode, explicit):
@@ -52,7 +53,8 @@ class IncComp:
     """A comprehension along with incrementalization info."""
     
     def __init__(self, comp, spec, name, use_uset, uset_name, uset_params,
-                 rc, selfjoin, maint_impl, outsideinvs, uset_lru):
+                 rc, selfjoin, maint_impl, outsideinvs, uset_lru,
+                 deltalog=None, lazy_maint=None):
         self.comp = comp
         self.spec = spec 
         self.name = name
@@ -64,9 +66,23 @@ class IncComp:
         self.maint_impl = maint_impl
         self.outsideinvs = outsideinvs
         self.uset_lru = uset_lru
+        self.deltalog = deltalog
+        self.lazy_maint = lazy_maint
         
         self.change_tracker = False
         
+        self.fused = False
+        """If True, the result is kept as a map from parameter tuples
+        to image sets, rather than as a flat set with a separate
+        auxiliary map for retrieval.
+        """
+        
+        self.change_rels = ()
+        """Relations for which a removal of a pair (o, o.f) followed
+        immediately by an addition of (o, v) is maintained as a single
+        change. See make_comp_change_code().
+        """
+        
         assert maint_impl in ['batch', 'auxonly']
 
 
@@ -93,14 +109,25 @@ class RelcompMaintainer(L.OuterMaintTransformer):
                          for rel in rels}
         self.removefuncs = {rel: '_maint_{}_{}_remove'.format(name, rel)
                             for rel in rels}
+        self.changefuncs = {rel: '_maint_{}_{}_change'.format(name, rel)
+                            for rel in inccomp.change_rels}
     
     def process(self, tree):
         self.maint_comps = []
+        self.changes = {}
+        """Map from ids of SetUpdate nodes that form a change to
+        the new value, for the removal, or None, for the addition.
+        """
         tree = super().process(tree)
         return tree, self.maint_comps
     
     def visit_Module(self, node):
-        resinit = L.pe('RCSet()')
+        if self.inccomp.fused:
+            resinit = L.pe('Map()')
+            keylen = len(self.inccomp.comp.params)
+        else:
+            resinit = L.pe('RCSet()')
+            keylen = None
         
         code = L.pc('''
             RES = RESINIT
@@ -117,7 +144,8 @@ class RelcompMaintainer(L.OuterMaintTransformer):
                 prefix1,
                 maint_impl=self.inccomp.maint_impl,
                 rc=self.inccomp.rc,
-                selfjoin=self.inccomp.selfjoin)
+                selfjoin=self.inccomp.selfjoin,
+                keylen=keylen)
             
             remove_code, remove_comps = make_comp_maint_code(
                 self.inccomp.spec, self.inccomp.name,
@@ -125,7 +153,8 @@ class RelcompMaintainer(L.OuterMaintTransformer):
                 prefix2,
                 maint_impl=self.inccomp.maint_impl,
                 rc=self.inccomp.rc,
-                selfjoin=self.inccomp.selfjoin)
+                selfjoin=self.inccomp.selfjoin,
+                keylen=keylen)
             
             self.maint_comps.extend(add_comps)
             self.maint_comps.extend(remove_comps)
@@ -139,12 +168,45 @@ class RelcompMaintainer(L.OuterMaintTransformer):
                             '<c>ADDCODE': add_code,
                             '<def>REMOVEFUNC': self.removefuncs[rel],
                             '<c>REMOVECODE': remove_code})
+            prefixes = [prefix1, prefix2]
+            
+            if rel in self.changefuncs:
+                prefix3 = self.manager.namegen.next_prefix()
+                change_code, change_comps = make_comp_change_code(
+                    self.inccomp.spec, self.inccomp.name,
+                    rel, L.pe('_e'), L.pe('_new'),
+                    prefix3,
+                    maint_impl=self.inccomp.maint_impl,
+                    rc=self.inccomp.rc,
+                    keylen=keylen)
+                self.maint_comps.extend(change_comps)
+                code += L.pc('''
+                    def CHANGEFUNC(_e, _new):
+                        CHANGECODE
+                    ''', subst={'<def>CHANGEFUNC': self.changefuncs[rel],
+                                '<c>CHANGECODE': change_code})
+                prefixes.append(prefix3)
             
             vt = self.manager.vartypes
             for e in self.inccomp.spec.join.enumvars:
                 if e in vt:
-                    vt[prefix1 + e] = vt[e]
-                    vt[prefix2 + e] = vt[e]
+                    for prefix in prefixes:
+                        vt[prefix + e] = vt[e]
+        
+        if (self.inccomp.deltalog is not None and
+            not self.inccomp.change_tracker):
+            name = self.inccomp.name
+            code = L.DeltaLogger.run(code, name,
+                                     self.manager.namegen.next_prefix())
+            code = (code[:1] +
+                    L.DeltaLogger.make_logvar(name, self.inccomp.deltalog) +
+                    code[1:])
+        
+        if self.inccomp.lazy_maint is not None:
+            maker = L.DeferMaker(self.inccomp.name)
+            code = (code[:1] +
+                    maker.make_init(self.inccomp.lazy_maint) +
+                    code[1:])
         
         node = node._replace(body=code + node.body)
         node = self.generic_visit(node)
@@ -167,6 +229,16 @@ class RelcompMaintainer(L.OuterMaintTransformer):
             funcdict = self.addfuncs if is_add else self.removefuncs
         
         func = funcdict[var]
+        
+        if self.inccomp.lazy_maint is not None:
+            # Deferred maintenance is queued up before the update,
+            # so that pending maintenance for other operands runs
+            # before this one changes.
+            maker = L.DeferMaker(self.inccomp.name)
+            precode = maker.make_defer(var, op, elem, func)
+            return self.with_outer_maint(node, self.inccomp.name,
+                                         L.ts(node), precode, ())
+        
         code = L.pc('FUNC(ELEM)',
                     subst={'FUNC': func,
                            'ELEM': elem})
@@ -183,7 +255,71 @@ class RelcompMaintainer(L.OuterMaintTransformer):
         return self.with_outer_maint(node, self.inccomp.name, L.ts(node),
                                      precode, postcode)
     
+    def change_helper(self, node, var, elem, newvalue):
+        # The old value is read from the object, so maintenance must
+        # go before the removal.
+        code = L.pc('FUNC(ELEM, NEW)',
+                    subst={'FUNC': self.changefuncs[var],
+                           'ELEM': elem,
+                           'NEW': newvalue})
+        return self.with_outer_maint(node, self.inccomp.name, L.ts(node),
+                                     code, ())
+    
+    @classmethod
+    def get_update(cls, stmt):
+        """Return the update statement that stmt consists of, looking
+        inside Maintenance nodes.
+        """
+        while isinstance(stmt, L.Maintenance):
+            updates = [s for s in stmt.update
+                         if not isinstance(s, L.Comment)]
+            if len(updates) != 1:
+                return None
+            stmt = updates[0]
+        return stmt
+    
+    def find_changes(self, seq):
+        """Record each pair of consecutive updates
+        
+            R.remove((o, o.f))
+            R.add((o, v))
+        
+        where R is in changefuncs, o is a variable, and v is a variable
+        or constant. Since v is evaluated before the removal, it must
+        not be any other kind of expression.
+        """
+        for stmt1, stmt2 in zip(seq, seq[1:]):
+            upd1 = self.get_update(stmt1)
+            upd2 = self.get_update(stmt2)
+            if not (isinstance(upd1, L.SetUpdate) and upd1.is_varupdate() and
+                    isinstance(upd2, L.SetUpdate) and upd2.is_varupdate()):
+                continue
+            var1, op1, elem1 = upd1.get_varupdate()
+            var2, op2, elem2 = upd2.get_varupdate()
+            if not (var1 == var2 and var1 in self.changefuncs and
+                    op1 == 'remove' and op2 == 'add'):
+                continue
+            if not (isinstance(elem1, L.Tuple) and len(elem1.elts) == 2 and
+                    isinstance(elem2, L.Tuple) and len(elem2.elts) == 2):
+                continue
+            cont, old = elem1.elts
+            cont2, new = elem2.elts
+            if not (isinstance(cont, L.Name) and cont2 == cont and
+                    isinstance(old, L.Attribute) and old.value == cont and
+                    isinstance(new, (L.Name, L.Num, L.Str,
+                                     L.NameConstant))):
+                continue
+            self.changes[id(upd1)] = new
+            self.changes[id(upd2)] = None
+    
+    def seq_visit(self, seq):
+        if len(self.changefuncs) > 0:
+            self.find_changes(seq)
+        return super().seq_visit(seq)
+    
     def visit_SetUpdate(self, node):
+        is_change = id(node) in self.changes
+        newvalue = self.changes.get(id(node))
         node = self.generic_visit(node)
         
         if not node.is_varupdate():
@@ -192,6 +328,12 @@ class RelcompMaintainer(L.OuterMaintTransformer):
         if var not in self.inccomp.spec.join.rels:
             return node
         
+        if is_change:
+            if op == 'add':
+                # Already handled along with the removal.
+                return node
+            return self.change_helper(node, var, elem, newvalue)
+        
         return self.helper(node, var, op, elem)
 
 
@@ -211,8 +353,19 @@ class CompReplacer(L.NodeTransformer):
     def get_res_code(self):
         """Return code (expression) to lookup the result."""
         params = self.inccomp.comp.params
+        lazy = self.inccomp.lazy_maint is not None
+        
+        if self.inccomp.fused:
+            # The result is already keyed by the parameters.
+            use_rc = uses_rc(self.inccomp.spec, self.inccomp.rc)
+            code = L.pe('''
+                RES.LOOKUP(PARAMS)
+                ''', subst={'RES': L.ln(self.inccomp.name),
+                            '@LOOKUP': ('rcimglookup' if use_rc
+                                        else 'imglookup'),
+                            'PARAMS': L.tuplify(params)})
         
-        if len(params) > 0:
+        elif len(params) > 0:
             resexp = self.inccomp.spec.resexp
             assert isinstance(resexp, L.Tuple)
             resexp_arity = len(resexp.elts)
@@ -221,6 +374,11 @@ class CompReplacer(L.NodeTransformer):
             maskstr = 'b' * len(params) + 'u' * n_rescomponents
             masknode = Mask(maskstr).make_node()
             paramsnode = L.tuplify(params)
+            # Flush deferred maintenance as part of computing the key,
+            # so that the lookup is still a setmatch over the result.
+            if lazy:
+                maker = L.DeferMaker(self.inccomp.name)
+                paramsnode = maker.make_flushed(paramsnode)
             
             code = L.pe('''
                 setmatch(RES, MASK, PARAMS)
@@ -230,6 +388,9 @@ class CompReplacer(L.NodeTransformer):
         
         else:
             code = L.ln(self.inccomp.name)
+            if lazy:
+                maker = L.DeferMaker(self.inccomp.name)
+                code = maker.make_flushed(code)
         
         return code
     
@@ -320,6 +481,7 @@ class AuxonlyTransformer(L.NodeTransformer):
             ''', subst={'RESEXP': spec.resexp})
         
         code = spec.join.get_code(spec.params, code,
+                                  orderer=self.manager.orderer,
                                   augmented=self.augmented)
         
         code = L.pc('''
@@ -373,6 +535,7 @@ class AuxonlyTransformer(L.NodeTransformer):
             code = ()
             code += (L.Comment('Iterate ' + str(spec)),)
             code += spec.join.get_code(spec.params, node.body,
+                                       orderer=self.manager.orderer,
                                        augmented=self.augmented)
             return self.visit(code)
         else:
@@ -501,9 +664,12 @@ def make_inccomp(tree, manager, comp, name, *,
     if uset_lru is None:
         uset_lru = manager.options.get_opt('default_uset_lru')
     
+    deltalog = get(comp, 'deltalog')
+    lazy_maint = get(comp, 'lazy_maint')
+    
     return IncComp(comp, spec, name, use_uset, L.N.uset(name),
                    uset_params, rc, selfjoin_strat, maint_impl,
-                   outsideinvs, uset_lru)
+                   outsideinvs, uset_lru, deltalog, lazy_maint)
 
 def inc_relcomp_helper(tree, manager, inccomp):
     """Incrementalize a comprehension based on an IncComp structure.
@@ -557,6 +723,47 @@ def inc_relcomp_helper(tree, manager, inccomp):
     new_spec = spec._replace(join=spec.join._replace(clauses=new_clauses))
     inccomp.spec = new_spec
     
+    # Deferring maintenance is only sound if running an operand's
+    # maintenance late reads nothing that changed in the meantime.
+    # Other operands are covered by flushing when they change, but
+    # not a self-join's other occurrences of the same relation, nor
+    # demand invariants for subqueries, nor other queries that read
+    # the result.
+    if inccomp.lazy_maint is not None:
+        rels = [cl.enumrel for cl in new_spec.join.clauses
+                if cl.enumrel is not None]
+        if (inccomp.change_tracker or len(deminvs) > 0 or
+            len(inccomp.outsideinvs) > 0 or len(set(rels)) < len(rels) or
+            not L.OuterQueryChecker.run(tree, inccomp.comp)):
+            if manager.options.get_opt('verbose'):
+                print('Not deferring maintenance for ' + inccomp.name)
+            inccomp.lazy_maint = None
+    
+    # Keep a parameterized result directly in the form that retrieval
+    # reads, unless something else needs the flat set.
+    if (manager.options.get_opt('fuse_results') and
+        len(inccomp.comp.params) > 0 and
+        not inccomp.change_tracker and
+        inccomp.deltalog is None and
+        inccomp.lazy_maint is None):
+        inccomp.fused = L.OuterQueryChecker.run(tree, inccomp.comp)
+    
+    # Maintain field changes as a unit where possible. The new result
+    # entries are added while the relation still holds the old pair,
+    # so nothing that is maintained on the relation's updates may read
+    # the result, and the other operands must not be query results
+    # that themselves change with the relation.
+    if (manager.options.get_opt('change_maint') and
+        not inccomp.change_tracker and
+        inccomp.lazy_maint is None and
+        len(deminvs) == 0 and
+        L.OuterQueryChecker.run(tree, inccomp.comp)):
+        inccomp.change_rels = tuple(
+            rel for rel in new_spec.join.rels
+            if get_change_var(new_spec, rel) is not None
+            if all(cl.enumrel not in manager.invariants
+                   for cl in new_spec.join.clauses))
+    
     tree = CompReplacer.run(tree, manager, inccomp)
     tree, comps = RelcompMaintainer.run(tree, manager, inccomp)
     
@@ -15,6 +15,7 @@ from simplestruct import Struct, Field, TypedField
 from incoq.util.type import checktype
 from incoq.util.seq import elim_duplicates, pairs
 from incoq.util.collections import Partitioning
+from incoq.util.faststruct import fast_struct
 import incoq.compiler.incast as L
 from incoq.compiler.set import Mask
 
@@ -22,6 +23,7 @@ from .clause import Clause
 from .order import AsymptoticOrderer
 
 
+@fast_struct
 class DeltaInfo(Struct):
     
     """Information about maintenance joins."""
@@ -65,6 +67,7 @@ class DeltaInfo(Struct):
         return options
 
 
+@fast_struct
 class Join(Struct):
     
     """A join of one or more enumerator clauses and zero or more
@@ -4,10 +4,12 @@
 __all__ = [
     'Rate',
     'AsymptoticOrderer',
+    'IndexSharingOrderer',
 ]
 
 
 from incoq.util.type import checktype_seq
+from incoq.compiler.set import Mask
 
 
 class Rate:
@@ -166,3 +168,75 @@ class AsymptoticOrderer:
         """Return a single order."""
         return self.get_orders(clauses, init_bounds=init_bounds,
                                first_only=True)[0]
+
+
+class IndexSharingOrderer(AsymptoticOrderer):
+    
+    """Orderer that is shared across all joins of a program. Among
+    the orders that the heuristic considers equally good, it picks
+    the one that needs the fewest auxiliary maps not already needed
+    by previously ordered joins. Ties go to the order the plain
+    heuristic would have picked.
+    
+    The choice for a given join and set of initially bound variables
+    is remembered, so that the join is ordered consistently each time
+    it is asked for.
+    """
+    
+    max_orders = 64
+    """Maximum number of alternative orders to consider per join."""
+    
+    def __init__(self, overrides=None):
+        super().__init__(overrides)
+        self.indexes = set()
+        """Set of (rel, mask string) pairs for the auxiliary maps
+        needed by the orders chosen so far.
+        """
+        self.chosen = {}
+        """Map from (clauses, init bounds) to chosen order."""
+    
+    def process(self, states, first_only=False):
+        # Like the base version, but stops after max_orders results.
+        # Since states are expanded left-to-right, the first result
+        # is still the default order.
+        checktype_seq(states, self.State)
+        
+        results = []
+        for state in states:
+            if len(results) >= self.max_orders:
+                break
+            if state.is_done():
+                results.append(state)
+            else:
+                next_states = state.step(deterministic=first_only)
+                results.extend(self.process(next_states))
+        return results[:self.max_orders]
+    
+    @staticmethod
+    def get_order_indexes(order, init_bounds):
+        """Return the set of (rel, mask string) pairs for the
+        auxiliary maps needed to run the clauses in the given order.
+        """
+        indexes = set()
+        bindenv = set(init_bounds)
+        for _i, cl, _ in order:
+            if cl.enumrel is not None and not cl.isdelta:
+                mask = Mask.from_vars(cl.enumlhs, bindenv)
+                if mask.is_mixed:
+                    indexes.add((cl.enumrel, mask.maskstr))
+            bindenv.update(cl.enumvars)
+        return indexes
+    
+    def get_order(self, clauses, init_bounds=()):
+        clauses = tuple(clauses)
+        key = (clauses, frozenset(init_bounds))
+        order = self.chosen.get(key)
+        if order is None:
+            orders = self.get_orders(clauses, init_bounds=init_bounds)
+            # min() returns the first of several minimal items.
+            order = min(orders, key=lambda o: len(
+                        self.get_order_indexes(o, init_bounds) -
+                        self.indexes))
+            self.indexes.update(self.get_order_indexes(order, init_bounds))
+            self.chosen[key] = order
+        return order
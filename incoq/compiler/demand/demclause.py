@@ -10,6 +10,7 @@ __all__ = [
 from simplestruct import TypedField
 from simplestruct.type import checktype
 
+from incoq.util.faststruct import fast_struct
 import incoq.compiler.incast as L
 from incoq.compiler.set import Mask
 from incoq.compiler.comp import Rate, Clause
@@ -17,6 +18,7 @@ from incoq.compiler.comp.clause import (ABCStruct, ClauseFactory,
                                        apply_subst_tuple)
 
 
+@fast_struct
 class DemClause(Clause, ABCStruct):
     
     """An enumerator clause who's RHS is the result of a query with
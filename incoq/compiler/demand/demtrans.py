@@ -10,11 +10,12 @@ from operator import attrgetter
 
 import incoq.compiler.incast as L
 from incoq.compiler.comp import (make_inccomp, inc_relcomp_helper,
-                                inc_relcomp, inc_changetrack)
+                                inc_changetrack)
 
 from .demclause import DemClause
 from .tags import (make_structures, filter_comps,
-                   structures_to_comps, uset_to_comp)
+                   structures_to_comps, uset_to_comp,
+                   share_structures, register_structure)
 
 
 class OuterDemandMaintainer(L.OuterMaintTransformer):
@@ -66,6 +67,38 @@ class OuterDemandMaintainer(L.OuterMaintTransformer):
                                      (), postcode)
 
 
+class SharedTagMaintainer(L.OuterMaintTransformer):
+    
+    """Insert calls to the maintenance functions of a tag shared with
+    an earlier query after additions to and before removals from this
+    query's U-set, so that the tag also holds this U-set's values.
+    The functions keep the tag's reference counts, and the maintenance
+    of everything defined over the tag.
+    """
+    
+    def __init__(self, name, shared_uset, uset):
+        super().__init__(())
+        self.name = name
+        self.shared_uset = shared_uset
+        self.uset = uset
+    
+    def visit_SetUpdate(self, node):
+        if L.get_name(node.target) != self.uset:
+            return
+        
+        funcname = '_maint_{}_{}_{}'.format(self.name, self.shared_uset,
+                                            node.op)
+        code = L.pc('FUNC(ELEM)',
+                    subst={'FUNC': funcname,
+                           'ELEM': node.elem})
+        if node.op == 'add':
+            precode, postcode = (), code
+        else:
+            precode, postcode = code, ()
+        return self.with_outer_maint(node, self.name, L.ts(node),
+                                     precode, postcode)
+
+
 def deminc_relcomp(tree, manager, comp, compname):
     """Incrementalize a relational comprehension, add appropriate
     incrementalized demand structures, and rewrite the maint comps
@@ -80,6 +113,8 @@ def deminc_relcomp(tree, manager, comp, compname):
         force_uset = manager.options.get_opt('default_uset_force')
     
     subdem_tags = manager.options.get_opt('subdem_tags')
+    share = manager.options.get_opt('share_dem_structs')
+    uset_name = L.N.uset(compname)
     
     reorder = manager.options.get_queryopt(comp, 'demand_reorder')
     
@@ -98,6 +133,20 @@ def deminc_relcomp(tree, manager, comp, compname):
         print('  Tags/filters/usets: ' + ' ' * 31 +
               ', '.join(s.name for s in ds.structs))
     
+    # Find which tags and filters can reuse those of earlier queries.
+    # Those are already maintained, so the query's own maintenance must
+    # go outside theirs, just as it does for its own tags and filters.
+    # Augmented maintenance instead needs the demand structures to be
+    # outside the query's maintenance, so don't share then.
+    if share and not augmented:
+        shared = share_structures(structures_to_comps(ds, factory),
+                                  factory, manager.shared_structs,
+                                  uset_name)
+        inccomp.outsideinvs = tuple(sorted(
+                                set(s.name for s in shared.values())))
+    else:
+        shared = {}
+    
     # Eliminate Demand from clauses.
     new_clauses = []
     for cl in spec.join.clauses:
@@ -118,18 +167,49 @@ def deminc_relcomp(tree, manager, comp, compname):
                             use_tag_checks,
                             augmented=augmented, subdem_tags=subdem_tags)
     
-    manager.stats['dem structs'] += len(ds.structs)
+    # Refer to the shared structures in place of the remaining ones
+    # that reuse them.
+    demcomps = structures_to_comps(ds, factory)
+    aliases = {name: shared[name].name for name, _ in demcomps
+                                       if name in shared}
+    if len(aliases) > 0:
+        tree = L.VarRenamer.run(tree, aliases)
+    
+    manager.stats['dem structs'] += len(ds.structs) - len(aliases)
+    manager.stats['shared dem structs'] += len(aliases)
+    if verbose and len(aliases) > 0:
+        print('  Shared: ' + ' ' * 43 +
+              ', '.join('{} -> {}'.format(name, shared[name].name)
+                        for name, _ in demcomps if name in shared))
     
     # Incrementalize tags and filters.
-    demcomps = structures_to_comps(ds, factory)
     for name, comp in demcomps:
+        if name in shared:
+            # A shared tag over another query's U-set is maintained
+            # for this query's U-set too. Anything else that is shared
+            # is already maintained.
+            s = shared[name]
+            if s.uset is not None and s.uset != uset_name:
+                tree = SharedTagMaintainer.run(tree, s.name, s.uset,
+                                               uset_name)
+            continue
+        
+        comp = L.VarRenamer.run(comp, aliases)
         # When using augmented maintenance code, since the query
         # maintenance goes before an addition and after a removal,
         # make sure the demand invariant maintenance still comes
         # before and after that query maintenance respectively.
         outsideinvs = [compname] if augmented else []
-        tree = inc_relcomp(tree, manager, comp, name,
-                           outsideinvs=outsideinvs)
+        tag_inccomp = make_inccomp(tree, manager, comp, name,
+                                   outsideinvs=outsideinvs)
+        if share and not augmented:
+            # Other queries' U-sets may later contribute to a tag over
+            # this query's U-set, which takes reference counts.
+            s = register_structure(manager.shared_structs, name, comp,
+                                   factory, uset_name)
+            if s.uset is not None:
+                tag_inccomp.rc = 'yes'
+        tree, _comps = inc_relcomp_helper(tree, manager, tag_inccomp)
     
     # Take care of usets.
     usets = sorted(ds.usets, key=attrgetter('i'))
@@ -149,6 +229,7 @@ def deminc_relcomp(tree, manager, comp, compname):
         deltaname = L.N.deltaset(demname)
         
         uset_comp = uset_to_comp(ds, uset, factory, spec.join.clauses[0])
+        uset_comp = L.VarRenamer.run(uset_comp, aliases)
         tree = inc_changetrack(tree, manager, uset_comp, deltaname)
         
         tree = OuterDemandMaintainer.run(
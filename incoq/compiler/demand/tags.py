@@ -8,6 +8,8 @@ __all__ = [
     'structures_to_comps',
     'uset_to_comp',
     'filter_comps',
+    'share_structures',
+    'register_structure',
 ]
 
 
@@ -16,6 +18,7 @@ from operator import attrgetter
 
 from simplestruct import Struct, Field, TypedField
 
+from incoq.util.faststruct import fast_struct
 from incoq.compiler.set import Mask
 from incoq.compiler.comp import (Clause, EnumClause, inst_wildcards,
                                 Join, CompSpec)
@@ -29,6 +32,7 @@ KIND_FILTER = 'FILTER'
 KIND_USET = 'USET'
 
 
+@fast_struct
 class Tag(Struct):
     kind = KIND_TAG
     
@@ -47,6 +51,7 @@ class Tag(Struct):
     reorder_i = TypedField(int)
     """Relative order for demand graph."""
 
+@fast_struct
 class Filter(Struct):
     kind = KIND_FILTER
     
@@ -63,6 +68,7 @@ class Filter(Struct):
     reorder_i = TypedField(int)
     """Relative order for demand graph."""
 
+@fast_struct
 class USet(Struct):
     kind = KIND_USET
     
@@ -473,3 +479,75 @@ def filter_comps(tree, factory, ds, comps, use_tag_checks, *,
     
     prune_structures(ds, used_indices, subdem_tags=subdem_tags)
     return tree, ds
+
+
+class SharedStruct(Struct):
+    _immutable = False
+    
+    name = Field()
+    """Name of the tag or filter."""
+    key = Field()
+    """Definition of the structure, up to renaming of variables."""
+    uset = Field()
+    """If the structure is a tag over its query's U-set, the name of
+    that U-set, otherwise None.
+    """
+
+def get_struct_key(comp, factory, subst):
+    """Return a string identifying a tag or filter comprehension up
+    to renaming of its variables, after renaming the relations it is
+    defined over according to subst.
+    """
+    comp = L.VarRenamer.run(comp, subst)
+    spec = CompSpec.from_comp(comp, factory)
+    varsubst = {v: '_v{}'.format(i)
+                for i, v in enumerate(spec.join.enumvars, 1)}
+    return L.ts(L.VarRenamer.run(comp, varsubst))
+
+def is_uset_tag(comp, factory, uset):
+    """Return whether a tag or filter comprehension is a tag over the
+    given U-set.
+    """
+    clauses = CompSpec.from_comp(comp, factory).join.clauses
+    return len(clauses) == 1 and clauses[0].enumrel == uset
+
+def share_structures(demcomps, factory, shared, uset):
+    """Match a query's tags and filters against those of earlier
+    queries. demcomps is a list of pairs of names and comprehensions,
+    in dependency order, as returned by structures_to_comps(). shared
+    is a map from keys to the SharedStructs of earlier queries, and
+    uset is the name of this query's U-set.
+    
+    Return a map from the names of the structures that can reuse an
+    earlier one to its SharedStruct. A structure can reuse one that
+    has the same definition up to renaming of variables, after the
+    structures it is defined over are replaced by the ones they
+    reuse. A tag over this query's U-set can also reuse one over
+    another query's U-set, in which case the shared tag holds the
+    values demanded by either query.
+    """
+    result = {}
+    aliases = {}
+    for name, comp in demcomps:
+        subst = dict(aliases)
+        subst[uset] = '_U_'
+        rootkey = get_struct_key(comp, factory, subst)
+        s = shared.get(rootkey)
+        if s is None:
+            continue
+        if (get_struct_key(comp, factory, aliases) == s.key or
+            (s.uset is not None and is_uset_tag(comp, factory, uset))):
+            result[name] = s
+            aliases[name] = s.name
+    return result
+
+def register_structure(shared, name, comp, factory, uset):
+    """Record a tag or filter that is incrementalized for a query, so
+    that later queries may reuse it. Return its SharedStruct.
+    """
+    rootkey = get_struct_key(comp, factory, {uset: '_U_'})
+    key = get_struct_key(comp, factory, {})
+    s = SharedStruct(name, key,
+                     uset if is_uset_tag(comp, factory, uset) else None)
+    shared.setdefault(rootkey, s)
+    return s
@@ -19,6 +19,7 @@ from .error import *
 from .types import *
 from .typeeval import *
 from .helpers import *
+from .summary import *
 from .util import *
 from .nodeconv import *
 from .macros import *
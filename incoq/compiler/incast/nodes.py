@@ -11,6 +11,8 @@ __all__ = [
 from simplestruct import Field
 from iast import NodeTransformer
 
+from incoq.util.faststruct import enable_fast_construction
+
 from .nodes_untyped import (__all__ as untyped_all, native_nodes,
                             incast_nodes as incast_nodes_untyped)
 
@@ -37,6 +39,13 @@ for name, node in incast_nodes.items():
 
 globals().update(incast_nodes)
 
+# Skip per-field type checks when constructing nodes, unless struct
+# checking is turned on (see incoq.util.faststruct). This must come
+# after the typed nodes are generated above, since they copy the
+# namespaces of their untyped versions.
+enable_fast_construction(incast_nodes_untyped.values())
+enable_fast_construction(incast_nodes.values())
+
 
 class TypeAdder(NodeTransformer):
     
@@ -9,6 +9,7 @@ __all__ = [
     
     'parse_structast',
     'unparse_structast',
+    'parse_cache',
     
     # Re-exported from iast directly.
     'trim',
@@ -134,17 +135,63 @@ def export_structast(tree):
     return StructExporter.run(tree)
 
 
+class ParseCache:
+    
+    """Memo of parsed source text, keyed by the text and the parsing
+    mode. Code generators parse the same template text over and over
+    with different substitutions. Since ASTs are immutable, the tree
+    from before substitution can be shared by every use.
+    
+    Only sources of at most max_len characters are cached, so that
+    whole input programs are not kept alive. If the cache grows past
+    max_size entries it is emptied.
+    """
+    
+    max_len = 2000
+    max_size = 10000
+    
+    def __init__(self):
+        self.trees = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, source, mode, patterns):
+        """Return the parsed tree for source, before substitution."""
+        cacheable = len(source) <= self.max_len
+        key = (source, mode, patterns)
+        if cacheable:
+            tree = self.trees.get(key)
+            if tree is not None:
+                self.hits += 1
+                return tree
+        
+        self.misses += 1
+        tree = _parse(source)
+        tree = TypeAdder.run(tree)
+        tree = extract_tree(tree, mode)
+        if patterns:
+            tree = make_pattern(tree)
+        
+        if cacheable:
+            if len(self.trees) >= self.max_size:
+                self.trees.clear()
+            self.trees[key] = tree
+        return tree
+    
+    def clear(self):
+        self.trees.clear()
+        self.hits = self.misses = 0
+
+parse_cache = ParseCache()
+
+
 def parse_structast(source, *, mode=None, subst=None, patterns=False,
                     types=True):
     """Version of iast.python.native.parse() that also runs
     extract_tree(), subst(), and can be used on patterns.
     Type information for expressions is set to None.
     """
-    tree = _parse(source)
-    tree = TypeAdder.run(tree)
-    tree = extract_tree(tree, mode)
-    if patterns:
-        tree = make_pattern(tree)
+    tree = parse_cache.get(source, mode, patterns)
     if subst is not None:
         tree = Templater.run(tree, subst)
     return tree
@@ -0,0 +1,168 @@
+"""Cached summaries of subtrees: the kinds of nodes that occur in
+them, their structural hashes, and the queries they contain. Also
+visitors that use these summaries to skip subtrees.
+"""
+
+
+__all__ = [
+    'kinds_mask',
+    'subtree_kinds',
+    'contains_kinds',
+    'struct_hash',
+    'query_hashes',
+    'SkippingNodeVisitor',
+    'SkippingNodeTransformer',
+]
+
+
+import iast
+
+from .structconv import NodeVisitor, NodeTransformer
+
+
+# Each node kind (class name) is assigned a bit the first time it
+# is seen. A summary is the bitwise or of the bits of all nodes in
+# a subtree. Since nodes are immutable, a node's summary is computed
+# once and cached in the node's _kinds attribute (which is not a
+# field, so it does not participate in equality, hashing, pickling,
+# or _replace()). A node created by a transformation only needs to
+# combine the cached summaries of its children, so keeping summaries
+# up to date costs time proportional to the number of new nodes.
+#
+# As with NodeVisitor, only tuples are descended into, not other
+# kinds of sequences.
+
+_kind_bits = {}
+
+def kind_bit(name):
+    """Return the bit for the node kind with the given name."""
+    bit = _kind_bits.get(name)
+    if bit is None:
+        bit = _kind_bits[name] = 1 << len(_kind_bits)
+    return bit
+
+def kinds_mask(names):
+    """Return the summary mask for a sequence of node kind names."""
+    mask = 0
+    for name in names:
+        mask |= kind_bit(name)
+    return mask
+
+def subtree_kinds(tree):
+    """Return the summary mask for a node or tuple of nodes."""
+    if isinstance(tree, iast.AST):
+        mask = tree.__dict__.get('_kinds')
+        if mask is None:
+            mask = kind_bit(tree.__class__.__name__)
+            for field in tree._fields:
+                mask |= subtree_kinds(getattr(tree, field))
+            tree._kinds = mask
+        return mask
+    elif isinstance(tree, tuple):
+        mask = 0
+        for item in tree:
+            mask |= subtree_kinds(item)
+        return mask
+    else:
+        return 0
+
+def contains_kinds(tree, names):
+    """Return whether a node of one of the named kinds occurs in
+    tree.
+    """
+    return bool(subtree_kinds(tree) & kinds_mask(names))
+
+# Structural hashes are cached the same way, in the _hash attribute.
+# Equal trees have equal structural hashes, so comparing hashes first
+# lets comparisons of distinct trees fail fast, without the repeated
+# deep walks of Struct.__hash__() and Struct.__eq__().
+
+def struct_hash(tree):
+    """Return a hash of a node or tuple of nodes that is consistent
+    with structural equality.
+    """
+    if isinstance(tree, iast.AST):
+        h = tree.__dict__.get('_hash')
+        if h is None:
+            h = hash((tree.__class__.__name__,) +
+                     tuple(struct_hash(getattr(tree, field))
+                           for field in tree._fields))
+            tree._hash = h
+        return h
+    elif isinstance(tree, (tuple, list)):
+        return hash(tuple(struct_hash(item) for item in tree))
+    else:
+        try:
+            return hash(tree)
+        except TypeError:
+            return hash(type(tree).__name__)
+
+_query_mask = kinds_mask(['Comp', 'Aggregate'])
+_no_queries = frozenset()
+
+def query_hashes(tree):
+    """Return the set of structural hashes of the queries (Comp and
+    Aggregate nodes) occurring in a node or tuple of nodes.
+    """
+    if not subtree_kinds(tree) & _query_mask:
+        return _no_queries
+    if isinstance(tree, iast.AST):
+        hashes = tree.__dict__.get('_qhashes')
+        if hashes is None:
+            hashes = set()
+            if tree.__class__.__name__ in ['Comp', 'Aggregate']:
+                hashes.add(struct_hash(tree))
+            for field in tree._fields:
+                hashes.update(query_hashes(getattr(tree, field)))
+            hashes = tree._qhashes = frozenset(hashes)
+        return hashes
+    else:
+        hashes = set()
+        for item in tree:
+            hashes.update(query_hashes(item))
+        return hashes
+
+
+class SkippingMixin:
+    
+    """Mixin for visitors whose only behavior is in their handlers.
+    A subtree that contains no node of a kind the visitor has a
+    handler for is skipped, as if visited with generic_visit()
+    throughout.
+    
+    The relevant kinds are taken from the names of the visit_*
+    methods, unless the class attribute relevant_kinds is given.
+    The subclass must not override generic_visit() or the other
+    dispatch methods.
+    """
+    
+    relevant_kinds = None
+    
+    @classmethod
+    def get_relevant_mask(cls):
+        mask = cls.__dict__.get('_relevant_mask')
+        if mask is None:
+            names = cls.relevant_kinds
+            if names is None:
+                names = [attr[len('visit_'):] for attr in dir(cls)
+                         if attr.startswith('visit_')]
+            mask = kinds_mask(names)
+            cls._relevant_mask = mask
+        return mask
+    
+    def node_visit(self, node):
+        if not subtree_kinds(node) & self.get_relevant_mask():
+            return self.skipped(node)
+        return super().node_visit(node)
+
+
+class SkippingNodeVisitor(SkippingMixin, NodeVisitor):
+    
+    def skipped(self, node):
+        return None
+
+
+class SkippingNodeTransformer(SkippingMixin, NodeTransformer):
+    
+    def skipped(self, node):
+        return node
@@ -12,7 +12,7 @@ from incoq.util.seq import pairs
 
 from .nodes import (Load, Store, Not, Eq, NotEq, Lt, LtE, Gt, GtE,
                     Is, IsNot, In, NotIn, Enumerator, expr, Name,
-                    BitOr, BitXor, BitAnd)
+                    BitOr, BitXor, BitAnd, Module)
 from .structconv import AdvNodeTransformer
 from .error import ProgramError
 from .util import VarsFinder
@@ -542,6 +542,18 @@ class TypeAnalyzer(AdvNodeTransformer):
 
 
 def analyze_types(tree, vartypes=None):
+    """Analyze a tree, returning the tree with type information filled
+    in, and the final store.
+    
+    Analysis runs in rounds over the top-level statements (including
+    whole function definitions) until a round makes no change, with
+    the store widened after each round. A statement is re-analyzed
+    only if the types of the variables it mentions are different
+    from when it was last analyzed, or its last analysis changed
+    them. Otherwise, analyzing it again could not change anything,
+    so the results are the same as analyzing the whole tree in
+    every round.
+    """
     if vartypes is None:
         vartypes = {}
     
@@ -554,19 +566,40 @@ def analyze_types(tree, vartypes=None):
         for n, t in store.items():
             store[n] = t.widen(10)
     
+    is_module = isinstance(tree, Module)
+    units = list(tree.body) if is_module else [tree]
+    unitvars = [VarsFinder.run(unit) for unit in units]
+    # For each unit, the types of its variables after its last
+    # analysis, if that analysis did not change them, or None.
+    stable = [None] * len(units)
+    
+    def get_types(i):
+        return [store.get(var) for var in unitvars[i]]
+    
     count = 0
     limit = 10
-    oldtree = None
+    changed = True
     while count < limit:
-        if tree == oldtree:
+        if not changed:
             break
-        oldtree = tree
-        tree = TypeAnalyzer.run(tree, store)
+        changed = False
+        for i, unit in enumerate(units):
+            before = get_types(i)
+            if stable[i] == before:
+                continue
+            new_unit = TypeAnalyzer.run(unit, store)
+            after = get_types(i)
+            stable[i] = after if after == before else None
+            if not changed and new_unit != unit:
+                changed = True
+            units[i] = new_unit
         widen(store)
         count += 1
     else:
         print('Type analysis cut off after {} iterations'.format(count))
     
+    tree = tree._replace(body=tuple(units)) if is_module else units[0]
+    
 #    for k, v in store.items():
 #        print('  {} -- {}'.format(k, v))
     
@@ -2,6 +2,7 @@
 
 
 __all__ = [
+    'count_nodes',
     'VarsFinder',
     'VarRenamer',
     'ScopeVisitor',
@@ -9,6 +10,7 @@ __all__ = [
     'NameGenerator',
     'is_injective',
     'QueryReplacer',
+    'OuterQueryChecker',
     'QueryMapper',
     'StmtTransformer',
     'OuterMaintTransformer',
@@ -18,6 +20,8 @@ __all__ = [
     'elim_deadfuncs',
     'N',
     'DemfuncMaker',
+    'DeltaLogger',
+    'DeferMaker',
 ]
 
 
@@ -31,9 +35,25 @@ from incoq.util.collections import OrderedSet
 from .helpers import is_vartuple, get_vartuple, get_plainfuncdef, plainfuncdef
 from .nodes import *
 from .structconv import NodeVisitor, NodeTransformer, Templater
+from .summary import (kinds_mask, subtree_kinds, struct_hash, query_hashes,
+                      SkippingNodeVisitor, SkippingNodeTransformer)
 
 
-class VarsFinder(NodeVisitor):
+def count_nodes(tree):
+    """Return the number of AST nodes in a tree or sequence of trees."""
+    count = 0
+    stack = [tree]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, iast.AST):
+            count += 1
+            stack.extend(getattr(item, f) for f in item._fields)
+        elif isinstance(item, (tuple, list)):
+            stack.extend(item)
+    return count
+
+
+class VarsFinder(SkippingNodeVisitor):
     
     """Simple finder of variables (Name nodes).
     
@@ -325,24 +345,62 @@ class QueryReplacer(NodeTransformer):
     
     """Replace each occurrence of one query with another."""
     
+    # Only subtrees that contain a query with the same structural
+    # hash as from_query are visited, so the cost is proportional to
+    # the number of matches and their depth, once the subtree
+    # summaries are computed.
+    
     def __init__(self, from_query, to_query):
         super().__init__()
         self.from_query = from_query
         self.to_query = to_query
+        self.from_hash = struct_hash(from_query)
     
-    def visit_Comp(self, node):
-        if node == self.from_query:
-            return self.to_query
-        else:
-            return self.generic_visit(node)
+    def node_visit(self, node):
+        if self.from_hash not in query_hashes(node):
+            return node
+        return super().node_visit(node)
     
-    def visit_Aggregate(self, node):
-        if node == self.from_query:
+    def helper(self, node):
+        if (struct_hash(node) == self.from_hash and
+            node == self.from_query):
             return self.to_query
         else:
             return self.generic_visit(node)
+    
+    visit_Comp = helper
+    visit_Aggregate = helper
 
-class QueryMapper(NodeTransformer):
+class OuterQueryChecker(NodeVisitor):
+    
+    """Return whether every occurrence of a query is outside of other
+    queries, so that nothing but its retrieval reads its result.
+    """
+    
+    def __init__(self, query):
+        super().__init__()
+        self.query = query
+    
+    def process(self, tree):
+        self.depth = 0
+        self.outer = True
+        super().process(tree)
+        return self.outer
+    
+    def helper(self, node):
+        if node == self.query:
+            if self.depth > 0:
+                self.outer = False
+            return
+        
+        self.depth += 1
+        self.generic_visit(node)
+        self.depth -= 1
+    
+    visit_Comp = helper
+    visit_Aggregate = helper
+
+class QueryMapper(SkippingNodeTransformer):
     
     """For each unique query, replace all occurrences of that query
     with the result of the methods map_Comp() or map_Aggregate(),
@@ -358,7 +416,8 @@ class QueryMapper(NodeTransformer):
     
     def __init__(self):
         super().__init__()
-        # Replacement mapping.
+        # Replacement mapping, from structural hash to list of pairs
+        # of query and its replacement.
         self.comps = {}
         self.aggrs = {}
     
@@ -374,10 +433,14 @@ class QueryMapper(NodeTransformer):
         if handler is None:
             return node
         
-        repl = replmap.get(node, None)
-        if repl is None:
-            repl = handler(node)
-            replmap[node] = repl
+        # Key by structural hash, to avoid the deep walk of
+        # Struct.__hash__().
+        entries = replmap.setdefault(struct_hash(node), [])
+        for orig, repl in entries:
+            if orig == node:
+                return repl
+        repl = handler(node)
+        entries.append((node, repl))
         
         return repl
     
@@ -689,6 +752,9 @@ class MaintFinder(NodeVisitor):
             return False
     
     def node_visit(self, node):
+        # Subtrees without Maintenance nodes need not be visited.
+        if not subtree_kinds(node) & kinds_mask(['Maintenance']):
+            return False
         hasmaint = super().node_visit(node)
         if hasmaint:
             self.result.add(id(node))
@@ -851,6 +917,22 @@ class N:
     @classmethod
     def deltaset(cls, n):
         return n + '_delta'
+    
+    @classmethod
+    def deltalog(cls, n):
+        return '_DL_' + n
+    
+    @classmethod
+    def pendingdeltas(cls, n):
+        return '_PD_' + n
+    
+    @classmethod
+    def querycache(cls, n):
+        return '_QC_' + n
+    
+    @classmethod
+    def computefunc(cls, n):
+        return 'compute_' + n
 
 
 class DemfuncMaker:
@@ -971,3 +1053,115 @@ class DemfuncMaker:
                 self.make_undemfunc() +
                 self.make_queryfunc())
         return code
+
+
+class DeltaLogger(NodeTransformer):
+    
+    """Follow each addition to or removal from a query's result set
+    with code to publish the change to the query's delta log (named
+    by N.deltalog()). Reference count updates do not change the result
+    and are not published.
+    
+    If the updated element is not a simple expression, it is first
+    bound to a variable beginning with the given prefix, so that it
+    is evaluated only once.
+    """
+    
+    def __init__(self, resname, prefix):
+        super().__init__()
+        self.resname = resname
+        self.prefix = prefix
+    
+    @classmethod
+    def make_logvar(cls, name, capacity):
+        """Return code to initialize the delta log for a query."""
+        from . import pc
+        return pc('''
+            LOG = DeltaLog(NAME, CAPACITY)
+            ''', subst={'LOG': N.deltalog(name),
+                        'NAME': Str(name),
+                        'CAPACITY': Num(capacity)})
+    
+    def is_simple(self, node):
+        if isinstance(node, (Name, Num, Str, NameConstant)):
+            return True
+        elif isinstance(node, Tuple):
+            return all(self.is_simple(e) for e in node.elts)
+        else:
+            return False
+    
+    def visit_SetUpdate(self, node):
+        node = self.generic_visit(node)
+        if not (node.is_varupdate() and node.target.id == self.resname):
+            return node
+        
+        from . import pc, ln
+        precode = ()
+        if not self.is_simple(node.elem):
+            var = self.prefix + 'delem'
+            precode = pc('''
+                S_VAR = ELEM
+                ''', subst={'S_VAR': var, 'ELEM': node.elem})
+            node = node._replace(elem=ln(var))
+        
+        postcode = pc('''
+            LOG.publish(OP, ELEM)
+            ''', subst={'LOG': N.deltalog(self.resname),
+                        'OP': Str(node.op),
+                        'ELEM': node.elem})
+        return precode + (node,) + postcode
+
+
+class DeferMaker:
+    
+    """Generates code for a query using deferred maintenance. Instead
+    of running the maintenance for an operand update right away, the
+    update is handed to the query's PendingDeltas structure (named by
+    N.pendingdeltas()), which runs the maintenance functions later,
+    before the result is read.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        """Query name."""
+        self.pdname = N.pendingdeltas(name)
+        """Name of pending delta structure."""
+    
+    def make_init(self, limit):
+        """Return code to initialize the pending delta structure."""
+        from . import pc
+        return pc('''
+            PD = PendingDeltas(LIMIT)
+            ''', subst={'PD': self.pdname,
+                        'LIMIT': Num(limit)})
+    
+    def make_defer(self, rel, op, elem, func):
+        """Return code to defer the maintenance function func for the
+        given update to an operand. The code must run before the
+        update itself.
+        """
+        from . import pc
+        return pc('''
+            PD.defer(REL, OP, ELEM, FUNC)
+            ''', subst={'PD': self.pdname,
+                        'REL': Str(rel),
+                        'OP': Str(op),
+                        'ELEM': elem,
+                        'FUNC': func})
+    
+    def make_flush(self):
+        """Return code to run all deferred maintenance."""
+        from . import pc
+        return pc('''
+            PD.flush()
+            ''', subst={'PD': self.pdname})
+    
+    def make_flushed(self, value):
+        """Return an expression that runs all deferred maintenance
+        and then evaluates to value.
+        """
+        from . import pe
+        return pe('''
+            PD.flushed(VALUE)
+            ''', subst={'PD': self.pdname,
+                        'VALUE': value})
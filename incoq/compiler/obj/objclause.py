@@ -15,6 +15,7 @@ __all__ = [
 from simplestruct.type import checktype
 from simplestruct import Field
 
+from incoq.util.faststruct import fast_struct
 import incoq.compiler.incast as L
 from incoq.compiler.set import Mask
 from incoq.compiler.comp import (ClauseFactory, Rate, EnumClause)
@@ -25,6 +26,7 @@ from .pairrel import (is_mrel, make_mrel, is_frel, get_frel_field, make_frel,
                       is_maprel, make_maprel)
 
 
+@fast_struct
 class MClause(EnumClause, ABCStruct):
     
     """An enumerator over the M-set."""
@@ -96,6 +98,7 @@ class MClause(EnumClause, ABCStruct):
         return mset_bindmatch(mask, bvars, uvars, body,
                               typecheck=self.typecheck)
 
+@fast_struct
 class MClause_NoTC(MClause):
     
     """MClause without type checks in emitted code."""
@@ -106,6 +109,7 @@ class MClause_NoTC(MClause):
     typecheck = False
 
 
+@fast_struct
 class FClause(EnumClause, ABCStruct):
     
     """An enumerator over an F-set."""
@@ -188,6 +192,7 @@ class FClause(EnumClause, ABCStruct):
         return fset_bindmatch(self.field, mask, bvars, uvars, body,
                               typecheck=self.typecheck)
 
+@fast_struct
 class FClause_NoTC(FClause):
     
     """FClause without type checks in emitted code."""
@@ -199,6 +204,7 @@ class FClause_NoTC(FClause):
     typecheck = False
 
 
+@fast_struct
 class MapClause(EnumClause, ABCStruct):
     
     """An enumerator over the MAP set."""
@@ -274,6 +280,7 @@ class MapClause(EnumClause, ABCStruct):
         return mapset_bindmatch(mask, bvars, uvars, body,
                                 typecheck=self.typecheck)
 
+@fast_struct
 class MapClause_NoTC(MapClause):
     
     """MapClause without type checks in emitted code."""
@@ -43,6 +43,15 @@ def make_vareq_cond(eqs):
     return eqcond
 
 
+def is_containers_spec(manager, spec):
+    """Return whether an auxmap is the reverse membership map over
+    the M-set that is kept intrusively in set elements (see the
+    obj_containers option).
+    """
+    # Spelled out to avoid a circular import of incoq.compiler.obj.
+    return (manager.options.get_opt('obj_containers') and
+            spec.rel == '_M' and spec.mask == Mask.IN)
+
 def make_auxmap_maint_code(manager, spec, elem, addremove):
     """Construct auxmap maintenance code for a set update."""
     assert addremove in ['add', 'remove']
@@ -59,6 +68,19 @@ def make_auxmap_maint_code(manager, spec, elem, addremove):
     bvars_node = L.tuplify(bvars)
     uvars_node = L.tuplify(uvars)
     
+    if is_containers_spec(manager, spec):
+        func = {'add': 'addcontainer',
+                'remove': 'removecontainer'}[addremove]
+        return L.pc('''
+            VARS = ELEM
+            FUNC(BVARS, UVARS, MAP)
+            ''', subst={'VARS': vars_node,
+                        'ELEM': elem,
+                        'FUNC': L.ln(func),
+                        'BVARS': bvars_node,
+                        'UVARS': uvars_node,
+                        'MAP': map_node})
+    
     # If there are equalities, include a conditional check for the
     # constraints being satisfied. If there are wildcards, make the
     # image set manipulation operations reference-counted.
@@ -188,6 +210,12 @@ class MapqueryReplacer(L.NodeTransformer):
         if spec != self.spec:
             return node
         
+        if is_containers_spec(self.manager, self.spec):
+            return L.pe('''
+                getcontainers(BOUNDS, MAP)
+                ''', subst={'BOUNDS': bounds,
+                            'MAP': L.ln(self.spec.map_name)})
+        
         lookup = ('rcimglookup' if self.spec.mask.has_wildcards
                   else 'imglookup')
         
@@ -37,6 +37,7 @@ __all__ = [
 from simplestruct import Struct, Field
 from simplestruct.type import checktype, checktype_seq
 
+from incoq.util.faststruct import fast_struct
 import incoq.compiler.incast as L
 
 
@@ -330,6 +331,7 @@ Mask.BW = Mask('bw')
 Mask.U = Mask('u')
 
 
+@fast_struct
 class AuxmapSpec(Struct):
     
     rel = Field(str)
@@ -11,6 +11,7 @@ __all__ = [
 from simplestruct.type import checktype
 from simplestruct import TypedField
 
+from incoq.util.faststruct import fast_struct
 import incoq.compiler.incast as L
 from incoq.compiler.set import Mask
 from incoq.compiler.comp import (ClauseFactory, Rate, EnumClause,
@@ -19,6 +20,7 @@ from incoq.compiler.comp import (ClauseFactory, Rate, EnumClause,
 from .tuprel import is_trel, get_trel, make_trel, trel_bindmatch
 
 
+@fast_struct
 class TClause(EnumClause):
     
     """An enumerator over a tuple relation."""
@@ -126,6 +128,7 @@ class TClause(EnumClause):
                               mask, self.lhs, body,
                               typecheck=self.typecheck)
 
+@fast_struct
 class TClause_NoTC(TClause):
     
     """TClause without type checks in emitted code."""
@@ -11,3 +11,6 @@ output programs.
 
 # Exports.
 from .runtimelib import *
+from .columnar import *
+from .sampler import *
+from .snapshot import *
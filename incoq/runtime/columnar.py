@@ -0,0 +1,556 @@
+"""Column-oriented storage for flat relations."""
+
+
+__all__ = [
+    'HAVE_NUMPY',
+    'ColumnSet',
+]
+
+
+from array import array
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+from .runtimelib import Type, Set, Map, TAG_COLUMNS, tupify
+
+
+class ColumnSet(Type):
+    
+    """A set of tuples of a fixed arity, stored by column. Every
+    component value is interned as a small integer ID, and each column
+    is a compact array of IDs, so a row costs a few machine words
+    rather than a tuple object and its contents. Rows are materialized
+    as tuples only when iterated over or returned from a query.
+    
+    setmatch() over a ColumnSet scans the columns directly, using
+    NumPy when it is available. Aggregates over images use an index
+    from each key to its rows, which is built in one pass the first
+    time a mask is aggregated over and then kept up to date, so that
+    an aggregate costs time proportional to its image. Aggregate
+    results are cached per key until that key's image changes.
+    
+    Elements that are not tuples of the right arity cannot be added.
+    The arity is fixed by the first element added, unless given to
+    the constructor.
+    
+    Interned values are never released, even after every row that
+    used them is removed.
+    """
+    
+    # The ID of each row is used as the key of the row index, with
+    # the IDs of its components packed into one integer.
+    
+    __slots__ = ('arity', 'columns', 'index', 'ids', 'values',
+                 'version', '_valarray', '_numvalues', '_groups',
+                 '__weakref__')
+    
+    _tag = TAG_COLUMNS
+    
+    IDBITS = 32
+    
+    def __init__(self, arity=None):
+        self.arity = arity
+        self.columns = ([array('q') for _ in range(arity)]
+                        if arity is not None else None)
+        self.index = {}
+        """Map from packed row key to row number."""
+        self.ids = {}
+        """Map from interned value to its ID."""
+        self.values = []
+        """List of interned values, indexed by ID."""
+        self.version = 0
+        """Number of updates made."""
+        self._valarray = None
+        """NumPy object array copy of values, or None."""
+        self._numvalues = None
+        """Numeric NumPy copies of values (see _numeric_values()), or
+        None.
+        """
+        self._groups = {}
+        """Map from mask to its group index (see _group_index())."""
+    
+    def __repr__(self):
+        return 'ColumnSet(' + repr(set(self)) + ')'
+    
+    # ---- Rows ----
+    
+    def _check(self, item):
+        if self.arity is None:
+            if not (isinstance(item, tuple) and len(item) > 0):
+                raise TypeError('ColumnSet element must be a non-empty '
+                                'tuple: ' + repr(item))
+            self.arity = len(item)
+            self.columns = [array('q') for _ in range(self.arity)]
+        elif not (isinstance(item, tuple) and len(item) == self.arity):
+            raise TypeError('ColumnSet element must be a tuple of '
+                            'arity {}: {!r}'.format(self.arity, item))
+    
+    def _intern(self, value):
+        id = self.ids.get(value)
+        if id is None:
+            id = len(self.values)
+            assert id < 2 ** self.IDBITS
+            self.ids[value] = id
+            self.values.append(value)
+        return id
+    
+    def _pack(self, rowids):
+        key = 0
+        for id in reversed(rowids):
+            key = (key << self.IDBITS) | id
+        return key
+    
+    def _lookup_key(self, item):
+        """Return the packed key for a tuple without interning its
+        components, or None if it cannot be in the set.
+        """
+        if not (isinstance(item, tuple) and len(item) == self.arity):
+            return None
+        rowids = []
+        for value in item:
+            id = self.ids.get(value)
+            if id is None:
+                return None
+            rowids.append(id)
+        return self._pack(rowids)
+    
+    def _row(self, r):
+        values = self.values
+        return tuple(values[col[r]] for col in self.columns)
+    
+    # ---- Set interface ----
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def __contains__(self, item):
+        key = self._lookup_key(item)
+        return key is not None and key in self.index
+    
+    def __iter__(self):
+        for r in range(len(self.index)):
+            yield self._row(r)
+    
+    def add(self, item):
+        self._check(item)
+        rowids = [self._intern(value) for value in item]
+        key = self._pack(rowids)
+        if key in self.index:
+            return
+        r = self.index[key] = len(self.index)
+        for col, id in zip(self.columns, rowids):
+            col.append(id)
+        self.version += 1
+        for entry in self._groups.values():
+            self._group_add(entry, rowids, r)
+    
+    def remove(self, item):
+        key = self._lookup_key(item)
+        if key is None or key not in self.index:
+            raise KeyError(item)
+        r = self.index.pop(key)
+        last = len(self.index)
+        for entry in self._groups.values():
+            self._group_remove(entry, [col[r] for col in self.columns], r)
+        if r != last:
+            # Move the last row into the vacated one.
+            rowids = [col[last] for col in self.columns]
+            for col, id in zip(self.columns, rowids):
+                col[r] = id
+            self.index[self._pack(rowids)] = r
+            for entry in self._groups.values():
+                self._group_move(entry, rowids, last, r)
+        for col in self.columns:
+            col.pop()
+        self.version += 1
+    
+    # Aliased in order to bypass transformation, as for Set.
+    _add = add
+    _remove = remove
+    
+    def update(self, items):
+        for item in items:
+            self.add(item)
+    
+    def clear(self):
+        if self.arity is not None:
+            self.columns = [array('q') for _ in range(self.arity)]
+        self.index.clear()
+        self._groups.clear()
+        self.version += 1
+    
+    def get_structure_size(self):
+        return len(self)
+    
+    def __getstate__(self):
+        return (self.arity, list(self))
+    
+    def __setstate__(self, state):
+        arity, items = state
+        ColumnSet.__init__(self, arity)
+        self.update(items)
+    
+    # ---- Queries ----
+    
+    def _parse_mask(self, mask, key):
+        """Return a triple of a list of pairs (column, ID) for the
+        bound components, a list of pairs of columns that must be
+        equal, and a list of the unbound columns. Return None if
+        nothing can match.
+        """
+        if self.arity is None or len(mask) != self.arity:
+            return None
+        bpos = [j for j, c in enumerate(mask) if c == 'b']
+        if len(bpos) == 1:
+            bvals = (key,)
+        elif isinstance(key, tuple) and len(key) == len(bpos):
+            bvals = key
+        else:
+            return None
+        bound = []
+        for j, value in zip(bpos, bvals):
+            id = self.ids.get(value)
+            if id is None:
+                return None
+            bound.append((j, id))
+        eqs = [(j, int(c) - 1) for j, c in enumerate(mask) if c.isdigit()]
+        upos = [j for j, c in enumerate(mask) if c == 'u']
+        return bound, eqs, upos
+    
+    def match(self, mask, key):
+        """Return a Set of the unbound parts of the rows that match a
+        mask and key, as for setmatch(). The mask must already be
+        normalized.
+        """
+        parsed = self._parse_mask(mask, key)
+        if parsed is None or len(self) == 0:
+            return Set()
+        if HAVE_NUMPY:
+            return self._match_numpy(*parsed)
+        else:
+            return self._match_python(*parsed)
+    
+    def _match_python(self, bound, eqs, upos):
+        cols = self.columns
+        values = self.values
+        bound = [(cols[j], id) for j, id in bound]
+        eqs = [(cols[j], cols[k]) for j, k in eqs]
+        ucols = [cols[j] for j in upos]
+        
+        result = Set()
+        for r in range(len(self)):
+            if (all(col[r] == id for col, id in bound) and
+                all(col1[r] == col2[r] for col1, col2 in eqs)):
+                result.add(tupify([values[col[r]] for col in ucols]))
+        return result
+    
+    def _value_array(self):
+        """Return a NumPy object array of the interned values."""
+        old = self._valarray
+        n = len(self.values)
+        if old is None or len(old) != n:
+            new = np.empty(n, dtype=object)
+            start = 0
+            if old is not None:
+                start = len(old)
+                new[:start] = old
+            # Assign one by one, so that tuple values aren't
+            # broadcast.
+            for i in range(start, n):
+                new[i] = self.values[i]
+            self._valarray = new
+        return self._valarray
+    
+    def _column_views(self):
+        # Views share memory with the arrays, which cannot be resized
+        # while a view exists, so callers must not keep them.
+        return [np.frombuffer(col, dtype=np.int64) for col in self.columns]
+    
+    def _match_numpy(self, bound, eqs, upos):
+        cols = self._column_views()
+        sel = np.ones(len(self), dtype=bool)
+        for j, id in bound:
+            sel &= cols[j] == id
+        for j, k in eqs:
+            sel &= cols[j] == cols[k]
+        rows = np.flatnonzero(sel)
+        
+        if len(upos) == 0:
+            return Set([()]) if len(rows) > 0 else Set()
+        vals = self._value_array()
+        ucols = [vals[cols[j][rows]].tolist() for j in upos]
+        del cols
+        if len(ucols) == 1:
+            return Set(ucols[0])
+        else:
+            return Set(zip(*ucols))
+    
+    # ---- Aggregates ----
+    
+    # A group index for a mask is a tuple (bpos, eqs, upos, groups,
+    # results). bpos, eqs, and upos are as for _parse_mask(), groups
+    # maps the IDs of the bound components of each row satisfying
+    # the equalities to the set of those rows, and results maps each
+    # op to a dictionary of the cached aggregates of some keys.
+    
+    _aggr_funcs = {'count': len, 'sum': sum, 'min': min, 'max': max}
+    
+    @staticmethod
+    def _mask_positions(mask):
+        bpos = [j for j, c in enumerate(mask) if c == 'b']
+        eqs = [(j, int(c) - 1) for j, c in enumerate(mask) if c.isdigit()]
+        upos = [j for j, c in enumerate(mask) if c == 'u']
+        return bpos, eqs, upos
+    
+    def _group_index(self, mask):
+        """Return the group index for a mask, building it if needed.
+        Return None if no row can match the mask.
+        """
+        entry = self._groups.get(mask)
+        if entry is not None:
+            return entry
+        if self.arity is None or len(mask) != self.arity:
+            return None
+        
+        bpos, eqs, upos = self._mask_positions(mask)
+        groups = {}
+        if HAVE_NUMPY and len(self) > 0:
+            cols = self._column_views()
+            sel = np.ones(len(self), dtype=bool)
+            for j, k in eqs:
+                sel &= cols[j] == cols[k]
+            rows = np.flatnonzero(sel)
+            if len(rows) > 0:
+                codes, first = self._codes(cols, bpos, rows)
+                order = np.argsort(codes, kind='stable')
+                bounds = np.cumsum(np.bincount(codes))[:-1]
+                keyids = [cols[j][rows[first]].tolist() for j in bpos]
+                keys = (zip(*keyids) if len(bpos) > 0
+                        else [()] * len(first))
+                for key, grp in zip(keys, np.split(rows[order], bounds)):
+                    groups[tuple(key)] = set(grp.tolist())
+            del cols
+        else:
+            cols = self.columns
+            for r in range(len(self)):
+                if all(cols[j][r] == cols[k][r] for j, k in eqs):
+                    key = tuple(cols[j][r] for j in bpos)
+                    groups.setdefault(key, set()).add(r)
+        
+        entry = (bpos, eqs, upos, groups, {})
+        self._groups[mask] = entry
+        return entry
+    
+    @staticmethod
+    def _group_add(entry, rowids, r):
+        bpos, eqs, _, groups, results = entry
+        if all(rowids[j] == rowids[k] for j, k in eqs):
+            key = tuple(rowids[j] for j in bpos)
+            groups.setdefault(key, set()).add(r)
+            for cache in results.values():
+                cache.pop(key, None)
+    
+    @staticmethod
+    def _group_remove(entry, rowids, r):
+        bpos, eqs, _, groups, results = entry
+        if all(rowids[j] == rowids[k] for j, k in eqs):
+            key = tuple(rowids[j] for j in bpos)
+            rows = groups[key]
+            rows.remove(r)
+            if len(rows) == 0:
+                del groups[key]
+            for cache in results.values():
+                cache.pop(key, None)
+    
+    @staticmethod
+    def _group_move(entry, rowids, old, new):
+        bpos, eqs, _, groups, _ = entry
+        if all(rowids[j] == rowids[k] for j, k in eqs):
+            rows = groups[tuple(rowids[j] for j in bpos)]
+            rows.remove(old)
+            rows.add(new)
+    
+    def _group_aggregate(self, op, entry, key):
+        """Return the aggregate op of the image of a key in a group
+        index, using the built-in functions.
+        """
+        _, _, upos, groups, _ = entry
+        cols = self.columns
+        values = self.values
+        image = {tuple(cols[j][r] for j in upos) for r in groups[key]}
+        return self._aggr_funcs[op](
+                    [tupify([values[id] for id in ids]) for ids in image])
+    
+    def aggregate(self, op, mask, key):
+        """Return the aggregate op ('count', 'sum', 'min', or 'max')
+        of setmatch(self, mask, key). As for the built-in min() and
+        max(), ValueError is raised for the min or max of an empty
+        set.
+        """
+        assert op in self._aggr_funcs
+        mask = {'out': 'bu', 'in': 'ub'}.get(mask, mask)
+        entry = self._group_index(mask)
+        keyids = None
+        if entry is not None:
+            bvals = (key,) if len(entry[0]) == 1 else key
+            if isinstance(bvals, tuple) and len(bvals) == len(entry[0]):
+                keyids = tuple(self.ids.get(value) for value in bvals)
+        
+        if keyids is None or keyids not in entry[3]:
+            if op in ['count', 'sum']:
+                return 0
+            else:
+                raise ValueError('{}() arg is an empty sequence'.format(op))
+        
+        cache = entry[4].setdefault(op, {})
+        if keyids not in cache:
+            cache[keyids] = self._group_aggregate(op, entry, keyids)
+        return cache[keyids]
+    
+    def aggregate_map(self, op, mask):
+        """Return a dictionary from each key that matches the mask in
+        some row to the aggregate op of its image set. Aggregates that
+        aren't already cached are computed together, in one pass when
+        NumPy is available.
+        """
+        assert op in self._aggr_funcs
+        mask = {'out': 'bu', 'in': 'ub'}.get(mask, mask)
+        entry = self._group_index(mask)
+        if entry is None:
+            return {}
+        bpos, eqs, upos, groups, results = entry
+        
+        cache = results.setdefault(op, {})
+        if HAVE_NUMPY and len(cache) < len(groups):
+            for keyids, value in self._aggregate_numpy(
+                    op, bpos, eqs, upos).items():
+                cache.setdefault(keyids, value)
+        values = self.values
+        result = {}
+        for keyids in groups:
+            if keyids not in cache:
+                cache[keyids] = self._group_aggregate(op, entry, keyids)
+            result[tupify([values[id] for id in keyids])] = cache[keyids]
+        return result
+    
+    def _numeric_values(self):
+        """Return a triple of NumPy arrays indexed by value ID: the
+        kind of the value (1 for int, 2 for float, 0 otherwise), and
+        the value as an int64 and as a float64, or 0 where it is not
+        of that kind.
+        """
+        old = self._numvalues
+        start = 0 if old is None else len(old[0])
+        n = len(self.values)
+        if start == n:
+            return old
+        new = self.values[start:]
+        
+        def kind(v):
+            # Exclude the most negative int64, which has no absolute
+            # value.
+            if type(v) is int and -2 ** 63 < v < 2 ** 63:
+                return 1
+            elif type(v) is float:
+                return 2
+            else:
+                return 0
+        kinds = np.fromiter(map(kind, new), dtype=np.int8, count=len(new))
+        ints = np.fromiter((v if k == 1 else 0
+                            for v, k in zip(new, kinds.tolist())),
+                           dtype=np.int64, count=len(new))
+        floats = np.fromiter((v if k == 2 else 0.0
+                              for v, k in zip(new, kinds.tolist())),
+                             dtype=np.float64, count=len(new))
+        if old is not None:
+            kinds = np.concatenate((old[0], kinds))
+            ints = np.concatenate((old[1], ints))
+            floats = np.concatenate((old[2], floats))
+        self._numvalues = (kinds, ints, floats)
+        return self._numvalues
+    
+    @staticmethod
+    def _codes(cols, positions, rows):
+        """Number the distinct combinations of the values in the given
+        columns over the given rows. Return a pair of an array of each
+        row's number, and an array of, for each number, the index in
+        rows of a row having it.
+        """
+        if len(positions) == 0:
+            return (np.zeros(len(rows), dtype=np.int64),
+                    np.zeros(1, dtype=np.int64))
+        elif len(positions) == 1:
+            _, first, inverse = np.unique(
+                cols[positions[0]][rows],
+                return_index=True, return_inverse=True)
+        else:
+            stacked = np.stack([cols[j][rows] for j in positions], axis=1)
+            _, first, inverse = np.unique(
+                stacked, axis=0,
+                return_index=True, return_inverse=True)
+        return inverse.reshape(-1), first
+    
+    def _aggregate_numpy(self, op, bpos, eqs, upos):
+        """Vectorized aggregates of every group. Return a dictionary
+        from the IDs of each group's key to its aggregate, omitting
+        groups whose values aren't all ints or all floats, which are
+        left to the built-in functions.
+        """
+        if op != 'count' and len(upos) != 1:
+            return {}
+        
+        cols = self._column_views()
+        sel = np.ones(len(self), dtype=bool)
+        for j, k in eqs:
+            sel &= cols[j] == cols[k]
+        rows = np.flatnonzero(sel)
+        if len(rows) == 0:
+            return {}
+        
+        # Sort the distinct pairs of group and image by group, so
+        # that each group's images form a segment.
+        groups, grouprows = self._codes(cols, bpos, rows)
+        images, _ = self._codes(cols, upos, rows)
+        pairs = groups * (int(images.max()) + 1) + images
+        _, pairrows = np.unique(pairs, return_index=True)
+        pairgroups = groups[pairrows]
+        starts = np.flatnonzero(np.concatenate(
+                    ([True], pairgroups[1:] != pairgroups[:-1])))
+        sizes = np.diff(np.append(starts, len(pairrows)))
+        
+        if op == 'count':
+            values = sizes
+            ok = np.ones(len(starts), dtype=bool)
+        else:
+            # Only segments of all ints or all floats are handled, so
+            # that the result has the same type as with the built-ins.
+            ids = cols[upos[0]][rows[pairrows]]
+            kinds, ints, floats = self._numeric_values()
+            kinds = kinds[ids]
+            allint = np.logical_and.reduceat(kinds == 1, starts)
+            allfloat = np.logical_and.reduceat(kinds == 2, starts)
+            ufunc = {'sum': np.add, 'min': np.minimum,
+                     'max': np.maximum}[op]
+            intvalues = ints[ids]
+            if op == 'sum':
+                # Leave out sums that could overflow int64.
+                bound = np.maximum.reduceat(np.abs(intvalues), starts)
+                allint &= bound < (2 ** 63 - 1) // sizes
+            values = np.where(allint,
+                              ufunc.reduceat(intvalues, starts), 0)
+            values = values.astype(object)
+            values[allfloat] = ufunc.reduceat(floats[ids],
+                                              starts)[allfloat].tolist()
+            ok = allint | allfloat
+        
+        keyrows = rows[grouprows[pairgroups[starts[ok]]]]
+        keyids = [cols[j][keyrows].tolist() for j in bpos]
+        del cols
+        keys = (zip(*keyids) if len(bpos) > 0
+                else [()] * int(ok.sum()))
+        return {tuple(key): value
+                for key, value in zip(keys, values[ok].tolist())}
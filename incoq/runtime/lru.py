@@ -26,6 +26,8 @@ class LRUTracker:
         self.map = {}
     
     def _prepend(self, node):
+        node.prev = None
+        node.next = self.head
         if self.head is None:
             self.head = self.tail = node
         else:
@@ -15,6 +15,7 @@ __all__ =[
     'QUERYOPTIONS',
     'NODEMAND',
     'allow_profile',
+    'incoq_batch',
     
     'setmatch',
     'count',
@@ -26,6 +27,7 @@ __all__ =[
     'get_total_structure_size',
     
     'Type',
+    'ObjBase',
     'Obj',
     'Set',
     'RCSet',
@@ -38,10 +40,20 @@ __all__ =[
     'Tree',
     
     'LRUSet',
+    
+    'DeltaLog',
+    'PendingDeltas',
+    'Batch',
+    'QueryCache',
+    
+    'addcontainer',
+    'removecontainer',
+    'getcontainers',
 ]
 
 
-from collections import Counter
+from collections import Counter, deque, OrderedDict
+from itertools import islice
 import builtins
 
 try:
@@ -115,6 +127,19 @@ def allow_profile(f):
     profile = getattr(builtins, 'profile', None)
     return profile(f) if profile else f
 
+class incoq_batch:
+    
+    """Context manager marking a block whose updates are applied
+    together on exit (see BatchRewriter). No effect at runtime, so
+    the block's updates just happen immediately.
+    """
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        pass
+
 
 # ---- Batch implementations of queries ----
 
@@ -162,6 +187,14 @@ def setmatch(rel, mask, key):
     if mask == 'w':
         return {()}
     
+    # Column-oriented relations scan their columns directly, and
+    # Sets are matched using indexes built on demand.
+    tag = typetag(rel)
+    if tag == TAG_COLUMNS:
+        return rel.match(mask, key)
+    elif tag == TAG_SET:
+        return _indexed_setmatch(rel, mask, key)
+    
     result = Set()
     for item in rel:
         # Skip elements that are not tuples or that are tuples
@@ -209,10 +242,38 @@ def min2(*args):
 
 # ---- Types ----
 
+# Each Type subclass has a small integer tag identifying which of
+# the runtime's representations it uses, so that code that handles
+# several kinds of values can dispatch on a single lookup instead
+# of a chain of isinstance() tests. Subclasses inherit the tag of
+# the representation they extend. Values that are not Types have
+# tag TAG_NONE.
+#
+# The tags are for the runtime's own use and aren't exported to
+# programs. Generated maintenance code keeps its isinstance() and
+# hasattr() guards: each is a single C-level call, and on CPython
+# reading and comparing a tag is no faster for Types and several
+# times slower for other values.
+TAG_NONE = 0
+TAG_OBJ = 1
+TAG_SET = 2
+TAG_RCSET = 3
+TAG_MAP = 4
+TAG_COLUMNS = 5
+
+def typetag(value):
+    """Return the type tag of a value."""
+    return getattr(type(value), '_tag', TAG_NONE)
+
 class Type:
     
     """Base class for types."""
     
+    # Empty, so that subclasses may choose to have no __dict__.
+    __slots__ = ()
+    
+    _tag = TAG_NONE
+    
     def __getstate__(self):
         raise NotImplementedError
     
@@ -233,26 +294,76 @@ class Type:
         raise NotImplementedError
 
 
-class Obj(Type):
+class ObjBase(Type):
+    
+    """Base class for object types. Subclasses with a fixed set of
+    fields declare them in __slots__, so that their instances have
+    no __dict__ and take much less memory. Such classes are generated
+    for the object types given in the "obj_types" option.
+    """
+    
+    __slots__ = ('__weakref__', '_containers')
+    
+    _tag = TAG_OBJ
+    
+    # _containers is the reverse membership index, maintained by
+    # generated code when the "obj_containers" option is used (see
+    # addcontainer()). It is not a field, but it is pickled along with
+    # the fields, just as the fallback map for other elements is
+    # pickled along with its contents.
+    
+    _internal_slots = frozenset(['__weakref__', '__dict__', '_containers'])
+    
+    def get_field_names(self):
+        """Return a list of the names of the fields declared in
+        __slots__ by this object's class and its bases.
+        """
+        return [name for cls in type(self).__mro__
+                     for name in cls.__dict__.get('__slots__', ())
+                     if name not in self._internal_slots]
+    
+    def get_structure_size(self):
+        return 1
+    
+    def __getstate__(self):
+        state = {name: getattr(self, name)
+                 for name in self.get_field_names()
+                 if hasattr(self, name)}
+        if hasattr(self, '_containers'):
+            state['_containers'] = self._containers
+        return state
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Obj(ObjBase):
     
     """Generic object type."""
     
     # Note that the built-in "object" class doesn't support field
     # assignment.
     
+    __slots__ = ('__dict__',)
+    
     def __repr__(self):
         if hasattr(self, 'name'):
             return 'Obj(' + self.name + ')'
         else:
             return super().__repr__()
     
-    def get_structure_size(self):
-        return 1
-    
     def __getstate__(self):
-        return self.__dict__
+        if not hasattr(self, '_containers'):
+            return self.__dict__
+        state = dict(self.__dict__)
+        state['_containers'] = self._containers
+        return state
     
     def __setstate__(self, state):
+        if '_containers' in state:
+            state = dict(state)
+            self._containers = state.pop('_containers')
         self.__dict__.update(state)
 
 
@@ -264,6 +375,8 @@ class Set(Type, set):
     # Each wrapper call to a Python-level function introduces
     # noticeable overhead.
     
+    _tag = TAG_SET
+    
     def __repr__(self):
         return '{' + ', '.join(display_helper(item) for item in self) + '}'
     
@@ -320,6 +433,8 @@ class RCSet(Type):
     # block of iterations over this set, especially useful when the set
     # is very small (so overhead is larger by comparison).
     
+    _tag = TAG_RCSET
+    
     def __init__(self):
         super().__init__()
         self.elems = Counter()
@@ -384,6 +499,8 @@ class Map(Type, dict):
     
     """Map type."""
     
+    _tag = TAG_MAP
+    
     def __repr__(self):
         return '{' + ', '.join(display_helper(k) + ': ' + str(v)
                                for k, v in self.items()) + '}'
@@ -551,3 +668,550 @@ class LRUSet(Set):
         contents, cache = state
         self.update(contents)
         self.cache = cache
+
+
+# ---- Indexed matching ----
+
+# setmatch() over a Set keeps a hash index for each mask it is called
+# with, from keys to the sets of their images. The first call gives
+# the Set an indexed version of its class, whose updates increment a
+# version counter and patch the existing indexes. Sets that are never
+# matched against keep the plain class, and with it the speed of the
+# built-in set's updates.
+#
+# An index records the version it is consistent with. Single-element
+# updates patch indexes that are current and advance them with the
+# Set. Bulk updates only increment the version, leaving the indexes
+# to be rebuilt by the next setmatch(). So does removing an element
+# under a mask with wildcards, since another element may have the
+# same key and image.
+
+_mask_infos = {}
+
+def _get_mask_info(mask):
+    """Return a tuple of the length of a normalized mask, the
+    positions of its bound and unbound components, the pairs of
+    positions that must be equal, and whether it has wildcards.
+    """
+    info = _mask_infos.get(mask)
+    if info is None:
+        info = _mask_infos[mask] = (
+            len(mask),
+            tuple(i for i, c in enumerate(mask) if c == 'b'),
+            tuple(i for i, c in enumerate(mask) if c == 'u'),
+            tuple((i, int(c) - 1) for i, c in enumerate(mask)
+                                  if c.isdigit()),
+            'w' in mask)
+    return info
+
+def _split_item(item, info):
+    """Return the pair of the key and image of a tuple under a mask,
+    or None if it does not match the mask's shape.
+    """
+    length, bpos, upos, eqs, _wild = info
+    if not (isinstance(item, tuple) and len(item) == length):
+        return None
+    for i, j in eqs:
+        if item[i] != item[j]:
+            return None
+    return (tupify([item[i] for i in bpos]),
+            tupify([item[i] for i in upos]))
+
+
+class _IndexedSet:
+    
+    """Mixin for the indexed versions of Set classes. Instances have
+    attributes _version, the number of updates made since indexing
+    began, and _indexes, a map from each mask to a pair of the version
+    the index is consistent with and the index itself.
+    """
+    
+    __slots__ = ()
+    
+    def _patch(self, elem, is_add):
+        old = self._version
+        self._version = new = old + 1
+        for mask, entry in self._indexes.items():
+            if entry[0] != old:
+                continue
+            info = _get_mask_info(mask)
+            parts = _split_item(elem, info)
+            if parts is None:
+                entry[0] = new
+                continue
+            key, image = parts
+            index = entry[1]
+            if is_add:
+                images = index.get(key)
+                if images is None:
+                    images = index[key] = set()
+                images.add(image)
+            elif not info[4]:
+                images = index[key]
+                images.remove(image)
+                if len(images) == 0:
+                    del index[key]
+            else:
+                continue
+            entry[0] = new
+    
+    def _invalidate(self):
+        self._version += 1
+    
+    def add(self, elem):
+        is_new = elem not in self
+        super().add(elem)
+        if is_new:
+            self._patch(elem, True)
+    
+    def remove(self, elem):
+        super().remove(elem)
+        self._patch(elem, False)
+    
+    def _add(self, elem):
+        is_new = elem not in self
+        super()._add(elem)
+        if is_new:
+            self._patch(elem, True)
+    
+    def _remove(self, elem):
+        super()._remove(elem)
+        self._patch(elem, False)
+    
+    def discard(self, elem):
+        # Not remove(), which for MSet and the like also updates the
+        # contained object.
+        if elem in self:
+            set.discard(self, elem)
+            self._patch(elem, False)
+    
+    def pop(self):
+        elem = super().pop()
+        self._patch(elem, False)
+        return elem
+    
+    def clear(self):
+        super().clear()
+        self._indexes.clear()
+        self._invalidate()
+    
+    def update(self, *others):
+        super().update(*others)
+        self._invalidate()
+    
+    def intersection_update(self, *others):
+        super().intersection_update(*others)
+        self._invalidate()
+    
+    def difference_update(self, *others):
+        super().difference_update(*others)
+        self._invalidate()
+    
+    def symmetric_difference_update(self, other):
+        super().symmetric_difference_update(other)
+        self._invalidate()
+    
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._invalidate()
+        return result
+    
+    def __iand__(self, other):
+        result = super().__iand__(other)
+        self._invalidate()
+        return result
+    
+    def __isub__(self, other):
+        result = super().__isub__(other)
+        self._invalidate()
+        return result
+    
+    def __ixor__(self, other):
+        result = super().__ixor__(other)
+        self._invalidate()
+        return result
+    
+    def __reduce_ex__(self, protocol):
+        # Pickle as an instance of the plain class. Indexes are
+        # rebuilt on demand after unpickling.
+        reduced = object.__reduce_ex__(self, 2)
+        return (_new_plain, (self._plain_class,)) + reduced[2:]
+
+def _new_plain(cls):
+    return cls.__new__(cls)
+
+_indexed_classes = {}
+
+def _get_indexed_class(cls):
+    """Return the indexed version of a Set class. It has the same
+    name, so that it is displayed and snapshotted as the original.
+    """
+    icls = _indexed_classes.get(cls)
+    if icls is None:
+        icls = _indexed_classes[cls] = type(cls.__name__,
+            (_IndexedSet, cls),
+            {'__slots__': (),
+             '__module__': cls.__module__,
+             '__qualname__': cls.__qualname__,
+             '_plain_class': cls})
+    return icls
+
+def _indexed_setmatch(rel, mask, key):
+    """setmatch() for Sets, using and maintaining rel's index for
+    mask.
+    """
+    if not isinstance(rel, _IndexedSet):
+        rel.__class__ = _get_indexed_class(type(rel))
+        rel._version = 0
+        rel._indexes = {}
+    
+    entry = rel._indexes.get(mask)
+    if entry is None or entry[0] != rel._version:
+        info = _get_mask_info(mask)
+        index = {}
+        for item in rel:
+            parts = _split_item(item, info)
+            if parts is not None:
+                k, image = parts
+                images = index.get(k)
+                if images is None:
+                    images = index[k] = set()
+                images.add(image)
+        entry = rel._indexes[mask] = [rel._version, index]
+    
+    # Copy, so that the result is unaffected by later updates.
+    images = entry[1].get(key)
+    return Set(images) if images is not None else Set()
+
+
+# ---- Reverse membership ----
+
+# With the "obj_containers" option, the auxiliary map from each set
+# element to the sets containing it (the "in" mask over the M-set) is
+# kept intrusively. An object element records its containers in its
+# own _containers slot (see ObjBase), which saves a map entry and a
+# hash operation per membership change. Its value is a 1-tuple while
+# the object is in just one set, and a set once it is in more.
+# Elements that are not objects, and so can't hold the slot, fall
+# back on a Map passed in by the generated code.
+
+def addcontainer(elem, cont, fallback):
+    """Record that set cont now contains elem."""
+    if isinstance(elem, ObjBase):
+        try:
+            conts = elem._containers
+        except AttributeError:
+            elem._containers = (cont,)
+            return
+        if type(conts) is tuple:
+            assert conts[0] is not cont
+            elem._containers = {conts[0], cont}
+        else:
+            assert cont not in conts
+            conts.add(cont)
+    else:
+        if elem not in fallback:
+            fallback[elem] = set()
+        fallback[elem].add(cont)
+
+def removecontainer(elem, cont, fallback):
+    """Record that set cont no longer contains elem."""
+    if isinstance(elem, ObjBase):
+        conts = elem._containers
+        if type(conts) is tuple:
+            assert conts[0] is cont
+            del elem._containers
+        else:
+            conts.remove(cont)
+            if len(conts) == 0:
+                del elem._containers
+    else:
+        image = fallback[elem]
+        image.remove(cont)
+        if len(image) == 0:
+            del fallback[elem]
+
+def getcontainers(elem, fallback):
+    """Return an iterable of the sets containing elem."""
+    if isinstance(elem, ObjBase):
+        return getattr(elem, '_containers', ())
+    else:
+        return fallback.get(elem, ())
+
+
+# ---- Result change logs ----
+
+class DeltaLog:
+    
+    """Record of the changes made to a maintained query result.
+    Generated code calls publish() right after each element is added
+    to or removed from the result (see the "deltalog" query option).
+    
+    Subscribers can either register a callback, which is invoked
+    with the operation ('add' or 'remove') and element of each change,
+    or poll for the changes made since a previously seen position.
+    Only the most recent changes, up to the log's capacity, are kept
+    for polling.
+    
+    This is not a Type, so it is not counted as a structure.
+    """
+    
+    def __init__(self, name, capacity):
+        self.name = name
+        """Name of the query result."""
+        self.changes = deque(maxlen=capacity)
+        """Most recent changes, as pairs of operation and element."""
+        self.pos = 0
+        """Number of changes published so far."""
+        self.callbacks = []
+    
+    def __repr__(self):
+        return 'DeltaLog({!r}, {})'.format(self.name, self.changes.maxlen)
+    
+    def publish(self, op, elem):
+        self.pos += 1
+        self.changes.append((op, elem))
+        for callback in self.callbacks:
+            callback(op, elem)
+    
+    def subscribe(self, callback):
+        """Call callback(op, elem) upon each future change."""
+        self.callbacks.append(callback)
+    
+    def unsubscribe(self, callback):
+        self.callbacks.remove(callback)
+    
+    def since(self, pos):
+        """Return a pair of the current position and a list of the
+        changes published after position pos. Raise ValueError if
+        some of those changes are no longer kept, in which case the
+        subscriber must re-read the whole result.
+        """
+        n = self.pos - pos
+        if n < 0 or n > len(self.changes):
+            raise ValueError('Changes since position {} are no longer '
+                             'available'.format(pos))
+        changes = list(islice(reversed(self.changes), n))
+        changes.reverse()
+        return self.pos, changes
+
+
+# ---- Deferred maintenance ----
+
+class PendingDeltas:
+    
+    """Buffer of operand updates whose maintenance has been deferred,
+    for a query using the "lazy_maint" option.
+    
+    Generated code calls defer() before each update to an operand of
+    the query, passing along the maintenance function that would
+    otherwise have run. Updates to only one operand are buffered at a
+    time; an update to a different operand first flushes the buffer,
+    so the maintenance functions always see the other operands in the
+    same state as when the update happened. An update that undoes a
+    buffered update of the same element cancels it, and neither runs.
+    """
+    
+    def __init__(self, limit):
+        self.limit = limit
+        """Flush whenever this many updates are buffered (0 for never)."""
+        self.rel = None
+        """Name of the operand whose updates are buffered."""
+        self.pending = OrderedDict()
+        """Map from buffered element to pair of its operation and
+        maintenance function, in update order.
+        """
+    
+    def __len__(self):
+        return len(self.pending)
+    
+    def defer(self, rel, op, elem, func):
+        if rel != self.rel:
+            self.flush()
+            self.rel = rel
+        
+        prev = self.pending.pop(elem, None)
+        if prev is not None:
+            # Set semantics mean the buffered update must have been
+            # the opposite operation.
+            assert prev[0] != op
+            return
+        
+        self.pending[elem] = (op, func)
+        if self.limit and len(self.pending) >= self.limit:
+            self.flush()
+    
+    def flush(self):
+        """Run all buffered maintenance."""
+        # Swap in a fresh buffer first in case maintenance reads
+        # the query result.
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = OrderedDict()
+        for elem, (_op, func) in pending.items():
+            func(elem)
+    
+    def flushed(self, value):
+        """Flush and return value. Used in retrieval expressions."""
+        self.flush()
+        return value
+
+
+# ---- Batched updates ----
+
+class Batch:
+    
+    """Accumulator for the updates made inside an incoq_batch block.
+    
+    Generated code calls one of the update methods in place of each
+    update in the block, and replays the net updates from net() once
+    the block finishes. Every update is identified by its site, an
+    integer chosen by the compiler that determines how it is replayed.
+    Updates to the same set element, object field, or map key are
+    combined, so that an update that is later undone is not replayed
+    at all.
+    
+    The original state of a field or map key is read the first time
+    it is updated. The original membership of a set element is instead
+    inferred from the first update, assuming strict updates, since
+    reading a relation would disqualify it from being an input
+    relation. If strict is False, the last update of each element is
+    always replayed.
+    """
+    
+    def __init__(self, strict=True):
+        self.strict = strict
+        self.cells = OrderedDict()
+        """Map from the identity of an updated element, field, or key
+        to a list of the kind of cell, site, target, element, field,
+        or key, original state, and current state. For sets the state
+        is a bool for membership, and otherwise it is a pair of a bool
+        for presence and the value. Keeping the target here also keeps
+        its id unique until the batch is done.
+        """
+    
+    def __len__(self):
+        return len(self.cells)
+    
+    def setupdate(self, site, target, op, elem):
+        """Buffer target.add(elem) or target.remove(elem), according
+        to op. target is None for a relation that is determined by
+        the site.
+        """
+        key = (site, id(target), elem)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = ['set', site, target, elem,
+                                      op == 'remove', None]
+        cell[5] = op == 'add'
+    
+    def _valcell(self, key, site, target, arg, getorig):
+        cell = self.cells.get(key)
+        if cell is None:
+            orig = getorig()
+            cell = self.cells[key] = ['val', site, target, arg, orig, orig]
+        return cell
+    
+    def assignfield(self, site, obj, field, value):
+        """Buffer obj.<field> = value."""
+        cell = self._valcell(
+                ('field', id(obj), field), site, obj, field,
+                lambda: (hasattr(obj, field), getattr(obj, field, None)))
+        cell[5] = (True, value)
+    
+    def delfield(self, site, obj, field):
+        """Buffer del obj.<field>."""
+        cell = self._valcell(
+                ('field', id(obj), field), site, obj, field,
+                lambda: (True, getattr(obj, field)))
+        cell[5] = (False, None)
+    
+    def assignkey(self, site, map, key, value):
+        """Buffer map[key] = value."""
+        cell = self._valcell(
+                ('map', id(map), key), site, map, key,
+                lambda: (key in map, map.get(key)))
+        cell[5] = (True, value)
+    
+    def delkey(self, site, map, key):
+        """Buffer del map[key]."""
+        cell = self._valcell(
+                ('map', id(map), key), site, map, key,
+                lambda: (True, map[key]))
+        cell[5] = (False, None)
+    
+    def net(self):
+        """Generate the net updates as tuples (site, op, target, a, b)
+        and empty the batch. For sets, op is 'add' or 'remove' and a
+        is the element. For fields and maps, op is 'del' or 'assign',
+        a is the field name or key, and b is the assigned value. A
+        value that changes is deleted before it is reassigned.
+        """
+        cells = self.cells
+        self.cells = OrderedDict()
+        for kind, site, target, arg, orig, cur in cells.values():
+            if kind == 'set':
+                if cur != orig or not self.strict:
+                    yield (site, 'add' if cur else 'remove',
+                           target, arg, None)
+            else:
+                (had, old), (has, new) = orig, cur
+                if had and has and (old is new or old == new):
+                    continue
+                if had:
+                    yield (site, 'del', target, arg, None)
+                if has:
+                    yield (site, 'assign', target, arg, new)
+
+
+# ---- Query result caches ----
+
+class QueryCache:
+    
+    """Memoized results of a query implemented with impl 'cached',
+    keyed by the tuple of parameter values. Generated code calls
+    invalidate() after every update to one of the query's operand
+    relations. This bumps the cache's version instead of discarding
+    its entries, and a result is only reused if it was computed at
+    the current version.
+    
+    At most capacity results are kept (0 for no limit), evicting the
+    least recently used one first.
+    
+    This is not a Type, so it is not counted as a structure.
+    """
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.version = 0
+        self.entries = OrderedDict()
+        """Map from parameter tuples to pairs of the version the
+        result was computed at and the result.
+        """
+    
+    def __repr__(self):
+        return 'QueryCache({})'.format(self.capacity)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def invalidate(self):
+        self.version += 1
+    
+    def call(self, func, *args):
+        """Return func(*args), using the cached result for args if
+        it is current.
+        """
+        entries = self.entries
+        entry = entries.get(args)
+        if entry is not None and entry[0] == self.version:
+            entries.move_to_end(args)
+            return entry[1]
+        
+        result = func(*args)
+        entries[args] = (self.version, result)
+        entries.move_to_end(args)
+        if self.capacity and len(entries) > self.capacity:
+            entries.popitem(last=False)
+        return result
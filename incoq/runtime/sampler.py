@@ -0,0 +1,260 @@
+"""Time-series sampling of structure sizes in a running program."""
+
+
+__all__ = [
+    'get_structure_bytes',
+    'SizeSampler',
+    'read_size_samples',
+]
+
+
+import sys
+import struct
+import threading
+from time import perf_counter
+
+from .runtimelib import (Type, RCSet, typetag,
+                         TAG_OBJ, TAG_RCSET, TAG_COLUMNS)
+
+
+# File format:
+#
+#   MAGIC
+#   record*
+#
+# where each record begins with a one-byte tag.
+#
+#   b'N' <u16 length> <utf-8 name>
+#       Declares the next structure index (0, 1, ...) to refer to
+#       the given name.
+#   b'S' <f64 time> <u8 deep> <u32 count> entry*
+#       A sample taken at the given time (seconds since the sampler
+#       was created). Each entry is <u32 index> <u64 size>, followed
+#       by <u64 bytes> if deep is nonzero.
+#
+# Names are declared only once, the first time they are seen, so
+# a long run costs 13 or 21 bytes per structure per sample.
+
+MAGIC = b'IQSZ\x01'
+
+_name_hdr = struct.Struct('<H')
+_sample_hdr = struct.Struct('<dBI')
+_entry = struct.Struct('<IQ')
+_entry_deep = struct.Struct('<IQQ')
+
+
+def _contents(obj):
+    """Return a list of the objects directly held by a structure.
+    Taking a list snapshot keeps the iteration atomic with respect
+    to other threads for the built-in collection types.
+    """
+    tag = typetag(obj)
+    if tag == TAG_OBJ:
+        return list(obj.__getstate__().values())
+    elif tag == TAG_RCSET:
+        return list(obj.elems)
+    elif tag == TAG_COLUMNS:
+        return [obj.columns, obj.index, obj.ids, obj.values]
+    elif isinstance(obj, dict):
+        return [x for kv in list(obj.items()) for x in kv]
+    elif isinstance(obj, (set, frozenset, list, tuple)):
+        return list(obj)
+    elif hasattr(obj, '__dict__'):
+        return list(obj.__dict__.values())
+    return []
+
+def get_structure_bytes(obj, seen=None):
+    """Return the approximate number of bytes used by a structure,
+    including the containers and values reachable from it. Other
+    Type instances (objects and nested structures) reachable from
+    obj are not counted, nor is anything whose id is in seen. seen
+    is updated with the ids of everything that is counted.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        x = stack.pop()
+        if id(x) in seen:
+            continue
+        if x is not obj and isinstance(x, Type):
+            continue
+        seen.add(id(x))
+        total += sys.getsizeof(x)
+        if isinstance(x, RCSet):
+            total += sys.getsizeof(x.elems)
+        stack.extend(_contents(x))
+    return total
+
+
+class SizeSampler:
+    
+    """Periodically record the size of every structure in a module
+    namespace to a file. Sizes are as given by get_structure_size().
+    If deep is True, the approximate byte size of each structure is
+    recorded as well; this is considerably slower.
+    
+    Samples may be taken manually by calling sample(), or in a
+    background thread every interval seconds between start() and
+    stop(). The sampler can also be used as a context manager.
+    """
+    
+    max_retries = 10
+    """Number of times to retry measuring when the program mutates a
+    structure during the measurement, before skipping the sample.
+    """
+    
+    def __init__(self, namespace, filename, *, interval=1.0, deep=False):
+        self.namespace = namespace
+        self.filename = filename
+        self.interval = interval
+        self.deep = deep
+        
+        self.indices = {}
+        """Map from structure name to its index in the file."""
+        self.start_time = perf_counter()
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+    
+    def _measure(self):
+        """Return a list of triples of name, size, and byte size
+        (or None) for each structure currently in the namespace,
+        or None if the structures kept changing.
+        """
+        # Retry if the program mutated a structure out from under us.
+        for _ in range(self.max_retries + 1):
+            try:
+                seen = set()
+                result = []
+                for name, obj in list(self.namespace.items()):
+                    if not isinstance(obj, Type):
+                        continue
+                    size = obj.get_structure_size()
+                    nbytes = (get_structure_bytes(obj, seen)
+                              if self.deep else None)
+                    result.append((name, size, nbytes))
+                return result
+            except RuntimeError as exc:
+                if 'changed size during iteration' not in str(exc):
+                    raise
+        return None
+    
+    def sample(self):
+        """Record one sample of all structures. The sample is skipped
+        if it can't be taken consistently.
+        """
+        entries = self._measure()
+        if entries is None:
+            return
+        t = perf_counter() - self.start_time
+        
+        with self.lock:
+            if self.file.closed:
+                return
+            chunks = []
+            for name, _, _ in entries:
+                if name not in self.indices:
+                    self.indices[name] = len(self.indices)
+                    data = name.encode('utf-8')
+                    chunks.append(b'N' + _name_hdr.pack(len(data)) + data)
+            
+            chunks.append(b'S' + _sample_hdr.pack(t, self.deep, len(entries)))
+            for name, size, nbytes in entries:
+                i = self.indices[name]
+                if self.deep:
+                    chunks.append(_entry_deep.pack(i, size, nbytes))
+                else:
+                    chunks.append(_entry.pack(i, size))
+            self.file.write(b''.join(chunks))
+    
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+    
+    def start(self):
+        """Begin sampling in a background daemon thread."""
+        assert self.thread is None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the background thread, if running, take a final
+        sample, and close the file.
+        """
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        if not self.file.closed:
+            self.sample()
+            with self.lock:
+                self.file.close()
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def read_size_samples(filename):
+    """Read a file written by SizeSampler. Return a list of triples
+    (time, sizes, nbytes), where sizes maps from structure name to
+    size, and nbytes maps from structure name to byte size, or is
+    None if the sample is not deep.
+    """
+    with open(filename, 'rb') as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError('Not a size sample file: ' + filename)
+    
+    names = []
+    samples = []
+    pos = len(MAGIC)
+    try:
+        while pos < len(data):
+            pos = _read_record(data, pos, names, samples)
+    except struct.error:
+        # A truncated final record, e.g. if the program was killed
+        # while sampling. Keep everything before it.
+        pass
+    return samples
+
+def _read_record(data, pos, names, samples):
+    """Read the record at pos, appending to names or samples.
+    Return the position following the record.
+    """
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == b'N':
+        (n,) = _name_hdr.unpack_from(data, pos)
+        pos += _name_hdr.size
+        if pos + n > len(data):
+            raise struct.error('truncated name')
+        names.append(data[pos:pos + n].decode('utf-8'))
+        pos += n
+    elif tag == b'S':
+        t, deep, count = _sample_hdr.unpack_from(data, pos)
+        pos += _sample_hdr.size
+        sizes = {}
+        nbytes = {} if deep else None
+        for _ in range(count):
+            if deep:
+                i, size, b = _entry_deep.unpack_from(data, pos)
+                pos += _entry_deep.size
+                nbytes[names[i]] = b
+            else:
+                i, size = _entry.unpack_from(data, pos)
+                pos += _entry.size
+            sizes[names[i]] = size
+        samples.append((t, sizes, nbytes))
+    else:
+        raise ValueError('Bad record tag {!r} at offset {}'.format(
+                         tag, pos - 1))
+    return pos
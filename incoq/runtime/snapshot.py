@@ -0,0 +1,389 @@
+"""Checkpointing of all structures in a module namespace."""
+
+
+__all__ = [
+    'save_snapshot',
+    'load_snapshot',
+]
+
+
+import struct
+import mmap
+import importlib
+from collections import Counter
+
+from .runtimelib import (Type, LRUSet, HAVE_TREES,
+                         typetag, TAG_OBJ, TAG_SET, TAG_RCSET, TAG_COLUMNS)
+from .columnar import ColumnSet
+from .lru import LRUTracker
+
+if HAVE_TREES:
+    from bintrees import FastAVLTree
+else:
+    FastAVLTree = ()
+
+
+# A snapshot is a table of values followed by a list of fill records
+# and a list of roots. Every value is written to the table once, and
+# is referred to elsewhere by its index in the table.
+#
+#   MAGIC <u32 #entries> <u32 #fills> <u32 #roots>
+#   entry* fill* root*
+#
+# Immutable values (scalars, tuples, frozensets) are hash-consed:
+# equal values of the same type share a single entry, no matter how
+# many times they occur across structures. Their children always
+# precede them in the table.
+#
+# Mutable values (structures, objects, and plain sets, dicts and
+# lists) are written as a shell entry giving their kind and class.
+# All references to the same mutable value share its shell, so
+# object identities and aliasing are preserved. The contents of each
+# shell are given by a fill record, which is applied only after the
+# whole table is built, so that cycles are allowed.
+#
+#   fill: <u32 shell index> <u32 #items> <u32 ref>* <u32 #attrs>
+#         (<u32 name ref> <u32 value ref>)*
+#
+# For dict-like kinds and RCSets, items alternate between keys and
+# values (resp. elements and refcounts).
+#
+#   root: <u32 name ref> <u32 value ref>
+
+MAGIC = b'IQSN\x01'
+
+_u32 = struct.Struct('<I')
+_i64 = struct.Struct('<q')
+_f64 = struct.Struct('<d')
+_header = struct.Struct('<III')
+_pair = struct.Struct('<II')
+
+# Shell kinds.
+K_SET = b'S'
+K_LRUSET = b'U'
+K_RCSET = b'R'
+K_DICT = b'M'
+K_LIST = b'L'
+K_TREE = b'T'
+K_OBJ = b'O'
+K_COLUMNS = b'C'
+
+# Attributes that are rebuilt from a shell's items rather than saved.
+_derived_attrs = {
+    K_SET: {'_version', '_indexes'},
+    K_RCSET: {'elems'},
+    K_LRUSET: {'cache', '_version', '_indexes'},
+    K_COLUMNS: set(ColumnSet.__slots__) - {'arity'},
+}
+
+
+def _get_attrs(value):
+    """Return a dictionary of the instance attributes of value,
+    including those held in slots.
+    """
+    if isinstance(value, FastAVLTree):
+        # Tree internals are rebuilt from the items.
+        return {}
+    attrs = dict(getattr(value, '__dict__', {}))
+    for cls in type(value).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            if (name not in ('__dict__', '__weakref__') and
+                    hasattr(value, name)):
+                attrs[name] = getattr(value, name)
+    return attrs
+
+def _get_kind(value):
+    """Return the shell kind for a mutable value, or raise TypeError
+    if it cannot be snapshotted.
+    """
+    tag = typetag(value)
+    if tag == TAG_OBJ:
+        return K_OBJ
+    elif tag == TAG_SET:
+        return K_LRUSET if isinstance(value, LRUSet) else K_SET
+    elif tag == TAG_RCSET:
+        return K_RCSET
+    elif tag == TAG_COLUMNS:
+        return K_COLUMNS
+    elif isinstance(value, set):
+        return K_SET
+    elif isinstance(value, dict):
+        return K_DICT
+    elif isinstance(value, list):
+        return K_LIST
+    elif isinstance(value, FastAVLTree):
+        return K_TREE
+    elif isinstance(value, Type):
+        return K_OBJ
+    else:
+        raise TypeError('Cannot snapshot value of type ' +
+                        type(value).__qualname__)
+
+def _get_items(value, kind):
+    """Return the list of contents of a mutable value of the given
+    kind, in the form used by fill records.
+    """
+    if kind == K_SET:
+        return list(value)
+    elif kind == K_LRUSET:
+        # Oldest first, so re-adding them restores the LRU order.
+        items = []
+        node = value.cache.tail
+        while node is not None:
+            items.append(node.val)
+            node = node.prev
+        return items
+    elif kind == K_RCSET:
+        return [x for kv in value.elems.items() for x in kv]
+    elif kind in [K_DICT, K_TREE]:
+        return [x for kv in value.items() for x in kv]
+    elif kind in [K_LIST, K_COLUMNS]:
+        return list(value)
+    else:
+        return []
+
+
+class _Encoder:
+    
+    def __init__(self):
+        self.entries = []
+        """Encoded table entries."""
+        self.consed = {}
+        """Map from an immutable value's key to its entry index."""
+        self.shells = {}
+        """Map from a mutable value's id to its entry index."""
+        self.keepalive = []
+        """Mutable values seen so far, so their ids stay unique."""
+        self.pending = []
+        """Mutable values whose fill record has not been written."""
+        self.fills = []
+        """Encoded fill records."""
+    
+    def _cons(self, key, data):
+        i = self.consed.get(key)
+        if i is None:
+            i = self.consed[key] = len(self.entries)
+            self.entries.append(data)
+        return i
+    
+    def ref(self, value):
+        """Return the entry index for value, adding entries for it
+        and its children as needed.
+        """
+        t = type(value)
+        if value is None:
+            return self._cons(('n',), b'n')
+        elif value is True:
+            return self._cons(('T',), b'T')
+        elif value is False:
+            return self._cons(('F',), b'F')
+        elif t is int:
+            if -2**63 <= value < 2**63:
+                data = b'i' + _i64.pack(value)
+            else:
+                n = (value.bit_length() + 8) // 8
+                b = value.to_bytes(n, 'little', signed=True)
+                data = b'I' + _u32.pack(n) + b
+            return self._cons(('i', value), data)
+        elif t is float:
+            b = _f64.pack(value)
+            return self._cons(('d', b), b'd' + b)
+        elif t is str:
+            b = value.encode('utf-8', 'surrogatepass')
+            return self._cons(('s', value), b's' + _u32.pack(len(b)) + b)
+        elif t is bytes:
+            return self._cons(('b', value),
+                              b'b' + _u32.pack(len(value)) + value)
+        elif t is tuple or t is frozenset:
+            tag = 't' if t is tuple else 'z'
+            refs = [self.ref(x) for x in value]
+            key = (tag, tuple(refs) if t is tuple else frozenset(refs))
+            data = (tag.encode() + _u32.pack(len(refs)) +
+                    struct.pack('<{}I'.format(len(refs)), *refs))
+            return self._cons(key, data)
+        else:
+            return self._shell(value)
+    
+    def _shell(self, value):
+        i = self.shells.get(id(value))
+        if i is not None:
+            return i
+        kind = _get_kind(value)
+        cls = type(value)
+        clsref = self.ref(cls.__module__ + ':' + cls.__qualname__)
+        i = self.shells[id(value)] = len(self.entries)
+        self.entries.append(b'X' + kind + _u32.pack(clsref))
+        self.keepalive.append(value)
+        self.pending.append((i, kind, value))
+        return i
+    
+    def fill_all(self):
+        """Write fill records for all pending shells, including the
+        ones discovered along the way.
+        """
+        while self.pending:
+            i, kind, value = self.pending.pop()
+            items = [self.ref(x) for x in _get_items(value, kind)]
+            derived = _derived_attrs.get(kind, ())
+            attrs = [(self.ref(k), self.ref(v))
+                     for k, v in _get_attrs(value).items()
+                     if k not in derived]
+            chunks = [_pair.pack(i, len(items)),
+                      struct.pack('<{}I'.format(len(items)), *items),
+                      _u32.pack(len(attrs))]
+            chunks.extend(_pair.pack(k, v) for k, v in attrs)
+            self.fills.append(b''.join(chunks))
+
+
+def save_snapshot(namespace, filename):
+    """Write every structure in a module's global namespace (as in
+    get_structure_sizes()) to a snapshot file, along with everything
+    reachable from them. Return the number of structures saved.
+    
+    Objects shared between structures are saved once and remain
+    shared when the snapshot is loaded.
+    """
+    enc = _Encoder()
+    roots = [(enc.ref(name), enc.ref(value))
+             for name, value in namespace.items()
+             if isinstance(value, Type)]
+    enc.fill_all()
+    
+    with open(filename, 'wb') as file:
+        file.write(MAGIC)
+        file.write(_header.pack(len(enc.entries), len(enc.fills),
+                                len(roots)))
+        file.write(b''.join(enc.entries))
+        file.write(b''.join(enc.fills))
+        file.write(b''.join(_pair.pack(k, v) for k, v in roots))
+    return len(roots)
+
+
+def _resolve_class(qualname):
+    modname, _, name = qualname.partition(':')
+    obj = importlib.import_module(modname)
+    for part in name.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+def _make_shell(kind, cls):
+    if kind in [K_TREE, K_COLUMNS]:
+        return cls()
+    value = cls.__new__(cls)
+    if kind == K_LRUSET:
+        value.cache = LRUTracker()
+    return value
+
+def _apply_fill(value, kind, items, attrs):
+    if kind == K_SET:
+        set.update(value, items)
+    elif kind == K_LRUSET:
+        # Bypass LRUSet.add(), which may be a transformed operation
+        # in subclasses.
+        set.update(value, items)
+        for x in items:
+            value.cache.add(x)
+    elif kind == K_RCSET:
+        value.elems = Counter(dict(zip(items[::2], items[1::2])))
+    elif kind == K_DICT:
+        dict.update(value, zip(items[::2], items[1::2]))
+    elif kind == K_TREE:
+        value.update(zip(items[::2], items[1::2]))
+    elif kind == K_LIST:
+        list.extend(value, items)
+    elif kind == K_COLUMNS:
+        ColumnSet.update(value, items)
+    for k, v in attrs:
+        object.__setattr__(value, k, v)
+
+def _decode_entry(buf, pos, table, shells):
+    tag = buf[pos:pos + 1]
+    pos += 1
+    if tag == b'n':
+        value = None
+    elif tag == b'T':
+        value = True
+    elif tag == b'F':
+        value = False
+    elif tag == b'i':
+        (value,) = _i64.unpack_from(buf, pos)
+        pos += _i64.size
+    elif tag == b'I':
+        (n,) = _u32.unpack_from(buf, pos)
+        pos += _u32.size
+        value = int.from_bytes(buf[pos:pos + n], 'little', signed=True)
+        pos += n
+    elif tag == b'd':
+        (value,) = _f64.unpack_from(buf, pos)
+        pos += _f64.size
+    elif tag == b's' or tag == b'b':
+        (n,) = _u32.unpack_from(buf, pos)
+        pos += _u32.size
+        value = bytes(buf[pos:pos + n])
+        if tag == b's':
+            value = value.decode('utf-8', 'surrogatepass')
+        pos += n
+    elif tag == b't' or tag == b'z':
+        (n,) = _u32.unpack_from(buf, pos)
+        pos += _u32.size
+        refs = struct.unpack_from('<{}I'.format(n), buf, pos)
+        pos += 4 * n
+        value = (tuple if tag == b't' else frozenset)(
+                 table[r] for r in refs)
+    elif tag == b'X':
+        kind = buf[pos:pos + 1]
+        (clsref,) = _u32.unpack_from(buf, pos + 1)
+        pos += 1 + _u32.size
+        value = _make_shell(kind, _resolve_class(table[clsref]))
+        shells[len(table)] = kind
+    else:
+        raise ValueError('Bad snapshot entry tag {!r} at offset {}'.format(
+                         tag, pos - 1))
+    table.append(value)
+    return pos
+
+def load_snapshot(namespace, filename):
+    """Restore the structures saved in a snapshot file into a module's
+    global namespace, replacing any existing values of the same names.
+    The file is memory-mapped rather than read. Return the list of
+    restored names.
+    
+    Classes of saved objects are re-imported by module and name, so
+    they must be importable when loading.
+    """
+    with open(filename, 'rb') as file, \
+         mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a snapshot file: ' + filename)
+        pos = len(MAGIC)
+        n_entries, n_fills, n_roots = _header.unpack_from(buf, pos)
+        pos += _header.size
+        
+        table = []
+        shells = {}
+        for _ in range(n_entries):
+            pos = _decode_entry(buf, pos, table, shells)
+        
+        for _ in range(n_fills):
+            i, n = _pair.unpack_from(buf, pos)
+            pos += _pair.size
+            items = [table[r] for r in
+                     struct.unpack_from('<{}I'.format(n), buf, pos)]
+            pos += 4 * n
+            (n,) = _u32.unpack_from(buf, pos)
+            pos += _u32.size
+            attrs = []
+            for _ in range(n):
+                k, v = _pair.unpack_from(buf, pos)
+                pos += _pair.size
+                attrs.append((table[k], table[v]))
+            _apply_fill(table[i], shells[i], items, attrs)
+        
+        names = []
+        for _ in range(n_roots):
+            k, v = _pair.unpack_from(buf, pos)
+            pos += _pair.size
+            namespace[table[k]] = table[v]
+            names.append(table[k])
+    
+    return names
@@ -0,0 +1,92 @@
+"""Unit tests for the cached module."""
+
+
+import unittest
+
+import incoq.compiler.incast as L
+from incoq.compiler.central import CentralCase
+from incoq.compiler.central.cached import *
+
+
+class TestCached(CentralCase):
+    
+    def test_cached_info(self):
+        comp = L.pe('COMP({z for (x, y) in R for (y, z) in S}, [x], {})')
+        info = get_cached_info(self.manager, comp)
+        self.assertEqual(info, (('x',), ('R', 'S')))
+        
+        aggr = L.pe('count(setmatch(R, "bu", p))')
+        aggr = aggr._replace(options={})
+        info = get_cached_info(self.manager, aggr)
+        self.assertEqual(info, (('p',), ('R',)))
+        
+        self.manager.cached_queries['query_Q1'] = ('R', 'S')
+        aggr = L.pe('sum(query_Q1(x))')
+        aggr = aggr._replace(options={})
+        info = get_cached_info(self.manager, aggr)
+        self.assertEqual(info, (('x',), ('R', 'S')))
+        
+        aggr = L.pe('sum(f(x))')
+        aggr = aggr._replace(options={})
+        info = get_cached_info(self.manager, aggr)
+        self.assertIsNone(info)
+    
+    def test_cached_info_nested(self):
+        # Comprehensions depend on the operands of the cached
+        # queries they call.
+        self.manager.cached_queries['query_Aggr1'] = ('S',)
+        comp = L.pe('COMP({x for x in R if x > query_Aggr1()}, [], {})')
+        info = get_cached_info(self.manager, comp)
+        self.assertEqual(info, ((), ('R', 'S')))
+        comp = L.pe('COMP({x for x in R if x > abs(y)}, [y], {})')
+        info = get_cached_info(self.manager, comp)
+        self.assertEqual(info, (('y',), ('R',)))
+        
+        # They can't be cached if they read other results or
+        # globals, or call other functions.
+        self.manager.invariants['Aggr2'] = None
+        comp = L.pe('COMP({x for x in R if x > Aggr2}, [], {})')
+        self.assertIsNone(get_cached_info(self.manager, comp))
+        comp = L.pe('COMP({x for x in R if x > g}, [], {})')
+        self.assertIsNone(get_cached_info(self.manager, comp))
+        comp = L.pe('COMP({x for x in R if x > query_Aggr3()}, [], {})')
+        self.assertIsNone(get_cached_info(self.manager, comp))
+        comp = L.pe('COMP({x for (x, y) in Aggr2}, [], {})')
+        self.assertIsNone(get_cached_info(self.manager, comp))
+    
+    def test_impl_cached_query(self):
+        comp = L.pe('COMP({z for (x, y) in R for (y, z) in S}, [x], {})')
+        tree = L.p('''
+            R.add((1, 2))
+            S.add((2, 3))
+            T.add(4)
+            print(COMP)
+            ''', subst={'COMP': comp})
+        tree = impl_cached_query(tree, self.manager, comp, 'Q1')
+        
+        batch_comp = comp._replace(options={'impl': 'batch'})
+        exp_tree = L.p('''
+            _QC_Q1 = QueryCache(1000)
+            def compute_Q1(x):
+                return COMP
+            def query_Q1(x):
+                SPEC_STR
+                return _QC_Q1.call(compute_Q1, x)
+            with MAINT(Q1, 'after', 'R.add((1, 2))'):
+                R.add((1, 2))
+                _QC_Q1.invalidate()
+            with MAINT(Q1, 'after', 'S.add((2, 3))'):
+                S.add((2, 3))
+                _QC_Q1.invalidate()
+            T.add(4)
+            print(query_Q1(x))
+            ''', subst={'COMP': batch_comp,
+                        'SPEC_STR': L.Str(s=L.ts(comp))})
+        
+        self.assertEqual(tree, exp_tree)
+        self.assertEqual(self.manager.cached_queries,
+                         {'query_Q1': ('R', 'S')})
+
+
+if __name__ == '__main__':
+    unittest.main()
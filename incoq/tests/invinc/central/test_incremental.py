@@ -0,0 +1,98 @@
+"""Unit tests for the incremental module."""
+
+
+import unittest
+
+from incoq.compiler.central.transform import transform_source
+from incoq.compiler.central.incremental import *
+
+
+class TestIncremental(unittest.TestCase):
+    
+    source = '''
+        from incoq.runtime import *
+        def helper(a, b):
+            c = a + b
+            return c * 2
+        R = Set()
+        for i in range(5):
+            R.add(i)
+        print(sorted({x for x in R if x > 2}))
+        print(helper(1, 2))
+        '''
+    
+    def compile(self, source, record=None):
+        return transform_source_incremental(
+                    source, record, nopts={'default_impl': 'inc'})
+    
+    def full(self, source):
+        result, _ = transform_source(
+                    source, nopts={'default_impl': 'inc'})
+        return result
+    
+    def test_reuse(self):
+        out1, stats1, record = self.compile(self.source)
+        self.assertEqual(stats1['incremental'], 'full')
+        self.assertIn('helper', record.inert)
+        
+        out2, stats2, record = self.compile(self.source, record)
+        self.assertEqual(stats2['incremental'], 'reused')
+        self.assertEqual(out2, out1)
+    
+    def test_splice(self):
+        _, _, record = self.compile(self.source)
+        source2 = self.source.replace('return c * 2', 'return c * 3')
+        out, stats, record = self.compile(source2, record)
+        self.assertEqual(stats['incremental'], 'spliced')
+        self.assertEqual(out, self.full(source2))
+        self.assertIn('helper', record.inert)
+    
+    def test_splice_realistic(self):
+        # Loops, attribute and subscript reads, membership tests, and
+        # calls to builtins used elsewhere don't prevent splicing.
+        source = self.source + '''
+        def format_row(row, widths):
+            parts = []
+            for key, value in sorted(row.items()):
+                if key in widths:
+                    parts.append(str(value).ljust(widths[key]))
+            return ' | '.join(parts)
+        print(format_row({'a': 1}, {'a': 3}))
+        '''
+        _, _, record = self.compile(source)
+        self.assertIn('format_row', record.inert)
+        
+        source2 = source.replace("' | '", "', '")
+        out, stats, _ = self.compile(source2, record)
+        self.assertEqual(stats['incremental'], 'spliced')
+        self.assertEqual(out, self.full(source2))
+        
+        # Field assignments are rewritten, so they aren't inert.
+        source3 = source.replace(
+                    'parts = []',
+                    'row.seen = True\n            parts = []')
+        out, stats, _ = self.compile(source3, record)
+        self.assertEqual(stats['incremental'], 'full')
+    
+    def test_fallback(self):
+        _, _, record = self.compile(self.source)
+        
+        # Changes outside functions require a full transformation.
+        source2 = self.source.replace('x > 2', 'x > 3')
+        out, stats, _ = self.compile(source2, record)
+        self.assertEqual(stats['incremental'], 'full')
+        self.assertEqual(out, self.full(source2))
+        
+        # So do changes that make a function non-inert.
+        source3 = self.source.replace('return c * 2', 'return len(R)')
+        out, stats, _ = self.compile(source3, record)
+        self.assertEqual(stats['incremental'], 'full')
+        
+        # And changes to the options.
+        _, stats, _ = transform_source_incremental(
+                    self.source, record, nopts={'default_impl': 'batch'})
+        self.assertEqual(stats['incremental'], 'full')
+
+
+if __name__ == '__main__':
+    unittest.main()
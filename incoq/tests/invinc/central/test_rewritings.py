@@ -154,6 +154,75 @@ class RewriterCase(CentralCase):
             ''')
         self.assertEqual(tree, exp_tree)
     
+    def test_batchrewriter(self):
+        tree = L.p('''
+            with incoq_batch():
+                R.add(x)
+                o.f = y
+                for z in S:
+                    S.remove(z)
+                    m.assignkey(k, z)
+                del o.f
+            ''')
+        tree = BatchRewriter.run(tree, self.manager.namegen, ['R'])
+        exp_tree = L.p('''
+            v1_batch = Batch(True)
+            v1_batch.setupdate(0, None, 'add', x)
+            v1_batch.assignfield(1, o, 'f', y)
+            for z in S:
+                v1_batch.setupdate(2, S, 'remove', z)
+                v1_batch.assignkey(3, m, k, z)
+            v1_batch.delfield(1, o, 'f')
+            for v1_site, v1_op, v1_t, v1_a, v1_b in v1_batch.net():
+                if v1_site == 0:
+                    if v1_op == 'add':
+                        R.add(v1_a)
+                    else:
+                        R.remove(v1_a)
+                elif v1_site == 1:
+                    if v1_op == 'assign':
+                        v1_t.f = v1_b
+                    else:
+                        del v1_t.f
+                elif v1_site == 2:
+                    if v1_op == 'add':
+                        v1_t.add(v1_a)
+                    else:
+                        v1_t.remove(v1_a)
+                elif v1_site == 3:
+                    if v1_op == 'assign':
+                        v1_t.assignkey(v1_a, v1_b)
+                    else:
+                        v1_t.delkey(v1_a)
+            ''')
+        self.assertEqual(tree, exp_tree)
+        
+        tree = L.p('''
+            def f():
+                with incoq_batch():
+                    return
+            ''')
+        with self.assertRaises(L.ProgramError):
+            BatchRewriter.run(tree, self.manager.namegen, [])
+        
+        # A call could update S ahead of the buffered S.add(1).
+        tree = L.p('''
+            def f():
+                S.remove(1)
+            with incoq_batch():
+                S.add(1)
+                f()
+            ''')
+        with self.assertRaises(L.ProgramError):
+            BatchRewriter.run(tree, self.manager.namegen, [])
+        
+        tree = L.p('''
+            with incoq_batch():
+                S.add(len(T))
+                g = lambda: f()
+            ''')
+        BatchRewriter.run(tree, self.manager.namegen, [])
+    
     def test_minmax(self):
         tree = L.p('''
             max({1} | {x for x in R} | S)
@@ -189,6 +258,106 @@ class RewriterCase(CentralCase):
             ''')
         
         self.assertEqual(tree, exp_tree)
+    
+    def test_objconstructor(self):
+        obj_types = {'Point': {'x': 'Number', 'y': 'Number'},
+                     'Label': {'x': 'Number', 'text': 'String'}}
+        tree = L.p('''
+            p = Obj()
+            p.x = 1
+            p.y = 2
+            l = Obj()
+            l.x = 3
+            q = Obj()
+            q.z = 4
+            def f():
+                r = Obj()
+                r.text = 'a'
+                r = Obj()
+            ''')
+        tree = ObjConstructorRewriter.run(tree, obj_types)
+        exp_tree = L.p('''
+            p = Point()
+            p.x = 1
+            p.y = 2
+            l = Obj()
+            l.x = 3
+            q = Obj()
+            q.z = 4
+            def f():
+                r = Label()
+                r.text = 'a'
+                r = Obj()
+            ''')
+        self.assertEqual(tree, exp_tree)
+        
+        code = make_obj_classes(obj_types)
+        exp_code = L.pc('''
+            class Label(ObjBase):
+                __slots__ = ('text', 'x')
+            class Point(ObjBase):
+                __slots__ = ('x', 'y')
+            ''')
+        self.assertEqual(code, exp_code)
+    
+    def test_columnarrel(self):
+        tree = L.p('''
+            R = Set()
+            S = Set()
+            def f():
+                R = Set()
+            ''')
+        tree = ColumnarRelRewriter.run(tree, ['R'], ['R', 'S'])
+        exp_tree = L.p('''
+            R = ColumnSet()
+            S = Set()
+            def f():
+                R = Set()
+            ''')
+        self.assertEqual(tree, exp_tree)
+        
+        # Relations initialized some other way can't be converted.
+        tree = L.p('''
+            T = set()
+            def main():
+                R = Set()
+            ''')
+        with self.assertRaises(L.ProgramError):
+            ColumnarRelRewriter.run(tree, ['R'], ['R'])
+        with self.assertRaises(L.ProgramError):
+            ColumnarRelRewriter.run(tree, ['T'], ['T'])
+        
+        # So can relations that aren't input or flattened relations.
+        tree = L.p('''
+            R = Set()
+            ''')
+        with self.assertRaises(L.ProgramError):
+            ColumnarRelRewriter.run(tree, ['R'], ['S'])
+    
+    def test_columnaraggr(self):
+        tree = L.p('''
+            R = Set()
+            print(sum(setmatch(R, 'bu', x)))
+            print(count(setmatch(S, 'bu', x)))
+            print(max(R))
+            ''')
+        tree = ColumnarAggrRewriter.run(tree, ['R'])
+        exp_tree = L.p('''
+            R = Set()
+            print(R.aggregate('sum', 'bu', x))
+            print(count(setmatch(S, 'bu', x)))
+            print(max(R))
+            ''')
+        self.assertEqual(tree, exp_tree)
+        
+        # Relations that won't be converted are left alone.
+        tree = L.p('''
+            def main():
+                R = Set()
+                print(sum(setmatch(R, 'bu', x)))
+            ''')
+        tree2 = ColumnarAggrRewriter.run(tree, ['R'])
+        self.assertEqual(tree2, tree)
 
 
 if __name__ == '__main__':
@@ -151,6 +151,54 @@ class TestComp(CentralCase):
         
         self.assertEqual(tree, exp_tree)
     
+    def test_inc_relcomp_fused(self):
+        self.options.set_opt('fuse_results', True)
+        comp = L.pe('COMP({(x, y) for (x, y) in S}, [x], {})')
+        tree = L.p('''
+            S.add((1, 2))
+            print(COMP)
+            ''', subst={'COMP': comp})
+        tree = inc_relcomp(tree, self.manager, comp, 'Q')
+        
+        exp_tree = L.p('''
+            Q = Map()
+            def _maint_Q_S_add(_e):
+                for (v1_x, v1_y) in COMP({(v1_x, v1_y)
+                        for (v1_x, v1_y) in deltamatch(S, 'bb', _e, 1)},
+                        [], {'_deltaelem': '_e',
+                             '_deltalhs': '(v1_x, v1_y)',
+                             '_deltaop': 'add',
+                             '_deltarel': 'S',
+                             'impl': 'auxonly'}):
+                    Q.imgadd(v1_x, (v1_x, v1_y))
+            
+            def _maint_Q_S_remove(_e):
+                for (v2_x, v2_y) in COMP({(v2_x, v2_y)
+                        for (v2_x, v2_y) in deltamatch(S, 'bb', _e, 1)},
+                        [], {'_deltaelem': '_e',
+                             '_deltalhs': '(v2_x, v2_y)',
+                             '_deltaop': 'remove',
+                             '_deltarel': 'S',
+                             'impl': 'auxonly'}):
+                    Q.imgremove(v2_x, (v2_x, v2_y))
+            
+            with MAINT(Q, 'after', 'S.add((1, 2))'):
+                S.add((1, 2))
+                _maint_Q_S_add((1, 2))
+            print(Q.imglookup(x))
+            ''')
+        
+        self.assertEqual(tree, exp_tree)
+        
+        # Not fused when another query reads the result.
+        tree = L.p('''
+            S.add((1, 2))
+            print(sum(COMP))
+            ''', subst={'COMP': comp})
+        tree = inc_relcomp(tree, self.manager, comp, 'Q')
+        self.assertTrue(L.contains_kinds(tree, ['SetMatch']))
+        self.assertFalse(L.contains_kinds(tree, ['ImgLookup']))
+    
     def test_inc_relcomp_noparams(self):
         comp = L.pe('COMP({(x, y) for (x, y) in S}, [], {})')
         tree = L.p('''
@@ -189,6 +237,63 @@ class TestComp(CentralCase):
         
         self.assertEqual(tree, exp_tree)
     
+    def test_inc_relcomp_change(self):
+        self.options.set_opt('change_maint', True)
+        comp = L.pe('COMP({x for (x, y) in S if y > 0}, [], {})')
+        tree = L.p('''
+            S.remove((a, a.f))
+            S.add((a, b))
+            print(COMP)
+            ''', subst={'COMP': comp})
+        tree = inc_relcomp(tree, self.manager, comp, 'Q')
+        
+        exp_tree = L.p('''
+            Q = RCSet()
+            def _maint_Q_S_add(_e):
+                for (v1_x, v1_y) in COMP({(v1_x, v1_y)
+                        for (v1_x, v1_y) in deltamatch(S, 'bb', _e, 1)
+                        if (v1_y > 0)},
+                        [], {'_deltaelem': '_e',
+                             '_deltalhs': '(v1_x, v1_y)',
+                             '_deltaop': 'add',
+                             '_deltarel': 'S',
+                             'impl': 'auxonly'}):
+                    Q.rcadd(v1_x)
+            
+            def _maint_Q_S_remove(_e):
+                for (v2_x, v2_y) in COMP({(v2_x, v2_y)
+                        for (v2_x, v2_y) in deltamatch(S, 'bb', _e, 1)
+                        if (v2_y > 0)},
+                        [], {'_deltaelem': '_e',
+                             '_deltalhs': '(v2_x, v2_y)',
+                             '_deltaop': 'remove',
+                             '_deltarel': 'S',
+                             'impl': 'auxonly'}):
+                    Q.rcremove(v2_x)
+            
+            def _maint_Q_S_change(_e, _new):
+                for (v3_x, v3_y) in COMP({(v3_x, v3_y)
+                        for (v3_x, v3_y) in deltamatch(S, 'bb', _e, 1)},
+                        [], {'_deltaelem': '_e',
+                             '_deltalhs': '(v3_x, v3_y)',
+                             '_deltaop': 'remove',
+                             '_deltarel': 'S',
+                             'impl': 'auxonly'}):
+                    if (v3_y > 0):
+                        if (not (_new > 0)):
+                            Q.rcremove(v3_x)
+                    elif (_new > 0):
+                        Q.rcadd(v3_x)
+            
+            with MAINT(Q, 'before', 'S.remove((a, a.f))'):
+                _maint_Q_S_change((a, a.f), b)
+                S.remove((a, a.f))
+            S.add((a, b))
+            print(Q)
+            ''')
+        
+        self.assertEqual(tree, exp_tree)
+    
     def test_inc_relcomp_maintcomps(self):
         comp = L.pe('COMP({z for (x, y) in R for (y, z) in S}, [x], {})')
         tree = L.p('''
@@ -90,6 +90,32 @@ class TestOrder(unittest.TestCase):
         order = orderer.get_order(enumerate(self.clauses))
         
         self.assertEqual(order[0], (4, self.clauses[4], set()))
+    
+    def test_index_sharing(self):
+        def ec(source):
+            return EnumClause.from_expr(L.pe(source))
+        clauses = [
+            ec('(x, y) in R'),
+            ec('(y, z) in R'),
+        ]
+        
+        # Without prior indexes, the default order is chosen.
+        orderer = IndexSharingOrderer()
+        order = orderer.get_order(enumerate(clauses), ('x', 'z'))
+        self.assertEqual([i for i, _, _ in order], [0, 1])
+        self.assertEqual(orderer.indexes, {('R', 'bu')})
+        
+        # The tied order that reuses an existing index is preferred.
+        orderer = IndexSharingOrderer()
+        orderer.indexes.add(('R', 'ub'))
+        order = orderer.get_order(enumerate(clauses), ('x', 'z'))
+        self.assertEqual([i for i, _, _ in order], [1, 0])
+        self.assertEqual(orderer.indexes, {('R', 'ub')})
+        
+        # The choice is remembered.
+        orderer.indexes.add(('R', 'bu'))
+        order2 = orderer.get_order(enumerate(clauses), ('z', 'x'))
+        self.assertIs(order2, order)
 
 
 if __name__ == '__main__':
@@ -169,6 +169,31 @@ class TestTags(unittest.TestCase):
         self.assertEqual(tree, exp_tree)
         self.assertCountEqual(struct_names, exp_struct_names)
 
+    
+    def test_share_structures(self):
+        shared = {}
+        comps1 = [
+            ('Q_TS', L.pe('COMP({S for S in _U_Q}, [], {})')),
+            ('Q_d_M', L.pe('COMP({(S, x) for S in Q_TS '
+                                         'for (S, x) in _M}, [], {})')),
+        ]
+        for name, comp in comps1:
+            register_structure(shared, name, comp, CF, '_U_Q')
+        
+        comps2 = [
+            ('P_TT', L.pe('COMP({T for T in _U_P}, [], {})')),
+            ('P_d_M', L.pe('COMP({(T, y) for T in P_TT '
+                                         'for (T, y) in _M}, [], {})')),
+            ('P_Ty', L.pe('COMP({y for (T, y) in P_d_M}, [], {})')),
+            ('P_d_F_a', L.pe('COMP({(T, y) for T in P_TT '
+                                           'for (T, y) in _F_a}, [], {})')),
+        ]
+        res = share_structures(comps2, CF, shared, '_U_P')
+        self.assertEqual({name: s.name for name, s in res.items()},
+                         {'P_TT': 'Q_TS', 'P_d_M': 'Q_d_M'})
+        self.assertEqual(res['P_TT'].uset, '_U_Q')
+        self.assertIsNone(res['P_d_M'].uset)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -41,6 +41,18 @@ class StructconvCase(unittest.TestCase):
         exp_tree = BinOp(PatVar('_X'), Add(), Name('b', Load()))
         self.assertEqual(tree, exp_tree)
     
+    def test_parse_cache(self):
+        parse_cache.clear()
+        tree1 = parse_structast('x = A', mode='stmt', subst={'A': Num(1)})
+        tree2 = parse_structast('x = A', mode='stmt', subst={'A': Num(2)})
+        self.assertEqual(tree1, Assign((Name('x', Store()),), Num(1)))
+        self.assertEqual(tree2, Assign((Name('x', Store()),), Num(2)))
+        self.assertEqual((parse_cache.hits, parse_cache.misses), (1, 1))
+        
+        # Parsing as a different mode is a different entry.
+        parse_structast('x = A', mode='code')
+        self.assertEqual(parse_cache.misses, 2)
+    
     def test_unparse(self):
         tree = parse_structast('pass')
         tree = tree._replace(body=(Comment('test'),) + tree.body)
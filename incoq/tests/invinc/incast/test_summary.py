@@ -0,0 +1,93 @@
+"""Unit tests for summary.py."""
+
+
+import unittest
+
+from incoq.compiler.incast.nodes import *
+from incoq.compiler.incast.structconv import parse_structast
+from incoq.compiler.incast.nodeconv import IncLangImporter
+from incoq.compiler.incast.summary import *
+
+
+class SummaryCase(unittest.TestCase):
+    
+    def p(self, source, subst=None, mode=None):
+        return IncLangImporter.run(
+                    parse_structast(source, mode=mode, subst=subst))
+    
+    def test_subtree_kinds(self):
+        tree = self.p('''
+            def f():
+                x = 1
+            S.add(y)
+            ''')
+        self.assertTrue(contains_kinds(tree, ['Num']))
+        self.assertTrue(contains_kinds(tree, ['SetUpdate', 'Comp']))
+        self.assertFalse(contains_kinds(tree, ['Comp']))
+        
+        # Summaries are cached and don't affect equality.
+        func = tree.body[0]
+        self.assertIn('_kinds', func.__dict__)
+        self.assertEqual(func, func._replace())
+        self.assertFalse(contains_kinds(func, ['SetUpdate']))
+    
+    def test_skipping(self):
+        class Finder(SkippingNodeVisitor):
+            def process(self, tree):
+                self.visited = []
+                self.found = []
+                super().process(tree)
+                return self.visited, self.found
+            def node_visit(self, node):
+                self.visited.append(node.__class__.__name__)
+                return super().node_visit(node)
+            def visit_Num(self, node):
+                self.found.append(node.n)
+        
+        tree = self.p('''
+            def f():
+                x = y
+            def g():
+                return 1
+            ''')
+        visited, found = Finder.run(tree)
+        self.assertEqual(found, [1])
+        # f's body was skipped.
+        self.assertNotIn('Assign', visited)
+        
+        class Trans(SkippingNodeTransformer):
+            def visit_Num(self, node):
+                return node._replace(n=node.n + 1)
+        
+        tree2 = Trans.run(tree)
+        self.assertIs(tree2.body[0], tree.body[0])
+        self.assertEqual(tree2.body[1], self.p('''
+            def g():
+                return 2
+            ''').body[0])
+    
+    def test_struct_hash(self):
+        tree1 = self.p('x = {a for a in S}')
+        tree2 = self.p('x = {a for a in S}')
+        tree3 = self.p('x = {a for a in T}')
+        self.assertIsNot(tree1, tree2)
+        self.assertEqual(struct_hash(tree1), struct_hash(tree2))
+        self.assertNotEqual(struct_hash(tree1), struct_hash(tree3))
+    
+    def test_query_hashes(self):
+        tree = self.p('''
+            def f():
+                x = {a for a in S}
+            y = sum({b for b in T})
+            ''')
+        comp1 = self.p('{a for a in S}', mode='expr')
+        comp2 = self.p('{b for b in T}', mode='expr')
+        aggr = self.p('sum({b for b in T})', mode='expr')
+        self.assertEqual(query_hashes(tree),
+                         {struct_hash(comp1), struct_hash(comp2),
+                          struct_hash(aggr)})
+        self.assertEqual(query_hashes(tree.body[0]), {struct_hash(comp1)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -52,6 +52,19 @@ class ConstraintCase(unittest.TestCase):
         s = str(store['S'])
         exp_s = '{{{{{{{{{{Top}}}}}}}}}}'
         self.assertEqual(s, exp_s)
+    
+    def test_program4(self):
+        # Types flow backwards into an earlier function, which is
+        # only re-analyzed once x changes.
+        tree = self.p('''
+            def f():
+                y = x
+            x = 1
+            z = 'a'
+            ''')
+        tree, store = analyze_types(tree)
+        self.assertEqual(store['y'], numbertype)
+        self.assertEqual(store['z'], strtype)
 
 
 if __name__ == '__main__':
@@ -27,6 +27,12 @@ class UtilCase(unittest.TestCase):
     def pe(self, source, **kargs):
         return self.p(source, mode='expr', **kargs)
     
+    def test_count_nodes(self):
+        # Assign, two Names, and their contexts.
+        code = self.pc('x = y')
+        self.assertEqual(count_nodes(code), 5)
+        self.assertEqual(count_nodes(code + code), 10)
+    
     def test_usedvars(self):
         tree = self.p('''
             a = b
@@ -192,6 +198,16 @@ class UtilCase(unittest.TestCase):
         exp_tree = Expr(q2)
         self.assertEqual(tree, exp_tree)
     
+    def test_outerquerychecker(self):
+        q1 = Aggregate(self.pe('a'), 'count', {})
+        q2 = Aggregate(self.pe('b'), 'count', {})
+        
+        tree = self.pc('x = Q1; y = Q2', subst={'Q1': q1, 'Q2': q2})
+        self.assertTrue(OuterQueryChecker.run(tree, q1))
+        tree = self.pc('x = Q1 + 1; y = {z for z in R if Q1 > z}',
+                       subst={'Q1': q1})
+        self.assertFalse(OuterQueryChecker.run(tree, q1))
+    
     def test_query_mapper(self):
         q1 = Aggregate(self.p('a'), 'count', {})
         q2 = Aggregate(self.p('a'), 'sum', {})
@@ -474,6 +490,55 @@ class UtilCase(unittest.TestCase):
                 return True
             ''')
         self.assertEqual(code, exp_code)
+    
+    def test_deltalogger(self):
+        code = DeltaLogger.make_logvar('Q', 10)
+        exp_code = self.pc('''
+            _DL_Q = DeltaLog('Q', 10)
+            ''')
+        self.assertEqual(code, exp_code)
+        
+        tree = self.pc('''
+            if (x, y) not in Q:
+                Q.add((x, y))
+            else:
+                Q.incref((x, y))
+            Q.remove(f(x))
+            R.add(x)
+            ''')
+        tree = DeltaLogger.run(tree, 'Q', '_v1')
+        exp_tree = self.pc('''
+            if (x, y) not in Q:
+                Q.add((x, y))
+                _DL_Q.publish('add', (x, y))
+            else:
+                Q.incref((x, y))
+            _v1delem = f(x)
+            Q.remove(_v1delem)
+            _DL_Q.publish('remove', _v1delem)
+            R.add(x)
+            ''')
+        self.assertEqual(tree, exp_tree)
+    
+    def test_defermaker(self):
+        maker = DeferMaker('Q')
+        
+        code = maker.make_init(100)
+        exp_code = self.pc('''
+            _PD_Q = PendingDeltas(100)
+            ''')
+        self.assertEqual(code, exp_code)
+        
+        code = maker.make_defer('R', 'add', self.pe('(x, y)'),
+                                '_maint_Q_R_add')
+        exp_code = self.pc('''
+            _PD_Q.defer('R', 'add', (x, y), _maint_Q_R_add)
+            ''')
+        self.assertEqual(code, exp_code)
+        
+        code = maker.make_flushed(self.pe('(x,)'))
+        exp_code = self.pe('_PD_Q.flushed((x,))')
+        self.assertEqual(code, exp_code)
 
 
 if __name__ == '__main__':
@@ -106,6 +106,35 @@ class TestAuxmap(CentralCase):
         
         self.assertEqual(tree, exp_tree)
     
+    def test_inc_relmatch_containers(self):
+        self.options.set_opt('obj_containers', True)
+        spec = AuxmapSpec('_M', Mask('ub'))
+        
+        tree = L.p('''
+            _M.add((s, o))
+            print(setmatch(_M, 'ub', o))
+            ''')
+        
+        tree = inc_relmatch(tree, self.manager, spec)
+        
+        exp_tree = L.p('''
+            _m__M_in = Map()
+            def _maint__m__M_in_add(_e):
+                (v1_1, v1_2) = _e
+                addcontainer(v1_2, v1_1, _m__M_in)
+            
+            def _maint__m__M_in_remove(_e):
+                (v2_1, v2_2) = _e
+                removecontainer(v2_2, v2_1, _m__M_in)
+            
+            with MAINT(_m__M_in, 'after', '_M.add((s, o))'):
+                _M.add((s, o))
+                _maint__m__M_in_add((s, o))
+            print(getcontainers(o, _m__M_in))
+            ''')
+        
+        self.assertEqual(tree, exp_tree)
+    
     def test_queryfinder(self):
         code = L.p('''
             print(setmatch(R, 'bu', a))
@@ -0,0 +1,171 @@
+"""Unit tests for the columnar module."""
+
+
+import unittest
+import pickle
+
+from incoq.runtime import *
+from incoq.runtime.columnar import HAVE_NUMPY
+
+
+class TestColumnar(unittest.TestCase):
+    
+    def setUp(self):
+        self.R = ColumnSet()
+        self.R.update([(1, 'a', 1), (1, 'b', 2), (2, 'a', 2),
+                       (3, 'c', 3), (3, (4, 5), 3)])
+    
+    def test_basic(self):
+        R = self.R
+        self.assertEqual(len(R), 5)
+        self.assertEqual(R.arity, 3)
+        self.assertIn((1, 'b', 2), R)
+        self.assertNotIn((1, 'b', 3), R)
+        self.assertNotIn((1, 'z', 3), R)
+        self.assertNotIn((1, 'b'), R)
+        
+        R.add((1, 'b', 2))
+        self.assertEqual(len(R), 5)
+        R.remove((1, 'a', 1))
+        self.assertEqual(set(R), {(1, 'b', 2), (2, 'a', 2),
+                                  (3, 'c', 3), (3, (4, 5), 3)})
+        R.remove((3, (4, 5), 3))
+        R.add((1, 'a', 1))
+        self.assertIn((1, 'a', 1), R)
+        self.assertEqual(len(R), 4)
+        
+        with self.assertRaises(KeyError):
+            R.remove((5, 'a', 1))
+        with self.assertRaises(TypeError):
+            R.add((1, 2))
+        with self.assertRaises(TypeError):
+            ColumnSet().add(1)
+        
+        R.clear()
+        self.assertEqual(len(R), 0)
+        self.assertEqual(set(R), set())
+    
+    def check_match(self, match):
+        R = self.R
+        self.assertEqual(match('buu', 1), {('a', 1), ('b', 2)})
+        self.assertEqual(match('ubu', 'a'), {(1, 1), (2, 2)})
+        self.assertEqual(match('ubu', (4, 5)), {(3, 3)})
+        self.assertEqual(match('bbu', (1, 'b')), {2})
+        self.assertEqual(match('uu1', ()), {(1, 'a'), (2, 'a'),
+                                             (3, 'c'), (3, (4, 5))})
+        self.assertEqual(match('bwu', 3), {3})
+        self.assertEqual(match('bbb', (2, 'a', 2)), {()})
+        self.assertEqual(match('bbb', (2, 'a', 3)), set())
+        self.assertEqual(match('buu', 4), set())
+        self.assertEqual(match('buu', 'z'), set())
+        self.assertEqual(match('uuu', ()), set(R))
+    
+    def test_setmatch(self):
+        self.check_match(lambda mask, key: setmatch(self.R, mask, key))
+    
+    def test_match_python(self):
+        R = self.R
+        def match(mask, key):
+            parsed = R._parse_mask(mask, key)
+            return R._match_python(*parsed) if parsed else Set()
+        self.check_match(match)
+    
+    @unittest.skipUnless(HAVE_NUMPY, 'NumPy not available')
+    def test_match_numpy(self):
+        R = self.R
+        def match(mask, key):
+            parsed = R._parse_mask(mask, key)
+            return R._match_numpy(*parsed) if parsed else Set()
+        self.check_match(match)
+        
+        # Growing after a match must not be blocked by stale views.
+        R.add((4, 'd', 4))
+        self.assertEqual(setmatch(R, 'buu', 4), {('d', 4)})
+    
+    def test_aggregate(self):
+        R = self.R
+        self.assertEqual(R.aggregate('count', 'buu', 3), 2)
+        self.assertEqual(R.aggregate('count', 'bwu', 3), 1)
+        self.assertEqual(R.aggregate('count', 'buu', 4), 0)
+        self.assertEqual(R.aggregate('sum', 'bwu', 1), 3)
+        self.assertEqual(R.aggregate('sum', 'wbu', 'a'), 3)
+        self.assertEqual(R.aggregate('max', 'bwu', 1), 2)
+        self.assertEqual(R.aggregate('min', 'ubw', 'a'), 1)
+        self.assertEqual(R.aggregate('sum', 'uww', ()), 6)
+        self.assertEqual(R.aggregate('max', 'wbu', (4, 5)), 3)
+        with self.assertRaises(ValueError):
+            R.aggregate('max', 'bwu', 4)
+        with self.assertRaises(TypeError):
+            R.aggregate('sum', 'bub', (1, 1))
+        
+        # Results are kept up to date across updates.
+        groups = R.aggregate_map('sum', 'bwu')
+        self.assertEqual(groups, {1: 3, 2: 2, 3: 3})
+        R.add((1, 'd', 4))
+        self.assertEqual(R.aggregate('sum', 'bwu', 1), 7)
+        R.remove((1, 'd', 4))
+        self.assertEqual(R.aggregate('sum', 'bwu', 1), 3)
+        R.remove((1, 'a', 1))
+        self.assertEqual(R.aggregate_map('sum', 'bwu'), {1: 2, 2: 2, 3: 3})
+        self.assertEqual(R.aggregate_map('count', 'bu1'), {2: 1, 3: 2})
+        R.clear()
+        self.assertEqual(R.aggregate_map('count', 'bww'), {})
+    
+    def test_aggregate_types(self):
+        R = ColumnSet()
+        R.update([(1, 1), (1, 2), (2, 1.5), (2, 2.5), (3, 1), (3, 0.5),
+                  (4, 2 ** 70), (4, 1)])
+        groups = R.aggregate_map('sum', 'bu')
+        self.assertEqual(groups, {1: 3, 2: 4.0, 3: 1.5, 4: 2 ** 70 + 1})
+        self.assertIsInstance(groups[1], int)
+        self.assertIsInstance(groups[2], float)
+        self.assertEqual(R.aggregate_map('max', 'bu'),
+                         {1: 2, 2: 2.5, 3: 1, 4: 2 ** 70})
+    
+    def test_aggregate_mixed(self):
+        # A group whose values can't be aggregated only affects
+        # its own key.
+        R = ColumnSet()
+        R.update([(1, 1), (1, 5), (2, 'x'), (3, 'y'), (3, 2)])
+        self.assertEqual(R.aggregate('sum', 'bu', 1), 6)
+        self.assertEqual(R.aggregate('max', 'bu', 1), 5)
+        self.assertEqual(R.aggregate('max', 'bu', 2), 'x')
+        with self.assertRaises(TypeError):
+            R.aggregate('sum', 'bu', 3)
+        with self.assertRaises(TypeError):
+            R.aggregate('min', 'bu', 3)
+        with self.assertRaises(TypeError):
+            R.aggregate_map('sum', 'bu')
+        R.remove((3, 'y'))
+        self.assertEqual(R.aggregate_map('min', 'bu'), {1: 1, 2: 'x', 3: 2})
+    
+    def test_aggregate_incremental(self):
+        # Updates only recompute the aggregates of the keys they
+        # affect, in time proportional to their images.
+        R = ColumnSet()
+        R.update((i % 1000, i) for i in range(200000))
+        self.assertEqual(R.aggregate('sum', 'bu', 7),
+                         sum(range(7, 200000, 1000)))
+        entry = R._groups['bu']
+        for i in range(200):
+            R.add((7, -i))
+            R.remove((8, 8 + 1000 * i))
+            self.assertEqual(len(entry[4]['sum']), 0 if i == 0 else 1)
+            R.aggregate('sum', 'bu', 7)
+            R.aggregate('sum', 'bu', 9)
+        self.assertEqual(R.aggregate('sum', 'bu', 7),
+                         sum(range(7, 200000, 1000)) - sum(range(200)))
+        self.assertEqual(R.aggregate('count', 'bu', 8), 0)
+        self.assertEqual(R.aggregate('sum', 'bu', 8), 0)
+        self.assertEqual(set(R.aggregate_map('count', 'bu').values()),
+                         {200, 400})
+    
+    def test_pickle(self):
+        R2 = pickle.loads(pickle.dumps(self.R))
+        self.assertIsInstance(R2, ColumnSet)
+        self.assertEqual(set(R2), set(self.R))
+        self.assertEqual(setmatch(R2, 'buu', 2), {('a', 2)})
+
+
+if __name__ == '__main__':
+    unittest.main()
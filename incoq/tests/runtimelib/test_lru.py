@@ -21,6 +21,14 @@ class TestLRU(unittest.TestCase):
         s.add(4)
         s.ping(3)
         self.assertEqual(s.peek(), 4)
+    
+    def test_ping_order(self):
+        s = LRUTracker()
+        s.add(1)
+        s.add(2)
+        s.add(3)
+        s.ping(1)
+        self.assertEqual([s.pop(), s.pop(), s.pop()], [2, 3, 1])
 
 
 if __name__ == '__main__':
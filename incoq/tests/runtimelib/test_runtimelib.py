@@ -10,7 +10,15 @@ import unittest
 import pickle
 
 from incoq.runtime import *
-from incoq.runtime.runtimelib import tupify
+from incoq.runtime.runtimelib import (tupify, typetag, TAG_NONE, TAG_OBJ,
+                                     TAG_SET, TAG_RCSET, TAG_MAP)
+
+
+class Point(ObjBase):
+    __slots__ = ('x', 'y')
+
+class Tagged(Point):
+    __slots__ = ('_label',)
 
 
 class TestRuntimelib(unittest.TestCase):
@@ -42,6 +50,67 @@ class TestRuntimelib(unittest.TestCase):
         exp_res3 = {(1, 2), (1, 3), (2, 3)}
         self.assertEqual(res3, exp_res3)
     
+    def test_setmatch_indexed(self):
+        rel = Set({(1, 2), (1, 3), (2, 3), 'foo', (1, 4, 5), (4, 4)})
+        self.assertEqual(setmatch(rel, 'bu', 1), {2, 3})
+        self.assertEqual(setmatch(rel, 'u1', ()), {4})
+        self.assertEqual(setmatch(rel, 'bw', 1), {()})
+        self.assertEqual(type(rel).__name__, 'Set')
+        
+        # Results are not aliased to the index.
+        res = setmatch(rel, 'bu', 1)
+        res.add(9)
+        self.assertEqual(setmatch(rel, 'bu', 1), {2, 3})
+        
+        # Single updates patch the indexes.
+        rel.add((1, 6))
+        rel.remove((1, 2))
+        rel.discard((7, 7))
+        self.assertEqual(setmatch(rel, 'bu', 1), {3, 6})
+        rel.remove((1, 3))
+        self.assertEqual(setmatch(rel, 'bw', 1), {()})
+        rel.remove((1, 6))
+        self.assertEqual(setmatch(rel, 'bw', 1), set())
+        self.assertEqual(setmatch(rel, 'bu', 1), set())
+        
+        # Bulk updates invalidate them.
+        rel.update({(1, 7), (5, 5)})
+        self.assertEqual(setmatch(rel, 'bu', 1), {7})
+        self.assertEqual(setmatch(rel, 'u1', ()), {4, 5})
+        rel -= {(1, 7)}
+        self.assertEqual(setmatch(rel, 'bu', 1), set())
+        rel.clear()
+        self.assertEqual(setmatch(rel, 'u1', ()), set())
+        
+        # Subclasses keep their behavior.
+        rel = LRUSet()
+        rel.add((1, 2))
+        rel.add((1, 3))
+        self.assertEqual(setmatch(rel, 'bu', 1), {2, 3})
+        rel.remove((1, 2))
+        self.assertEqual(setmatch(rel, 'bu', 1), {3})
+        self.assertEqual(rel.peek(), (1, 3))
+        with self.assertRaises(AssertionError):
+            rel.add((1, 3))
+        
+        # discard() only changes the M-set, as for a plain MSet.
+        M = MSet()
+        s = Set()
+        M.add((s, 1))
+        M.add((s, 2))
+        self.assertEqual(setmatch(M, 'bu', s), {1, 2})
+        M.discard((s, 1))
+        self.assertIn(1, s)
+        self.assertEqual(setmatch(M, 'bu', s), {2})
+    
+    def test_setmatch_indexed_pickle(self):
+        rel = Set({(1, 2), (1, 3)})
+        setmatch(rel, 'bu', 1)
+        rel2 = pickle.loads(pickle.dumps(rel))
+        self.assertIs(type(rel2), Set)
+        self.assertEqual(rel2, {(1, 2), (1, 3)})
+        self.assertEqual(setmatch(rel2, 'bu', 1), {2, 3})
+    
     def test_minmax(self):
         self.assertEqual(max2(3, 5, 2), 5)
         self.assertEqual(max2(None, 5, None), 5)
@@ -70,6 +139,162 @@ class TestRuntimelib(unittest.TestCase):
         with self.assertRaises(AssertionError):
             s3.remove(1)
     
+    def test_containers(self):
+        fallback = Map()
+        o = Obj()
+        s1 = Set()
+        s2 = Set()
+        
+        addcontainer(o, s1, fallback)
+        self.assertEqual(list(getcontainers(o, fallback)), [s1])
+        addcontainer(o, s2, fallback)
+        self.assertCountEqual(getcontainers(o, fallback), [s1, s2])
+        removecontainer(o, s1, fallback)
+        self.assertCountEqual(getcontainers(o, fallback), [s2])
+        removecontainer(o, s2, fallback)
+        self.assertCountEqual(getcontainers(o, fallback), [])
+        
+        # The slot isn't part of the object's fields.
+        addcontainer(o, s1, fallback)
+        self.assertNotIn('_containers', o.__dict__)
+        self.assertEqual(len(fallback), 0)
+        
+        # The index survives pickling, together with the sets.
+        o.name = 'o'
+        s1.add(o)
+        o2, s1b = pickle.loads(pickle.dumps((o, s1)))
+        self.assertEqual(o2.name, 'o')
+        self.assertIn(o2, s1b)
+        self.assertNotIn('_containers', o2.__dict__)
+        self.assertEqual(list(getcontainers(o2, fallback)), [s1b])
+        removecontainer(o2, s1b, fallback)
+        self.assertCountEqual(getcontainers(o2, fallback), [])
+        removecontainer(o, s1, fallback)
+        s1.remove(o)
+        
+        p = Point()
+        addcontainer(p, s1, fallback)
+        addcontainer(p, s2, fallback)
+        p2, s1b, s2b = pickle.loads(pickle.dumps((p, s1, s2)))
+        self.assertCountEqual(getcontainers(p2, fallback), [s1b, s2b])
+        self.assertEqual(p2.get_field_names(), ['x', 'y'])
+        
+        # Non-objects use the fallback map.
+        addcontainer(1, s1, fallback)
+        self.assertCountEqual(getcontainers(1, fallback), [s1])
+        removecontainer(1, s1, fallback)
+        self.assertCountEqual(getcontainers(1, fallback), [])
+        self.assertEqual(len(fallback), 0)
+    
+    def test_deltalog(self):
+        log = DeltaLog('Q', 2)
+        seen = []
+        log.subscribe(lambda op, elem: seen.append((op, elem)))
+        pos0 = log.pos
+        log.publish('add', 1)
+        pos1, changes = log.since(pos0)
+        self.assertEqual(changes, [('add', 1)])
+        log.publish('add', 2)
+        log.publish('remove', 1)
+        self.assertEqual(log.since(pos1),
+                         (3, [('add', 2), ('remove', 1)]))
+        self.assertEqual(log.since(3), (3, []))
+        with self.assertRaises(ValueError):
+            log.since(pos0)
+        self.assertEqual(seen, [('add', 1), ('add', 2), ('remove', 1)])
+    
+    def test_pendingdeltas(self):
+        log = []
+        def f(tag):
+            return lambda elem: log.append((tag, elem))
+        pd = PendingDeltas(3)
+        
+        pd.defer('R', 'add', 1, f('R+'))
+        pd.defer('R', 'add', 2, f('R+'))
+        pd.defer('R', 'remove', 1, f('R-'))
+        self.assertEqual(len(pd), 1)
+        self.assertEqual(log, [])
+        
+        # Switching operands flushes.
+        pd.defer('S', 'remove', 5, f('S-'))
+        self.assertEqual(log, [('R+', 2)])
+        
+        # Reaching the limit flushes.
+        pd.defer('S', 'add', 6, f('S+'))
+        pd.defer('S', 'add', 7, f('S+'))
+        self.assertEqual(log, [('R+', 2), ('S-', 5), ('S+', 6), ('S+', 7)])
+        
+        pd.defer('S', 'remove', 6, f('S-'))
+        self.assertEqual(pd.flushed('x'), 'x')
+        self.assertEqual(log[-1], ('S-', 6))
+        self.assertEqual(len(pd), 0)
+    
+    def test_batch(self):
+        S = Set()
+        o = Obj()
+        o.f = 1
+        m = Map({1: 'a'})
+        b = Batch()
+        
+        # Cancelled updates.
+        b.setupdate(0, None, 'add', 1)
+        b.setupdate(0, None, 'remove', 1)
+        b.delfield(1, o, 'f')
+        b.assignfield(1, o, 'f', 1)
+        b.assignkey(2, m, 2, 'b')
+        b.delkey(2, m, 2)
+        # Net updates.
+        b.setupdate(0, S, 'add', 2)
+        b.setupdate(0, S, 'remove', 2)
+        b.setupdate(0, S, 'add', 2)
+        b.assignfield(1, o, 'g', 5)
+        b.delfield(1, o, 'f')
+        b.assignfield(1, o, 'f', 3)
+        b.delkey(2, m, 1)
+        
+        self.assertEqual(list(b.net()), [
+            (1, 'del', o, 'f', None),
+            (1, 'assign', o, 'f', 3),
+            (0, 'add', S, 2, None),
+            (1, 'assign', o, 'g', 5),
+            (2, 'del', m, 1, None),
+        ])
+        self.assertEqual(len(b), 0)
+        
+        b = Batch(strict=False)
+        b.setupdate(0, None, 'remove', 1)
+        b.setupdate(0, None, 'add', 1)
+        self.assertEqual(list(b.net()), [(0, 'add', None, 1, None)])
+        
+        with incoq_batch():
+            S.add(3)
+        self.assertIn(3, S)
+    
+    def test_querycache(self):
+        calls = []
+        def f(x, y):
+            calls.append((x, y))
+            return x + y
+        c = QueryCache(2)
+        
+        self.assertEqual(c.call(f, 1, 2), 3)
+        self.assertEqual(c.call(f, 1, 2), 3)
+        self.assertEqual(calls, [(1, 2)])
+        
+        c.invalidate()
+        self.assertEqual(c.call(f, 1, 2), 3)
+        self.assertEqual(calls, [(1, 2), (1, 2)])
+        
+        # Least recently used entries are evicted.
+        c.call(f, 3, 4)
+        c.call(f, 1, 2)
+        c.call(f, 5, 6)
+        self.assertEqual(len(c), 2)
+        del calls[:]
+        c.call(f, 1, 2)
+        c.call(f, 3, 4)
+        self.assertEqual(calls, [(3, 4)])
+    
     def test_pickle(self):
         o1 = Obj()
         o1.a = 'a'
@@ -102,6 +327,43 @@ class TestRuntimelib(unittest.TestCase):
         m2 = pickle.loads(b)
         self.assertEqual(m1.get(1, None), 2)
         self.assertEqual(m2.get(1, None), 2)
+    
+    def test_typetag(self):
+        self.assertEqual(typetag(Obj()), TAG_OBJ)
+        self.assertEqual(typetag(Point()), TAG_OBJ)
+        self.assertEqual(typetag(Set()), TAG_SET)
+        self.assertEqual(typetag(LRUSet()), TAG_SET)
+        self.assertEqual(typetag(RCSet()), TAG_RCSET)
+        self.assertEqual(typetag(Map()), TAG_MAP)
+        self.assertEqual(typetag(set()), TAG_NONE)
+        self.assertEqual(typetag(1), TAG_NONE)
+    
+    def test_objbase(self):
+        p1 = Point()
+        p1.x = 1
+        self.assertFalse(hasattr(p1, '__dict__'))
+        self.assertFalse(hasattr(p1, 'y'))
+        with self.assertRaises(AttributeError):
+            p1.z = 3
+        self.assertEqual(p1.get_field_names(), ['x', 'y'])
+        
+        b = pickle.dumps(p1)
+        p2 = pickle.loads(b)
+        self.assertEqual(p2.x, 1)
+        self.assertFalse(hasattr(p2, 'y'))
+        
+        S = Set()
+        S.add(p1)
+        addcontainer(p1, S, Map())
+        self.assertEqual(set(getcontainers(p1, Map())), {S})
+        
+        # Fields may start with an underscore.
+        t1 = Tagged()
+        t1.x = 1
+        t1._label = 'a'
+        self.assertEqual(t1.get_field_names(), ['_label', 'x', 'y'])
+        t2 = pickle.loads(pickle.dumps(t1))
+        self.assertEqual(t2._label, 'a')
 
 
 if __name__ == '__main__':
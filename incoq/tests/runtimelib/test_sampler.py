@@ -0,0 +1,110 @@
+"""Unit tests for the sampler module."""
+
+
+import unittest
+import os
+import tempfile
+
+from incoq.runtime import *
+
+
+class TestSampler(unittest.TestCase):
+    
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+    
+    def tearDown(self):
+        os.remove(self.filename)
+    
+    def test_manual(self):
+        ns = {'R': Set(), 'M': Map(), 'x': 5}
+        sampler = SizeSampler(ns, self.filename)
+        sampler.sample()
+        ns['R'].add(1)
+        ns['R'].add(2)
+        ns['M'][1] = Set({3})
+        ns['C'] = RCSet()
+        sampler.stop()
+        
+        samples = read_size_samples(self.filename)
+        self.assertEqual(len(samples), 2)
+        (t1, sizes1, bytes1), (t2, sizes2, bytes2) = samples
+        self.assertLessEqual(t1, t2)
+        self.assertEqual(sizes1, {'R': 0, 'M': 0})
+        self.assertEqual(sizes2, {'R': 2, 'M': 2, 'C': 0})
+        self.assertIsNone(bytes1)
+        self.assertIsNone(bytes2)
+    
+    def test_deep(self):
+        ns = {'R': Set()}
+        sampler = SizeSampler(ns, self.filename, deep=True)
+        sampler.sample()
+        ns['R'].update((i, str(i)) for i in range(100))
+        sampler.stop()
+        
+        (_, _, bytes1), (_, _, bytes2) = read_size_samples(self.filename)
+        self.assertGreater(bytes2['R'], bytes1['R'])
+    
+    def test_structure_bytes(self):
+        o = Obj()
+        s1 = Set({(o, 1)})
+        s2 = Set({(o, 1)})
+        # Type instances inside a structure aren't counted.
+        o.data = list(range(1000))
+        self.assertLess(get_structure_bytes(s1), 1000)
+        # Shared values are counted once.
+        seen = set()
+        b1 = get_structure_bytes(s1, seen)
+        b2 = get_structure_bytes(s1, seen)
+        self.assertGreater(b1, 0)
+        self.assertEqual(b2, 0)
+        self.assertGreater(get_structure_bytes(s2, seen), 0)
+    
+    def test_thread(self):
+        ns = {'R': Set()}
+        with SizeSampler(ns, self.filename, interval=0.001):
+            for i in range(20000):
+                ns['R'].add(i)
+        samples = read_size_samples(self.filename)
+        self.assertEqual(samples[-1][1], {'R': 20000})
+    
+    def test_mutation(self):
+        class Changing(Set):
+            def __init__(self, msg):
+                super().__init__()
+                self.msg = msg
+            def get_structure_size(self):
+                raise RuntimeError(self.msg)
+        
+        # Samples are skipped if a structure keeps changing.
+        ns = {'R': Set(), 'C': Changing('Set changed size during '
+                                        'iteration')}
+        sampler = SizeSampler(ns, self.filename)
+        sampler.sample()
+        del ns['C']
+        sampler.stop()
+        samples = read_size_samples(self.filename)
+        self.assertEqual([sizes for _, sizes, _ in samples], [{'R': 0}])
+        
+        # Other errors are not retried.
+        ns = {'C': Changing('other')}
+        sampler = SizeSampler(ns, self.filename)
+        with self.assertRaises(RuntimeError):
+            sampler.sample()
+        del ns['C']
+        sampler.stop()
+    
+    def test_truncated(self):
+        ns = {'R': Set()}
+        sampler = SizeSampler(ns, self.filename)
+        sampler.sample()
+        sampler.stop()
+        with open(self.filename, 'ab') as file:
+            file.write(b'S\x00\x00')
+        samples = read_size_samples(self.filename)
+        self.assertEqual(len(samples), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Unit tests for the snapshot module."""
+
+
+import unittest
+import os
+import tempfile
+
+from incoq.runtime import *
+from incoq.runtime.runtimelib import HAVE_TREES
+
+
+class TestSnapshot(unittest.TestCase):
+    
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+    
+    def tearDown(self):
+        os.remove(self.filename)
+    
+    def roundtrip(self, ns):
+        n = save_snapshot(ns, self.filename)
+        ns2 = {}
+        names = load_snapshot(ns2, self.filename)
+        self.assertEqual(n, len(names))
+        return ns2
+    
+    def test_basic(self):
+        R = Set({(1, 2), (1, 'a'), (2, 3.5), (None, True),
+                 (2**100, -2**70, b'x', frozenset({1, 2}))})
+        M = Map()
+        M[1] = Set({2, 3})
+        M[(1, 2)] = Set()
+        C = RCSet()
+        C.add((1, 2))
+        C.incref((1, 2))
+        ns = {'R': R, 'M': M, 'C': C, 'x': 5}
+        
+        ns2 = self.roundtrip(ns)
+        self.assertEqual(set(ns2), {'R', 'M', 'C'})
+        self.assertIsInstance(ns2['R'], Set)
+        self.assertEqual(set(ns2['R']), set(R))
+        self.assertIsInstance(ns2['M'], Map)
+        self.assertEqual(set(ns2['M']), set(M))
+        self.assertIsInstance(ns2['M'][1], Set)
+        self.assertEqual(set(ns2['M'][1]), {2, 3})
+        self.assertIsInstance(ns2['C'], RCSet)
+        self.assertEqual(ns2['C'].getref((1, 2)), 2)
+    
+    def test_identity(self):
+        o1 = Obj()
+        o2 = Obj()
+        o1.f = o2
+        o2.f = o1
+        s = Set({o1})
+        _M = MSet({(s, o1)})
+        _F_f = FSet('f')
+        _F_f.update({(o1, o2), (o2, o1)})
+        ns = {'o1': o1, 's': s, '_M': _M, '_F_f': _F_f}
+        
+        ns2 = self.roundtrip(ns)
+        o1, s, _M, _F_f = ns2['o1'], ns2['s'], ns2['_M'], ns2['_F_f']
+        self.assertIs(o1.f.f, o1)
+        self.assertIn(o1, s)
+        self.assertEqual(set(_M), {(s, o1)})
+        self.assertEqual(_F_f.field, 'f')
+        self.assertEqual(set(_F_f), {(o1, o1.f), (o1.f, o1)})
+    
+    def test_dedup(self):
+        o = Obj()
+        R = Set((o, i) for i in range(100))
+        ns = {'R1': R, 'R2': Set(R), 'R3': Set(R)}
+        save_snapshot({'R1': R}, self.filename)
+        size1 = os.path.getsize(self.filename)
+        save_snapshot(ns, self.filename)
+        size3 = os.path.getsize(self.filename)
+        # The extra sets only cost one reference per element.
+        self.assertLess(size3 - size1, 2 * 100 * 4 * 2)
+    
+    def test_lru(self):
+        s = LRUSet()
+        s.add(1)
+        s.add(2)
+        s.add(3)
+        s.ping(1)
+        ns2 = self.roundtrip({'s': s})
+        s2 = ns2['s']
+        self.assertEqual(set(s2), {1, 2, 3})
+        self.assertEqual(s2.peek(), 2)
+    
+    @unittest.skipUnless(HAVE_TREES, 'bintrees not available')
+    def test_tree(self):
+        t = Tree()
+        t[3] = None
+        t[1] = None
+        ns2 = self.roundtrip({'t': Map({1: t})})
+        self.assertEqual(ns2['t'][1].__min__(), 1)
+    
+    def test_indexed(self):
+        R = Set({(1, 2), (1, 3)})
+        setmatch(R, 'bu', 1)
+        ns2 = self.roundtrip({'R': R})
+        R2 = ns2['R']
+        self.assertIs(type(R2), Set)
+        self.assertFalse(hasattr(R2, '_indexes'))
+        self.assertEqual(setmatch(R2, 'bu', 1), {2, 3})
+    
+    def test_columns(self):
+        R = ColumnSet()
+        R.update([(1, 'a'), (2, 'b'), (3, 'a')])
+        R.remove((2, 'b'))
+        E = ColumnSet(2)
+        ns2 = self.roundtrip({'R': R, 'E': E})
+        R2 = ns2['R']
+        self.assertIsInstance(R2, ColumnSet)
+        self.assertEqual(set(R2), {(1, 'a'), (3, 'a')})
+        self.assertEqual(setmatch(R2, 'ub', 'a'), {1, 3})
+        self.assertEqual(ns2['E'].arity, 2)
+    
+    def test_unsupported(self):
+        with self.assertRaises(TypeError):
+            save_snapshot({'R': Set({(1, len)})}, self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
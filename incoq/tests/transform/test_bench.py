@@ -0,0 +1,64 @@
+"""Unit tests for the bench module."""
+
+
+import unittest
+
+from incoq.transform.bench import stage_totals, compare_bench
+
+
+class BenchCase(unittest.TestCase):
+    
+    def test_stage_totals(self):
+        stats = {'stages': [('parse', 1.0, 0, 0), ('inc', 2.0, 0, 0),
+                            ('parse', 0.5, 0, 0)]}
+        self.assertEqual(stage_totals(stats), {'parse': 1.5, 'inc': 2.0})
+        self.assertEqual(stage_totals({}), {})
+    
+    def test_threshold(self):
+        baseline = {'a': {'wall time': 1.0, 'peak memory': 100}}
+        
+        # Growth of exactly the threshold is not a regression.
+        results = {'a': {'wall time': 1.25, 'peak memory': 125}}
+        self.assertEqual(compare_bench(results, baseline, threshold=0.25),
+                         [])
+        
+        results = {'a': {'wall time': 1.5, 'peak memory': 126}}
+        self.assertEqual(compare_bench(results, baseline, threshold=0.25),
+                         [('a', 'wall time', 1.0, 1.5),
+                          ('a', 'peak memory', 100, 126)])
+    
+    def test_min_time(self):
+        baseline = {'a': {'wall time': 0.01}}
+        results = {'a': {'wall time': 0.04}}
+        self.assertEqual(compare_bench(results, baseline, min_time=0.05),
+                         [])
+        # Only one run needs to be above min_time.
+        results = {'a': {'wall time': 0.06}}
+        self.assertEqual(compare_bench(results, baseline, min_time=0.05),
+                         [('a', 'wall time', 0.01, 0.06)])
+        
+        # min_time doesn't apply to memory.
+        baseline = {'a': {'wall time': 0.01, 'peak memory': 10}}
+        results = {'a': {'wall time': 0.01, 'peak memory': 20}}
+        self.assertEqual(compare_bench(results, baseline),
+                         [('a', 'peak memory', 10, 20)])
+    
+    def test_missing(self):
+        # Missing metrics and zero baselines are skipped.
+        baseline = {'a': {'wall time': 1.0},
+                    'b': {'wall time': 0, 'peak memory': 0}}
+        results = {'a': {'wall time': 2.0, 'peak memory': 100},
+                   'b': {'wall time': 1.0, 'peak memory': 100}}
+        self.assertEqual(compare_bench(results, baseline),
+                         [('a', 'wall time', 1.0, 2.0)])
+        
+        results = {'a': {'peak memory': 100}}
+        self.assertEqual(compare_bench(results, baseline), [])
+        
+        # So are entries not in the baseline.
+        results = {'c': {'wall time': 5.0, 'peak memory': 100}}
+        self.assertEqual(compare_bench(results, baseline), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
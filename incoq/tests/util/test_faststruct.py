@@ -0,0 +1,81 @@
+"""Unit tests for the faststruct module."""
+
+
+import unittest
+import pickle
+
+from simplestruct import Struct, Field, TypedField
+
+from incoq.util.faststruct import *
+
+
+class Point(Struct):
+    x = TypedField(int)
+    y = TypedField(int, default=0)
+
+class Poly(Struct):
+    name = Field()
+    points = TypedField(Point, seq=True)
+    origin = TypedField(Point, or_none=True)
+    
+    def __init__(self, name, points, origin):
+        self.size = len(self.points)
+
+class Checked(Struct):
+    x = TypedField(int)
+
+enable_fast_construction([Point, Poly])
+
+class SubPoint(Point):
+    x = TypedField(int)
+    y = TypedField(int)
+
+
+class FastStructCase(unittest.TestCase):
+    
+    def test_construct(self):
+        p = Point(1, 2)
+        self.assertEqual(p, Point(x=1, y=2))
+        self.assertEqual(hash(p), hash(Point(1, 2)))
+        self.assertEqual(Point(1), Point(1, 0))
+        with self.assertRaises(AttributeError):
+            p.x = 5
+        
+        # Normalization still happens, and __init__() still runs.
+        poly = Poly('a', [Point(1, 2)], (0, 0))
+        self.assertEqual(poly.points, (Point(1, 2),))
+        self.assertEqual(poly.origin, Point(0, 0))
+        self.assertEqual(poly.size, 1)
+        
+        self.assertEqual(pickle.loads(pickle.dumps(poly)), poly)
+    
+    def test_replace(self):
+        p = Point(1, 2)
+        self.assertEqual(p._replace(y=3), Point(1, 3))
+        with self.assertRaises(TypeError):
+            p._replace(z=3)
+        
+        poly = Poly('a', [], None)
+        poly2 = poly._replace(points=[Point(1)])
+        self.assertEqual(poly2.points, (Point(1),))
+        self.assertEqual(poly2.size, 1)
+    
+    def test_checking(self):
+        # Type checks are skipped...
+        Point('a')
+        # ...except for classes without fast construction...
+        with self.assertRaises(TypeError):
+            Checked('a')
+        with self.assertRaises(TypeError):
+            SubPoint('a', 'b')
+        # ...or when checking is turned on.
+        old = set_checking(True)
+        try:
+            with self.assertRaises(TypeError):
+                Point('a')
+        finally:
+            set_checking(old)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,3 +5,5 @@
 from .statsdb import *
 from .schema import *
 from .trans import *
+from .server import *
+from .bench import *
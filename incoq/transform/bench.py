@@ -0,0 +1,245 @@
+"""Benchmark the throughput of the compiler itself.
+
+    python -m incoq.transform.bench [options]
+
+Every test program (incoq/tests/programs/**/*_in.py) and experiment
+input (experiments/**/*_in.py) is compiled under each of a list of
+TaskTemplates. For each combination we record the wall time, the peak
+memory allocated during the transformation, and the per-stage
+breakdown from the compiler's stats. Results are stored in a StatsDB,
+one entry per program and template, and can be compared against a
+baseline StatsDB from an earlier run to flag regressions.
+"""
+
+
+__all__ = [
+    'BENCH_TEMPLATES',
+    'find_bench_programs',
+    'bench_task',
+    'run_bench',
+    'compare_bench',
+]
+
+
+import os
+import gc
+import sys
+import time
+import argparse
+import tracemalloc
+from fnmatch import fnmatch
+
+from incoq.compiler.central import transform_source
+
+from .statsdb import StatsDB, Session
+from .trans import (Task, task_from_template,
+                    AUX, INC, INC_SUBDEM, DEM, DEM_OBJ, DEM_INLINE,
+                    DEM_SINGLE_TAG, DEM_NORCELIM)
+
+
+BENCH_TEMPLATES = [
+    AUX,
+    INC,
+    INC_SUBDEM,
+    DEM,
+    DEM_OBJ,
+    DEM_INLINE,
+    DEM_SINGLE_TAG,
+    DEM_NORCELIM,
+]
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def find_bench_programs(root=ROOT):
+    """Return a sorted list of paths, relative to root, of the input
+    programs to benchmark.
+    """
+    result = []
+    for top in [os.path.join('incoq', 'tests', 'programs'), 'experiments']:
+        for dirpath, _dirnames, filenames in os.walk(os.path.join(root, top)):
+            for fn in filenames:
+                if fn.endswith('_in.py'):
+                    path = os.path.join(dirpath, fn)
+                    result.append(os.path.relpath(path, root))
+    return sorted(result)
+
+def bench_task(task, *, repeat=1, memory=True):
+    """Compile a task's input without writing any output. Return a
+    stats dictionary with the compiler's stats for the fastest of
+    repeat runs, plus entries 'wall time' (seconds) and, if memory is
+    True, 'peak memory' (bytes, measured in a separate run). Return
+    None if the transformation fails.
+    """
+    with open(task.input_name, 'r') as in_file:
+        source = in_file.read()
+    
+    best = None
+    try:
+        for _ in range(repeat):
+            gc.collect()
+            t1 = time.perf_counter()
+            _, manager = transform_source(source, nopts=task.nopts,
+                                          qopts=task.qopts)
+            t2 = time.perf_counter()
+            if best is None or t2 - t1 < best['wall time']:
+                best = dict(manager.stats)
+                best['wall time'] = t2 - t1
+        
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                transform_source(source, nopts=task.nopts, qopts=task.qopts)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            best['peak memory'] = peak
+    except Exception as exc:
+        print('  failed: {}: {}'.format(type(exc).__name__, exc))
+        return None
+    
+    return best
+
+def run_bench(programs, templates, *, repeat=1, memory=True, root=ROOT):
+    """Benchmark each program under each template. Return a dictionary
+    from entry names to stats, omitting failed transformations.
+    """
+    results = {}
+    for prog in programs:
+        base = prog[:-len('_in.py')]
+        for template in templates:
+            task = Task(base, os.path.join(root, prog),
+                        os.path.join(root, base + '.py'), {}, {})
+            task = task_from_template(task, template)
+            nopts = dict(task.nopts)
+            nopts['verbose'] = False
+            task = task._replace(nopts=nopts)
+            name = '{} [{}]'.format(base, template.__name__)
+            
+            print('==== Bench {} ===='.format(name))
+            stats = bench_task(task, repeat=repeat, memory=memory)
+            if stats is not None:
+                results[name] = stats
+    return results
+
+def stage_totals(stats):
+    """Return a map from stage name to total time in a stats dict."""
+    totals = {}
+    for stage, t, _, _ in stats.get('stages', []):
+        totals[stage] = totals.get(stage, 0) + t
+    return totals
+
+def compare_bench(results, baseline, *, threshold=0.1, min_time=0.05):
+    """Compare benchmark results against baseline results. Return a
+    list of regressions, as tuples of the entry name, the metric, the
+    baseline value, and the new value. A metric regresses if it grows
+    by more than the fraction threshold. Wall times below min_time
+    seconds in both runs are too noisy to compare and are ignored.
+    """
+    regressions = []
+    for name in sorted(results):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        new = results[name]
+        for metric in ['wall time', 'peak memory']:
+            v1 = old.get(metric)
+            v2 = new.get(metric)
+            if v1 is None or v2 is None or v1 == 0:
+                continue
+            if metric == 'wall time' and max(v1, v2) < min_time:
+                continue
+            if v2 > v1 * (1 + threshold):
+                regressions.append((name, metric, v1, v2))
+    return regressions
+
+
+def print_summary(session, results):
+    """Print per-entry results and per-stage totals."""
+    rows = [[name, '{:.3f}'.format(s['wall time']),
+             '{:.1f}'.format(s['peak memory'] / 2**20)
+                if 'peak memory' in s else '-',
+             s.get('lines', '-')]
+            for name, s in sorted(results.items())]
+    session.print_table(['Entry', 'Wall (s)', 'Peak (MiB)', 'LOC'], rows)
+    
+    totals = {}
+    for stats in results.values():
+        for stage, t in stage_totals(stats).items():
+            totals[stage] = totals.get(stage, 0) + t
+    grand = sum(totals.values())
+    rows = [[stage, '{:.3f}'.format(t),
+             '{:.1%}'.format(t / grand) if grand else '-']
+            for stage, t in sorted(totals.items(), key=lambda x: -x[1])]
+    print()
+    session.print_table(['Stage', 'Total (s)', '%'], rows)
+
+def print_regressions(session, regressions, results, baseline):
+    """Print regressions, with the stages that slowed down most."""
+    rows = []
+    for name, metric, v1, v2 in regressions:
+        if metric == 'wall time':
+            old_stages = stage_totals(baseline[name])
+            new_stages = stage_totals(results[name])
+            worst = max(new_stages,
+                        key=lambda s: new_stages[s] - old_stages.get(s, 0),
+                        default='-')
+            fmt = '{:.3f}'
+        else:
+            worst = '-'
+            fmt = '{:.0f}'
+        rows.append([name, metric, fmt.format(v1), fmt.format(v2),
+                     '{:+.1%}'.format(v2 / v1 - 1), worst])
+    session.print_table(['Entry', 'Metric', 'Baseline', 'New', 'Change',
+                         'Slowest stage'], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench.py')
+    parser.add_argument('--out', default='stats/benchstats.pickle',
+                        help='StatsDB file to store results in')
+    parser.add_argument('--baseline', default=None,
+                        help='StatsDB file with baseline results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fractional increase that counts as a '
+                             'regression')
+    parser.add_argument('--templates', default=None,
+                        help='comma-separated template names')
+    parser.add_argument('--filter', default='*',
+                        help='glob pattern on program paths')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the peak memory measurement')
+    ns = parser.parse_args()
+    
+    templates = BENCH_TEMPLATES
+    if ns.templates is not None:
+        byname = {t.__name__: t for t in BENCH_TEMPLATES}
+        templates = [byname[n] for n in ns.templates.split(',')]
+    programs = [p for p in find_bench_programs() if fnmatch(p, ns.filter)]
+    
+    results = run_bench(programs, templates, repeat=ns.repeat,
+                        memory=not ns.no_memory)
+    
+    statsdb = StatsDB(ns.out)
+    statsdb.allstats = results
+    statsdb.save()
+    session = Session(statsdb)
+    print()
+    print_summary(session, results)
+    
+    if ns.baseline is not None:
+        baseline = StatsDB(ns.baseline).allstats
+        regressions = compare_bench(results, baseline,
+                                    threshold=ns.threshold)
+        print()
+        if regressions:
+            print_regressions(session, regressions, results, baseline)
+            sys.exit(1)
+        else:
+            print('No regressions against ' + ns.baseline)
+
+
+if __name__ == '__main__':
+    main()
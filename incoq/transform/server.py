@@ -0,0 +1,271 @@
+"""A long-running compile server, and a watch mode, that keep the
+compiler imported and its caches warm across transformations.
+
+    python -m incoq.transform.server [--host HOST] [--port PORT]
+
+Clients send Tasks over a local socket and get back the stats
+dictionary. The server only listens on loopback addresses. Each run
+generates a fresh authentication key and stores it in a file that
+only the user can read (see key_filename()), where clients on the
+same machine pick it up. The server also keeps the compile record of each task's
+previous transformation in memory (see incoq.compiler.central
+.incremental), so re-sending a task whose input barely changed is
+cheap.
+"""
+
+
+__all__ = [
+    'DEFAULT_ADDRESS',
+    'key_filename',
+    'CompileServer',
+    'CompileClient',
+    'watch_tasks',
+]
+
+
+import os
+import time
+import socket
+import argparse
+import ipaddress
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from incoq.compiler.incast import print_exc_with_ast
+from incoq.compiler.central import transform_source_incremental
+
+from .statsdb import StatsDB
+
+
+DEFAULT_ADDRESS = ('localhost', 7431)
+
+
+def key_filename(address):
+    """Return the path of the file holding the authentication key
+    of the server at the given address.
+    """
+    return os.path.join(os.path.expanduser('~'),
+                        '.incoq_server_{}.key'.format(address[1]))
+
+def is_loopback(host):
+    """Return whether every address host resolves to is a loopback
+    address.
+    """
+    try:
+        infos = socket.getaddrinfo(host, None)
+        return all(ipaddress.ip_address(info[4][0]).is_loopback
+                   for info in infos)
+    except (OSError, ValueError):
+        return False
+
+def write_key(filename, key):
+    """Write key to a new file that only the user can access."""
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with open(fd, 'wb') as file:
+        file.write(key)
+
+
+class CompileServer:
+    
+    """Serve transformation requests one at a time. Requests and
+    replies are tuples whose first component names the operation:
+    
+        ('transform', task) -> ('ok', stats) or ('error', message)
+        ('ping',)           -> ('ok', None)
+        ('stop',)           -> ('ok', None), and the server exits
+    
+    Messages are pickled, so anyone who can authenticate can run
+    arbitrary code as the server's user. The address must therefore
+    be a loopback address, and the key is random unless given.
+    """
+    
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        if not is_loopback(address[0]):
+            raise ValueError('Compile server must listen on a loopback '
+                             'address, not ' + repr(address[0]))
+        if authkey is None:
+            authkey = os.urandom(32)
+        self.address = address
+        self.authkey = authkey
+        self.records = {}
+        """Map from output filename to the compile record of its last
+        transformation.
+        """
+    
+    def run_task(self, task):
+        """Transform a task's input file and write its output file,
+        reusing the previous record for the same output. Return the
+        stats.
+        """
+        with open(task.input_name, 'r') as in_file:
+            source = in_file.read()
+        
+        record = self.records.get(task.output_name)
+        out_source, stats, record = transform_source_incremental(
+                    source, record, nopts=task.nopts, qopts=task.qopts)
+        self.records[task.output_name] = record
+        
+        eol = {'lf': '\n', 'crlf': '\r\n', 'native': None}[record.eol]
+        with open(task.output_name, 'w', newline=eol) as out_file:
+            out_file.write(out_source)
+        return stats
+    
+    def handle(self, request):
+        """Return the reply to a request."""
+        op = request[0]
+        if op == 'transform':
+            task = request[1]
+            print('==== Serving {} ===='.format(task.display_name))
+            try:
+                return ('ok', self.run_task(task))
+            except Exception:
+                print_exc_with_ast()
+                return ('error', traceback.format_exc())
+        elif op in ['ping', 'stop']:
+            return ('ok', None)
+        else:
+            return ('error', 'Unknown request: ' + repr(op))
+    
+    def serve_forever(self):
+        """Accept connections until a stop request is received.
+        The key file is written once the address is bound, and
+        removed on exit.
+        """
+        with Listener(self.address, authkey=self.authkey) as listener:
+            keyfile = key_filename(self.address)
+            write_key(keyfile, self.authkey)
+            try:
+                print('Compile server listening on {}:{}'.format(
+                      *self.address))
+                self.accept_loop(listener)
+            finally:
+                os.remove(keyfile)
+    
+    def accept_loop(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError):
+                # Ignore clients without the key.
+                continue
+            with conn:
+                while True:
+                    # A dropped client only ends its own connection.
+                    try:
+                        request = conn.recv()
+                        conn.send(self.handle(request))
+                    except (EOFError, OSError):
+                        break
+                    if request[0] == 'stop':
+                        return
+
+
+class CompileClient:
+    
+    """Connection to a compile server. Can be used as a context
+    manager. If authkey is not given, it is read from the server's
+    key file.
+    """
+    
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        if authkey is None:
+            with open(key_filename(address), 'rb') as file:
+                authkey = file.read()
+        self.conn = Client(address, authkey=authkey)
+    
+    def request(self, *request):
+        self.conn.send(request)
+        return self.conn.recv()
+    
+    def transform(self, task):
+        """Run a task on the server. Return its stats, or None if the
+        transformation failed, as for run_task().
+        """
+        status, result = self.request('transform', task)
+        if status != 'ok':
+            print(result)
+            return None
+        return result
+    
+    def stop(self):
+        """Shut down the server."""
+        self.request('stop')
+    
+    def close(self):
+        self.conn.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def watch_tasks(tasks, path, *, interval=1.0, server=None):
+    """Transform each task whenever its input file changes, updating
+    the stats database at path after each round. Tasks without an
+    output file are ignored. If server is given, it is the address of
+    a compile server to use; otherwise the compiler runs in this
+    process. Runs until interrupted.
+    """
+    tasks = [t for t in tasks if t.output_name is not None]
+    statsdb = StatsDB(path)
+    mtimes = {}
+    
+    if server is not None:
+        client = CompileClient(server)
+    else:
+        client = None
+        local = CompileServer()
+    try:
+        while True:
+            changed = False
+            for t in tasks:
+                try:
+                    mtime = os.stat(t.input_name).st_mtime
+                except OSError:
+                    continue
+                if mtimes.get(t.display_name) == mtime:
+                    continue
+                mtimes[t.display_name] = mtime
+                
+                if client is not None:
+                    stats = client.transform(t)
+                else:
+                    status, stats = local.handle(('transform', t))
+                    if status != 'ok':
+                        stats = None
+                if stats is not None:
+                    statsdb.allstats[t.display_name] = stats
+                    changed = True
+            if changed:
+                statsdb.save()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if client is not None:
+            client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='server.py')
+    parser.add_argument('--host', default=DEFAULT_ADDRESS[0],
+                        help='loopback address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    ns = parser.parse_args()
+    
+    try:
+        server = CompileServer((ns.host, ns.port))
+    except ValueError as exc:
+        parser.error(str(exc))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
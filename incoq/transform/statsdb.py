@@ -107,6 +107,73 @@ class Session(BaseSession):
     def cmd_switch(self, name):
         self.ns['stats'] = self.ns['allstats'][name]
     
+    def get_stats(self, name=None):
+        if name is not None:
+            return self.ns['allstats'][name]
+        else:
+            return self.ns['stats']
+    
+    def print_table(self, headers, rows):
+        if HAVE_TABULATE:
+            print(tabulate(rows, headers, tablefmt='grid'))
+        else:
+            rows = [headers] + rows
+            widths = [max(len(str(row[i])) for row in rows)
+                      for i in range(len(headers))]
+            for row in rows:
+                print('  '.join('{:<{}}'.format(str(c), w)
+                                for c, w in zip(row, widths)))
+    
+    def cmd_showstages(self, name=None):
+        """Show the time and tree size of each transformation stage."""
+        stages = self.get_stats(name).get('stages', [])
+        total = sum(t for _, t, _, _ in stages)
+        rows = [[stage, '{:.3f}'.format(t),
+                 '{:.1%}'.format(t / total) if total else '-',
+                 before, after]
+                for stage, t, before, after in stages]
+        self.print_table(['Stage', 'Time', '%', 'Nodes in', 'Nodes out'],
+                         rows)
+    
+    def cmd_showqueries(self, name=None, top=None):
+        """Show the time taken to transform each query, slowest first."""
+        times = self.get_stats(name).get('query times', [])
+        times = sorted(times, key=lambda x: x[2], reverse=True)
+        if top is not None:
+            times = times[:top]
+        rows = [[qname, impl, '{:.3f}'.format(t)]
+                for qname, impl, t in times]
+        self.print_table(['Query', 'Impl', 'Time'], rows)
+    
+    def cmd_comparestages(self, name1, name2):
+        """Compare the stage times of two entries, e.g. the same
+        program transformed by two versions of the compiler. Stages
+        are matched by name and by order of occurrence.
+        """
+        def keyed(stages):
+            result = {}
+            order = []
+            for stage, t, _, _ in stages:
+                key = (stage, sum(1 for k in order if k[0] == stage))
+                order.append(key)
+                result[key] = t
+            return order, result
+        
+        order1, times1 = keyed(self.get_stats(name1).get('stages', []))
+        order2, times2 = keyed(self.get_stats(name2).get('stages', []))
+        order = order1 + [k for k in order2 if k not in times1]
+        rows = []
+        for key in order:
+            t1 = times1.get(key)
+            t2 = times2.get(key)
+            if t1 is not None and t2 is not None:
+                delta = '{:+.3f}'.format(t2 - t1)
+            else:
+                delta = '-'
+            fmt = lambda t: '-' if t is None else '{:.3f}'.format(t)
+            rows.append([key[0], fmt(t1), fmt(t2), delta])
+        self.print_table(['Stage', name1, name2, 'Change'], rows)
+    
     def cmd_showcosts(self, name=None):
         if name is not None:
             stats = self.ns['allstats'][name]
@@ -38,6 +38,7 @@ from incoq.compiler.incast import print_exc_with_ast
 from incoq.compiler.central import transform_file
 
 from .statsdb import StatsDB
+from .server import CompileClient
 
 
 class Task(Struct):
@@ -56,7 +57,7 @@ class Task(Struct):
     """Query options."""
 
 
-def run_task(task):
+def run_task(task, client=None):
     # Dummy case for generating a stats entry for an input file's LOC.
     if task.output_name is None:
         in_loc = get_loc_file(task.input_name)
@@ -68,6 +69,9 @@ def run_task(task):
     print('==== Task {:30}{} -> {} ===='.format(
             task.display_name + ': ', input_name, output_name))
     
+    if client is not None:
+        return client.transform(task)
+    
     try:
         stats = transform_file(task.input_name, task.output_name,
                                nopts=task.nopts, qopts=task.qopts)
@@ -77,18 +81,25 @@ def run_task(task):
         return None
 
 
-def do_tasks(tasks, path):
+def do_tasks(tasks, path, *, server=None):
     """Run a sequence of transformation tasks, updating the
-    stats database. Return the time elapsed.
+    stats database. Return the time elapsed. If server is given,
+    it is the address of a compile server (see server.py) to send
+    the tasks to.
     """
     t1 = clock()
     statsdb = StatsDB(path)
     statsdb.load()
     
-    for t in tasks:
-        cur_stats = run_task(t)
-        if cur_stats is not None:
-            statsdb.allstats[t.display_name] = cur_stats
+    client = CompileClient(server) if server is not None else None
+    try:
+        for t in tasks:
+            cur_stats = run_task(t, client)
+            if cur_stats is not None:
+                statsdb.allstats[t.display_name] = cur_stats
+    finally:
+        if client is not None:
+            client.close()
     
     statsdb.save()
     t2 = clock()
@@ -0,0 +1,183 @@
+"""Fast construction for simplestruct Structs.
+
+Constructing a Struct normally binds the arguments against an
+inspect.Signature twice and sends each field value through its
+descriptor, which for TypedFields means a dynamic type check. For
+classes that are instantiated in large numbers, such as AST nodes and
+comprehension clauses, this dominates the cost of transformations.
+
+enable_fast_construction() gives a Struct class a generated
+constructor that writes field values directly into the instance
+dictionary. TypedField normalizations (converting sequences to
+tuples and coercing tuples to Structs) are still applied, but type
+checks are not. Instances are indistinguishable from normally
+constructed ones. Checks can be turned back on globally with
+set_checking(), or by setting the environment variable
+INCOQ_CHECK_STRUCTS before import.
+"""
+
+
+__all__ = [
+    'enable_fast_construction',
+    'fast_struct',
+    'set_checking',
+]
+
+
+import os
+import keyword
+
+from simplestruct import Struct, Field, TypedField, MetaStruct
+
+
+_checking = bool(os.environ.get('INCOQ_CHECK_STRUCTS'))
+
+def set_checking(enabled):
+    """Set whether Structs are constructed with full checking, even
+    if they have fast construction enabled. Return the previous
+    setting.
+    """
+    global _checking
+    old = _checking
+    _checking = bool(enabled)
+    return old
+
+
+# Fast construction is hooked into instantiation by replacing the
+# class's metaclass with a subclass of it that overrides __call__().
+# One such subclass is made per original metaclass.
+
+_fast_metas = {}
+
+def _get_fast_meta(meta):
+    if meta in _fast_metas.values():
+        return meta
+    fast_meta = _fast_metas.get(meta)
+    if fast_meta is None:
+        def __call__(cls, *args, **kargs):
+            fast = cls.__dict__.get('_fast_new')
+            if fast is None or _checking:
+                return super(fast_meta, cls).__call__(*args, **kargs)
+            return fast(cls, *args, **kargs)
+        fast_meta = type('Fast' + meta.__name__, (meta,),
+                         {'__call__': __call__,
+                          '__module__': __name__})
+        _fast_metas[meta] = fast_meta
+    return fast_meta
+
+
+def _fast_replace(self, **kargs):
+    """Version of Struct._replace() that uses fast construction."""
+    cls = type(self)
+    fast = cls.__dict__.get('_fast_new')
+    if fast is None or _checking:
+        return Struct._replace(self, **kargs)
+    d = self.__dict__
+    values = [kargs.pop(f.name, d[f.name]) if kargs else d[f.name]
+              for f in cls._struct]
+    if kargs:
+        raise TypeError('Error constructing {}: unexpected keyword '
+                        'argument(s) {}'.format(
+                        cls.__name__, ', '.join(kargs)))
+    return fast(cls, *values)
+
+
+def _make_normalizer(field):
+    """Return a function that applies field's normalization to a
+    value, or None if no normalization is needed.
+    """
+    if type(field) is Field:
+        return None
+    assert isinstance(field, TypedField)
+    or_none = field.or_none
+    if field.seq:
+        # TypedASTField (from iast) leaves metasyntactic nodes alone.
+        keep_meta = hasattr(field, 'quant')
+        def normalize(value):
+            if type(value) is tuple:
+                return value
+            if or_none and value is None:
+                return value
+            if keep_meta and getattr(value, '_meta', False):
+                return value
+            return tuple(value)
+        return normalize
+    kind = field.kind
+    if (len(kind) == 1 and isinstance(kind[0], type) and
+        issubclass(kind[0], Struct)):
+        kind = kind[0]
+        def normalize(value):
+            if isinstance(value, tuple):
+                return kind(*value)
+            return value
+        return normalize
+    return None
+
+def _is_eligible(cls):
+    # A class-specific __new__() may preprocess arguments, and other
+    # kinds of fields may have arbitrary __set__() behavior. Field
+    # names become parameter names of the generated constructor, so
+    # they must not clash with its local names.
+    if cls.__new__ is not Struct.__new__:
+        return False
+    return all((type(f) is Field or isinstance(f, TypedField)) and
+               not f.name.startswith('_') and
+               not keyword.iskeyword(f.name)
+               for f in cls._struct)
+
+def _make_fast_new(cls):
+    """Generate the fast constructor for cls."""
+    fields = cls._struct
+    names = [f.name for f in fields]
+    env = {'_object_new': object.__new__}
+    
+    params = []
+    for i, f in enumerate(fields):
+        if f.has_default:
+            env['_d{}'.format(i)] = f.default
+            params.append('{}=_d{}'.format(f.name, i))
+        else:
+            params.append(f.name)
+    
+    has_init = cls.__init__ is not object.__init__
+    lines = ['def _fast_new(_cls, {}):'.format(', '.join(params)),
+             '    _inst = _object_new(_cls)',
+             '    _d = _inst.__dict__',
+             '    _d["_initialized"] = False']
+    for i, f in enumerate(fields):
+        norm = _make_normalizer(f)
+        if norm is None:
+            lines.append('    _d[{0!r}] = {0}'.format(f.name))
+        else:
+            env['_n{}'.format(i)] = norm
+            lines.append('    _d[{0!r}] = _n{1}({0})'.format(f.name, i))
+    if has_init:
+        env['_init'] = cls.__init__
+        lines.append('    _init(_inst, {})'.format(', '.join(names)))
+    lines.append('    _d["_initialized"] = True')
+    lines.append('    return _inst')
+    
+    exec('\n'.join(lines), env)
+    return env['_fast_new']
+
+
+def enable_fast_construction(classes):
+    """Enable fast construction for each of the given Struct classes.
+    Classes with their own __new__() or with other kinds of fields
+    than Field and TypedField are left unchanged. Subclasses do not
+    inherit fast construction.
+    
+    This must be called after the kinds of all TypedFields are
+    finalized.
+    """
+    for cls in classes:
+        if not isinstance(cls, MetaStruct) or not _is_eligible(cls):
+            continue
+        cls.__class__ = _get_fast_meta(type(cls))
+        cls._fast_new = _make_fast_new(cls)
+        cls._replace = _fast_replace
+
+def fast_struct(cls):
+    """Class decorator form of enable_fast_construction()."""
+    enable_fast_construction([cls])
+    return cls
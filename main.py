@@ -6,6 +6,9 @@ from incoq.transform import *
 
 STATS_DIR = 'stats/'
 STATS_FILE = STATS_DIR + 'transstats.pickle'
+# Address of a running compile server (python -m incoq.transform.server)
+# to send tasks to, e.g. DEFAULT_ADDRESS. None to compile in-process.
+SERVER = None
 
 
 all_tasks = []
@@ -317,7 +320,7 @@ for name in test_programs:
     add_task(make_testprogram_task(name))
 
 
-elapsed = do_tasks(all_tasks, STATS_FILE)
+elapsed = do_tasks(all_tasks, STATS_FILE, server=SERVER)
 
 print('Done  ({:.3f} s)'.format(elapsed))
 